@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""Benchmark of encoder profiles for PIL manipulator output.
+
+For each test image, output format and encoder profile in
+iiif.manipulator_pil.ENCODER_PROFILES reports the time to encode and
+the number of bytes of output, for a 512x512 tile and for the full
+image. Run from the top level directory of the repository:
+
+    python docs/benchmark_encoder_profiles.py [image ...]
+"""
+import io
+import sys
+import time
+
+from PIL import Image
+
+sys.path.insert(0, '.')
+from iiif.manipulator_pil import ENCODER_PROFILES  # noqa: E402
+
+IMAGES = ['testimages/starfish_1500x2000.png',
+          'testimages/starfish.jpg']
+FORMATS = ['jpeg', 'png', 'webp']
+
+
+def encode(image, format, options, repeat=3):
+    """Return (seconds, bytes) for best of repeat encodes of image."""
+    best = None
+    for n in range(repeat):
+        buf = io.BytesIO()
+        start = time.time()
+        image.save(buf, format=format, **options)
+        seconds = time.time() - start
+        if (best is None or seconds < best):
+            best = seconds
+    return (best, len(buf.getvalue()))
+
+
+def main(images):
+    """Print table of encode time and bytes for each profile."""
+    print("%-40s %-10s %-5s %-8s %10s %10s" %
+          ('image', 'size', 'fmt', 'profile', 'ms', 'bytes'))
+    for filename in images:
+        source = Image.open(filename).convert('RGB')
+        for (label, image) in (('512x512', source.crop((0, 0, 512, 512))),
+                               ('full', source)):
+            for format in FORMATS:
+                for profile in sorted(ENCODER_PROFILES.keys()):
+                    options = ENCODER_PROFILES[profile].get(format, {})
+                    (seconds, nbytes) = encode(image, format, options)
+                    print("%-40s %-10s %-5s %-8s %10.1f %10d" %
+                          (filename, label, format, profile,
+                           seconds * 1000.0, nbytes))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or IMAGES)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""Benchmark of quality conversions in PIL manipulator.
+
+For each test image converted to each source mode (including 16-bit
+I;16 and I;16B, palette and CMYK) reports the time for do_quality()
+with color, gray and bitonal qualities. For 16-bit images also reports
+the time for the previous conversion via 32-bit mode I. Run from the
+top level directory of the repository:
+
+    python docs/benchmark_quality.py [image ...]
+"""
+import sys
+import time
+
+from PIL import Image
+
+sys.path.insert(0, '.')
+from iiif.manipulator_pil import IIIFManipulatorPIL  # noqa: E402
+
+IMAGES = ['testimages/starfish_1500x2000.png',
+          'testimages/starfish.jpg']
+QUALITIES = ['color', 'gray', 'bitonal']
+
+
+def source_images(filename):
+    """List of (mode, image) for image filename in each source mode."""
+    rgb = Image.open(filename).convert('RGB')
+    gray = rgb.convert('L')
+    # 16-bit images with the gray image as the most significant bytes
+    data = bytearray(2 * gray.size[0] * gray.size[1])
+    (data[0::2], data[1::2]) = (gray.tobytes(), gray.tobytes())
+    images = [('RGB', rgb),
+              ('RGBA', rgb.convert('RGBA')),
+              ('L', gray),
+              ('P', rgb.convert('P', palette=Image.ADAPTIVE)),
+              ('CMYK', rgb.convert('CMYK')),
+              ('I;16', Image.frombytes('I;16', gray.size, bytes(data))),
+              ('I;16B', Image.frombytes('I;16B', gray.size, bytes(data)))]
+    return images
+
+
+def best_time(func, repeat=3):
+    """Best of repeat times for func() in seconds."""
+    best = None
+    for n in range(repeat):
+        start = time.time()
+        func()
+        seconds = time.time() - start
+        if (best is None or seconds < best):
+            best = seconds
+    return best
+
+
+def quality(image, q):
+    """Run do_quality(q) on image."""
+    m = IIIFManipulatorPIL()
+    m.image = image
+    m.do_quality(q)
+
+
+def previous_color(image):
+    """Previous conversion of 16-bit image to RGB via mode I."""
+    image.convert('I').point(lambda i: i * (1.0 / 256.0)).convert('RGB')
+
+
+def main(images):
+    """Print table of conversion times for each mode and quality."""
+    print("%-40s %-6s %-14s %10s" % ('image', 'mode', 'quality', 'ms'))
+    for filename in images:
+        for (mode, image) in source_images(filename):
+            image.load()
+            for q in QUALITIES:
+                seconds = best_time(lambda: quality(image, q))
+                print("%-40s %-6s %-14s %10.1f" %
+                      (filename, mode, q, seconds * 1000.0))
+            if (mode.startswith('I;16')):
+                seconds = best_time(lambda: previous_color(image))
+                print("%-40s %-6s %-14s %10.1f" %
+                      (filename, mode, 'color (via I)', seconds * 1000.0))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or IMAGES)
@@ -0,0 +1,129 @@
+"""Cache of source image dimensions for image information requests.
+
+An image information (info.json) response needs only the width and
+height of the source image, but a viewer will request info.json for
+every image on a page. The DimensionCache keeps the dimensions of each
+source file, keyed by path and checked against the file modification
+time, so that they are read from the image header once. The cache may
+be persisted to a JSON sidecar file so that it stays warm across server
+restarts. New dimensions mark the cache as changed and it is saved at
+most once every save_interval seconds, when dimensions are added, and
+at interpreter exit.
+"""
+
+import atexit
+import json
+import logging
+import os
+import os.path
+import tempfile
+import threading
+from timeit import default_timer
+
+
+class DimensionCache(object):
+    """Thread-safe cache of source image dimensions."""
+
+    def __init__(self, filename=None, save_interval=60.0):
+        """Initialize DimensionCache object.
+
+        Keyword arguments:
+        filename -- JSON sidecar file to load the cache from, and to
+            save the cache to when new dimensions have been added
+        save_interval -- minimum seconds between saves of the sidecar
+            file, which is also saved at exit if changed
+        """
+        self.filename = filename
+        self.save_interval = save_interval
+        self.logger = logging.getLogger(__name__)
+        self._sizes = {}
+        self._dirty = False
+        self._last_save = default_timer()
+        self._lock = threading.Lock()
+        if (self.filename is not None):
+            if (os.path.exists(self.filename)):
+                self.load()
+            atexit.register(self.flush)
+
+    def __len__(self):
+        """Return number of sources in cache."""
+        return len(self._sizes)
+
+    def get(self, path):
+        """Get (width, height) for source file path, or None if not cached.
+
+        Dimensions cached for a different modification time of the file
+        are ignored.
+        """
+        try:
+            mtime = os.path.getmtime(path)
+        except (OSError, TypeError):
+            return None
+        with self._lock:
+            entry = self._sizes.get(os.path.abspath(path))
+        if (entry is None or entry[0] != mtime):
+            return None
+        return (entry[1], entry[2])
+
+    def put(self, path, size):
+        """Add (width, height) for source file path.
+
+        Marks the cache as changed, and saves it to the sidecar file if
+        one is set and save_interval has passed since the last save.
+        """
+        try:
+            mtime = os.path.getmtime(path)
+        except (OSError, TypeError):
+            return
+        with self._lock:
+            self._sizes[os.path.abspath(path)] = [mtime, size[0], size[1]]
+            self._dirty = True
+            due = (default_timer() - self._last_save >= self.save_interval)
+        if (due):
+            self.flush()
+
+    def flush(self):
+        """Save cache to sidecar file if one is set and the cache has changed."""
+        if (self.filename is not None and self._dirty):
+            self.save()
+
+    def load(self):
+        """Load cache from sidecar file.
+
+        A missing or bad sidecar file is logged and otherwise ignored.
+        """
+        try:
+            with open(self.filename, 'r') as fh:
+                sizes = json.load(fh)
+        except (IOError, OSError, ValueError) as e:
+            self.logger.warning("Failed to load dimension cache %s: %s"
+                                % (self.filename, str(e)))
+            return
+        with self._lock:
+            self._sizes.update(sizes)
+
+    def save(self):
+        """Save cache to sidecar file.
+
+        Writes a temporary file in the same directory and then renames it
+        so that a reader never sees a partially written file.
+        """
+        with self._lock:
+            data = json.dumps(self._sizes)
+            self._dirty = False
+            self._last_save = default_timer()
+        dirname = os.path.dirname(os.path.abspath(self.filename))
+        try:
+            (fd, tmpfile) = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        except (IOError, OSError) as e:
+            self.logger.warning("Failed to save dimension cache %s: %s"
+                                % (self.filename, str(e)))
+            return
+        try:
+            with os.fdopen(fd, 'w') as fh:
+                fh.write(data)
+            os.rename(tmpfile, self.filename)
+        except (IOError, OSError) as e:
+            self.logger.warning("Failed to save dimension cache %s: %s"
+                                % (self.filename, str(e)))
+            os.unlink(tmpfile)
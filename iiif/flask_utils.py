@@ -27,6 +27,7 @@ except ImportError:  # pragma: no cover # python2
 
 from iiif.error import IIIFError
 from iiif.request import IIIFRequest, IIIFRequestPathError, IIIFRequestBaseURI
+from iiif.dimension_cache import DimensionCache
 from iiif.info import IIIFInfo
 
 
@@ -93,7 +94,7 @@ def identifiers(config):
     else:
         for image_file in os.listdir(config.image_dir):
             (iid, ext) = os.path.splitext(image_file)
-            if (ext in ['.jpg', '.png', '.tif'] and
+            if (ext in ['.jpg', '.png', '.tif', '.tiff', '.jp2'] and
                     os.path.isfile(os.path.join(config.image_dir, image_file))):
                 ids.append(iid)
     return ids
@@ -192,7 +193,20 @@ def osd_page_handler(config=None, identifier=None, prefix=None, **args):
 
 
 class IIIFHandler(object):
-    """IIIFHandler class."""
+    """IIIFHandler class.
+
+    The class attribute dimension_cache may be set to a
+    iiif.dimension_cache.DimensionCache object, shared by all
+    instances, to cache source image dimensions for image
+    information requests.
+
+    The class attribute pool may be set to a
+    iiif.process_pool.ManipulatorPool object, shared by all instances,
+    to run image manipulations in worker processes.
+    """
+
+    dimension_cache = None
+    pool = None
 
     def __init__(self, prefix, identifier, config, klass, auth):
         """Initialize IIIFHandler setting key configurations.
@@ -217,6 +231,8 @@ class IIIFHandler(object):
         self.iiif = IIIFRequest(api_version=self.api_version,
                                 identifier=self.identifier)
         self.manipulator = klass(api_version=self.api_version)
+        for (name, value) in self.manipulator_settings.items():
+            setattr(self.manipulator, name, value)
         #
         # Set up auth object with locations if not already done
         if (self.auth and not self.auth.login_uri):
@@ -234,6 +250,22 @@ class IIIFHandler(object):
         """Server and prefix from config."""
         return(host_port_prefix(self.config.host, self.config.port, self.prefix))
 
+    @property
+    def manipulator_settings(self):
+        """Dict of manipulator attribute settings from config.
+
+        Encoder profile settings are included for manipulators that
+        support them.
+        """
+        settings = {}
+        if (hasattr(self.klass, 'encoder_profile')):
+            for name in ('encoder_profile', 'encoder_profile_large',
+                         'encoder_large_pixels'):
+                value = getattr(self.config, name, None)
+                if (value is not None):
+                    settings[name] = value
+        return settings
+
     @property
     def json_mime_type(self):
         """Return the MIME type for a JSON response.
@@ -259,7 +291,7 @@ class IIIFHandler(object):
                 if (os.path.isfile(file)):
                     return file
         else:
-            for ext in ['.jpg', '.png', '.tif']:
+            for ext in ['.jpg', '.png', '.tif', '.tiff', '.jp2']:
                 file = os.path.join(self.config.image_dir,
                                     self.identifier + ext)
                 if (os.path.isfile(file)):
@@ -292,9 +324,16 @@ class IIIFHandler(object):
             self.identifier = dr
         else:
             self.logger.info("image_information: %s" % (self.identifier))
-        # get size
+        # get size from image header, or dimension cache
         self.manipulator.srcfile = self.file
-        self.manipulator.do_first()
+        size = None
+        if (self.dimension_cache is not None):
+            size = self.dimension_cache.get(self.manipulator.srcfile)
+        if (size is None):
+            size = self.manipulator.source_size()
+            if (self.dimension_cache is not None and size[0] > 0):
+                self.dimension_cache.put(self.manipulator.srcfile, size)
+        (self.manipulator.width, self.manipulator.height) = size
         # most of info.json comes from config, a few things specific to image
         info = {'tile_height': self.config.tile_height,
                 'tile_width': self.config.tile_width,
@@ -355,7 +394,8 @@ class IIIFHandler(object):
             self.logger.info("image_request: %s" % (self.identifier))
         file = self.file
         self.manipulator.srcfile = file
-        self.manipulator.do_first()
+        if (self.pool is None):
+            self.manipulator.do_first()
         if (self.api_version < '2.0' and
                 self.iiif.format is None and
                 'Accept' in request.headers):
@@ -370,11 +410,27 @@ class IIIFHandler(object):
             # instead?
             if (accept in formats):
                 self.iiif.format = formats[accept]
+        if (self.pool is not None):
+            # Manipulation in worker process, image comes back as bytes
+            (content, mime_type) = self.pool.derive(self.klass, file, self.iiif,
+                                                    self.manipulator_settings)
+            self.add_compliance_header()
+            return self.make_response(content,
+                                      headers={'Content-Type': mime_type,
+                                               'Content-Length': str(len(content))})
+        self.manipulator.in_memory = getattr(self.config, 'encode_in_memory', False)
         (outfile, mime_type) = self.manipulator.derive(file, self.iiif)
+        self.add_compliance_header()
+        if (self.manipulator.outbytes is not None):
+            # Image encoded in memory, send bytes and we are done
+            content = self.manipulator.outbytes
+            self.manipulator.cleanup()
+            return self.make_response(content,
+                                      headers={'Content-Type': mime_type,
+                                               'Content-Length': str(len(content))})
         # FIXME - find efficient way to serve file with headers
         # could this be the answer: https://stackoverflow.com/questions/31554680/how-to-send-header-in-flask-send-file
         # currently no headers are sent with the file
-        self.add_compliance_header()
         return self.make_response(send_file(outfile, mimetype=mime_type))
 
     def error_response(self, e):
@@ -600,6 +656,59 @@ def add_shared_configs(p, base_dir=''):
           help="Tile width")
     p.add('--gauth-client-secret', default=os.path.join(base_dir, 'client_secret.json'),
           help="Name of file with Google auth client secret")
+    p.add('--encode-in-memory', action='store_true',
+          help="Encode derived images in memory instead of writing temporary files")
+    p.add('--image-cache-size', type=int, default=0,
+          help="Size in MB of cache of decoded source images shared between "
+               "requests with manipulator='pil' (default 0, no cache)")
+    p.add('--icc-to-srgb', action='store_true',
+          help="Convert sources with an embedded ICC colour profile to sRGB "
+               "with manipulator='pil'")
+    p.add('--jpegtran', default=None,
+          help="Path of jpegtran command to use for lossless crop and "
+               "rotation of JPEG sources with manipulator='pil' (default "
+               "none, always decode)")
+    p.add('--netpbm-max-pipelines', type=int, default=0,
+          help="Number of netpbm pipelines that may run at once with "
+               "manipulator='netpbm' (default 0, no limit)")
+    p.add('--netpbm-pipeline-timeout', type=float, default=10.0,
+          help="Seconds an image request waits for a netpbm pipeline "
+               "before a 503 response (default 10)")
+    p.add('--netpbm-cache-dir', default=None,
+          help="Directory for cache of decoded PNM sources with "
+               "manipulator='netpbm' (default none, no cache)")
+    p.add('--netpbm-cache-size', type=int, default=1024,
+          help="Size in MB of cache of decoded PNM sources (default 1024)")
+    p.add('--dimension-cache-file', default=None,
+          help="JSON sidecar file to persist the cache of source image "
+               "dimensions used for info.json responses")
+    p.add('--timing-sample-rate', type=float, default=0.0,
+          help="Fraction of image requests for which to log timings of each "
+               "manipulator stage (default 0.0, no timing)")
+    p.add('--encoder-profile', default=None,
+          help="Encoder profile for images with manipulator='pil', one of "
+               "default, fast or small (default default)")
+    p.add('--encoder-profile-large', default=None,
+          help="Encoder profile for large images with manipulator='pil' "
+               "(default same as --encoder-profile)")
+    p.add('--encoder-large-pixels', type=int, default=None,
+          help="Number of pixels at and above which an image is large for "
+               "--encoder-profile-large (default 1048576)")
+    p.add('--process-pool-size', type=int, default=0,
+          help="Number of worker processes to run image manipulations, "
+               "-1 for one per core (default 0, run in request thread)")
+    p.add('--process-pool-maxtasksperchild', type=int, default=None,
+          help="Number of image manipulations after which a worker process "
+               "is replaced (default no limit)")
+    p.add('--process-pool-memory-limit', type=int, default=0,
+          help="Limit in MB on memory of each worker process (default 0, "
+               "no limit)")
+    p.add('--memory-budget', type=int, default=0,
+          help="Budget in MB for the predicted peak memory of image "
+               "manipulations running at once (default 0, no budget)")
+    p.add('--memory-budget-timeout', type=float, default=10.0,
+          help="Seconds an image request waits for memory budget before "
+               "a 503 response (default 10)")
     p.add('--include-osd', action='store_true',
           help="Include a page with OpenSeadragon for each source")
     p.add('--access-cookie-lifetime', type=int, default=3600,
@@ -634,6 +743,24 @@ def add_handler(app, config):
             config.access_cookie_lifetime - number of seconds
             config.access_token_lifetime - number of seconds
             config.auth_type - Auth type string or 'none'
+            config.image_cache_size - MB for decoded image cache or 0
+            config.icc_to_srgb - True to convert colour-managed sources to sRGB
+            config.jpegtran - path of jpegtran command or None
+            config.netpbm_max_pipelines - number of concurrent netpbm pipelines or 0
+            config.netpbm_pipeline_timeout - seconds to wait for a netpbm pipeline
+            config.netpbm_cache_dir - directory for decoded PNM cache or None
+            config.netpbm_cache_size - MB for decoded PNM cache
+            config.dimension_cache_file - sidecar file for dimension cache or None
+            config.timing_sample_rate - fraction of image requests to time
+            config.encoder_profile - encoder profile name or None
+            config.encoder_profile_large - encoder profile for large images or None
+            config.encoder_large_pixels - size for large images or None
+            config.process_pool_size - number of worker processes, -1 for
+                one per core, or 0 to manipulate in request thread
+            config.process_pool_maxtasksperchild - tasks before worker replaced
+            config.process_pool_memory_limit - MB limit for each worker or 0
+            config.memory_budget - MB budget for image manipulations or 0
+            config.memory_budget_timeout - seconds to wait for memory budget
 
     Returns True on success, nothing otherwise.
     """
@@ -665,9 +792,27 @@ def add_handler(app, config):
     if (config.klass_name == 'pil'):
         from iiif.manipulator_pil import IIIFManipulatorPIL
         klass = IIIFManipulatorPIL
+        if (getattr(config, 'image_cache_size', 0) and klass.image_cache is None):
+            from iiif.image_cache import ImageCache
+            klass.image_cache = ImageCache(max_bytes=config.image_cache_size * 1024 * 1024)
+        if (getattr(config, 'icc_to_srgb', False) and klass.icc_transforms is None):
+            from iiif.icc import TransformCache
+            klass.icc_transforms = TransformCache()
+        if (getattr(config, 'jpegtran', None)):
+            klass.jpegtran = config.jpegtran
     elif (config.klass_name == 'netpbm'):
         from iiif.manipulator_netpbm import IIIFManipulatorNetpbm
         klass = IIIFManipulatorNetpbm
+        if (getattr(config, 'netpbm_max_pipelines', 0) and klass.pipeline_limit is None):
+            from iiif.pipeline_limit import PipelineLimit
+            klass.pipeline_limit = PipelineLimit(
+                max_pipelines=config.netpbm_max_pipelines,
+                timeout=getattr(config, 'netpbm_pipeline_timeout', 10.0))
+        if (getattr(config, 'netpbm_cache_dir', None) and klass.pnm_cache is None):
+            from iiif.pnm_cache import PNMCache
+            klass.pnm_cache = PNMCache(
+                directory=config.netpbm_cache_dir,
+                max_bytes=getattr(config, 'netpbm_cache_size', 1024) * 1024 * 1024)
     elif (config.klass_name == 'dummy'):
         from iiif.manipulator import IIIFManipulator
         klass = IIIFManipulator
@@ -677,6 +822,26 @@ def add_handler(app, config):
     else:
         logging.error("Unknown manipulator type %s, ignoring" % (config.klass_name))
         return
+    if (getattr(config, 'timing_sample_rate', 0.0) and klass.stage_timer is None):
+        from iiif.stage_timer import StageTimer, log_timings
+        klass.stage_timer = StageTimer(sample_rate=config.timing_sample_rate,
+                                       sink=log_timings)
+    from iiif.manipulator import IIIFManipulator
+    if (getattr(config, 'memory_budget', 0) and IIIFManipulator.memory_budget is None):
+        from iiif.memory_budget import MemoryBudget
+        IIIFManipulator.memory_budget = MemoryBudget(
+            max_bytes=config.memory_budget * 1024 * 1024,
+            timeout=getattr(config, 'memory_budget_timeout', 10.0))
+    if (IIIFHandler.dimension_cache is None):
+        IIIFHandler.dimension_cache = DimensionCache(
+            filename=getattr(config, 'dimension_cache_file', None))
+    if (getattr(config, 'process_pool_size', 0) and IIIFHandler.pool is None):
+        from iiif.process_pool import ManipulatorPool
+        memory_limit = getattr(config, 'process_pool_memory_limit', 0)
+        IIIFHandler.pool = ManipulatorPool(
+            processes=max(config.process_pool_size, 0),
+            maxtasksperchild=getattr(config, 'process_pool_maxtasksperchild', None),
+            memory_limit=memory_limit * 1024 * 1024)
     base = urljoin('/', config.prefix + '/')  # ensure has trailing slash
     client_base = urljoin('/', config.client_prefix + '/')  # ensure has trailing slash
     logging.warning("Installing %s IIIFManipulator at %s v%s %s" %
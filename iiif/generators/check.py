@@ -5,6 +5,11 @@ square also a repeat, and so on. Each sucessive level is colored
 more and more red
 """
 
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy not installed
+    np = None
+
 
 def _num(x, y):
     """PRIVATE function to return cell number in 3x3 square, 1..9."""
@@ -53,3 +58,28 @@ class PixelGen(object):
             return (red, 0, 0)
         else:
             return None
+
+    def pixels(self, x, y):
+        """Return array of colors for numpy arrays of pixel coordinates.
+
+        Follows the same recursion as pixel() for all pixels at once,
+        level by level, for the pixels that are still in middle squares.
+        """
+        (x, y) = (np.array(x), np.array(y))
+        red = np.zeros(x.shape, dtype=np.int64)
+        colored = np.zeros(x.shape, dtype=bool)
+        middle = np.ones(x.shape, dtype=bool)
+        size = self.sz
+        while (size > 3):
+            divisor = size // 3
+            n = _num(x // divisor, y // divisor)
+            colored |= middle & (n != 5) & (n % 2 == 1)
+            middle &= (n == 5)
+            red = np.where(middle, np.minimum(red + 25, 255), red)
+            (x, y, size) = (x % divisor, y % divisor, divisor)
+        colored |= middle & (_num(x, y) % 2 == 1)
+        colors = np.empty(x.shape + (3,), dtype=np.uint8)
+        colors[...] = self.background_color
+        colors[colored] = np.stack([red[colored], np.zeros_like(red[colored]),
+                                    np.zeros_like(red[colored])], axis=-1)
+        return colors
@@ -1,5 +1,10 @@
 """Image generator for fractal diagonal cross."""
 
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy not installed
+    np = None
+
 
 def _not_diagonal(x, y):
     """PRIVATE function to return element in 3x3 square is diagonal.
@@ -40,3 +45,18 @@ class PixelGen(object):
         if (_not_diagonal(x // divisor, y // divisor)):
             return None
         return self.pixel(x % divisor, y % divisor, divisor)
+
+    def pixels(self, x, y):
+        """Return array of colors for numpy arrays of pixel coordinates."""
+        (x, y) = (np.array(x), np.array(y))
+        black = np.ones(x.shape, dtype=bool)
+        size = self.sz
+        while (size > 3):
+            divisor = size // 3
+            black &= (_not_diagonal(x // divisor, y // divisor) == 0)
+            (x, y, size) = (x % divisor, y % divisor, divisor)
+        black &= (_not_diagonal(x, y) == 0)
+        colors = np.empty(x.shape + (3,), dtype=np.uint8)
+        colors[...] = self.background_color
+        colors[black] = (0, 0, 0)
+        return colors
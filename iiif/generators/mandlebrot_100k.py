@@ -5,6 +5,11 @@ Ref: <http://www.karlsims.com/julia.html>
 
 import cmath
 
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy not installed
+    np = None
+
 
 class PixelGen(object):
     """Pixel generation classfor Mandlebrot set."""
@@ -74,3 +79,30 @@ class PixelGen(object):
         z = complex(x, y)
         self.set_c(z)
         return self.mpixel(z)
+
+    def pixels(self, ix, iy):
+        """Return array of colors for numpy arrays of pixel coordinates.
+
+        Iterates all points at once, as mpixel() does for one point,
+        with each point dropped from the iteration as it escapes.
+        """
+        x = (np.array(ix) - self.xoffset + 0.5) / self.scale
+        y = (np.array(iy) - self.yoffset + 0.5) / self.scale
+        z = x + 1j * y
+        self.set_c(z)
+        # Copy because self.c may be z itself, which is updated in place
+        c = np.array(np.broadcast_to(self.c, z.shape))
+        escaped = np.full(z.shape, -1, dtype=np.int64)
+        active = np.ones(z.shape, dtype=bool)
+        for n in range(self.max_iter + 1):
+            z[active] = z[active] * z[active] + c[active]
+            done = active & (np.abs(z) > 2.0)
+            escaped[done] = n
+            active &= ~done
+        colors = np.empty(z.shape + (3,), dtype=np.uint8)
+        colors[...] = self.background_color
+        mask = (escaped >= 0)
+        colors[mask] = np.stack([np.minimum(escaped[mask] * self.shade_factor, 255),
+                                 np.full(escaped[mask].shape, 50),
+                                 np.full(escaped[mask].shape, 100)], axis=-1)
+        return colors
@@ -3,6 +3,11 @@
 See for example <https://en.wikipedia.org/wiki/Sierpinski_carpet>
 """
 
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy not installed
+    np = None
+
 
 def _middle(x, y):
     """PRIVATE function to return True is x==1 and y==1.
@@ -44,3 +49,19 @@ class PixelGen(object):
         if (_middle(x // divisor, y // divisor)):
             return None
         return self.pixel(x % divisor, y % divisor, divisor)
+
+    def pixels(self, x, y):
+        """Return array of colors for numpy arrays of pixel coordinates."""
+        (x, y) = (np.array(x), np.array(y))
+        black = np.ones(x.shape, dtype=bool)
+        size = self.sz
+        while (size > 3):
+            divisor = size // 3
+            (cx, cy) = (x // divisor, y // divisor)
+            black &= ~((cx == 1) & (cy == 1))
+            (x, y, size) = (x % divisor, y % divisor, divisor)
+        black &= ~((x == 1) & (y == 1))
+        colors = np.empty(x.shape + (3,), dtype=np.uint8)
+        colors[...] = self.background_color
+        colors[black] = (0, 0, 0)
+        return colors
@@ -0,0 +1,107 @@
+"""Cache of ICC colour transforms to sRGB shared between requests.
+
+Scans often have an embedded ICC profile for a wide gamut colour space
+such as Adobe RGB or ProPhoto RGB, or a camera profile. Images on the
+web without a profile are displayed as sRGB so the pixels of such
+sources must be transformed to sRGB for correct display. Building an
+ImageCms transform takes much longer than applying it to a tile, so a
+TransformCache keeps built transforms keyed by a hash of the source
+profile, the image mode and the rendering intent. All access is
+protected by a lock so that one cache may be shared between threads,
+the transforms themselves may be applied concurrently.
+
+Requires PIL built with littlecms (PIL.ImageCms).
+"""
+
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+
+try:
+    from PIL import ImageCms
+except ImportError:  # pragma: no cover - PIL without littlecms
+    ImageCms = None
+
+# Output mode of transform to sRGB for each input mode
+TRANSFORM_MODES = {
+    'RGB': 'RGB',
+    'RGBA': 'RGBA',
+    'CMYK': 'RGB'
+}
+
+
+def is_srgb(profile):
+    """Return True if ImageCms profile is an sRGB profile, by its description."""
+    description = ImageCms.getProfileDescription(profile) or ''
+    return description.strip().lower().startswith('srgb')
+
+
+class TransformCache(object):
+    """Thread-safe LRU cache of ImageCms transforms to sRGB."""
+
+    def __init__(self, max_entries=32):
+        """Initialize TransformCache object.
+
+        Keyword arguments:
+        max_entries -- number of transforms to keep
+        """
+        if (ImageCms is None):
+            raise ImportError("TransformCache requires PIL.ImageCms")
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._transforms = OrderedDict()
+        self._lock = threading.Lock()
+        self._srgb = ImageCms.createProfile('sRGB')
+
+    def __len__(self):
+        """Return number of transforms in cache."""
+        return len(self._transforms)
+
+    def key(self, icc_profile, mode, intent):
+        """Get cache key from hash of icc_profile bytes, mode and intent."""
+        return (hashlib.sha1(icc_profile).hexdigest(), mode, intent)
+
+    def get(self, icc_profile, mode, intent=0):
+        """Transform from icc_profile for an image of mode to sRGB.
+
+        Returns None if no transform is needed, because the profile is
+        already sRGB, or possible, because the mode is not supported or
+        the profile cannot be read. The result is cached in both cases.
+        """
+        if (mode not in TRANSFORM_MODES):
+            return None
+        key = self.key(icc_profile, mode, intent)
+        with self._lock:
+            if (key in self._transforms):
+                # Reinsert as most recently used
+                transform = self._transforms.pop(key)
+                self._transforms[key] = transform
+                self.hits += 1
+                return transform
+            self.misses += 1
+        # Build outside lock, a concurrent build for the same key is harmless
+        transform = self.build(icc_profile, mode, intent)
+        with self._lock:
+            self._transforms[key] = transform
+            while (len(self._transforms) > self.max_entries):
+                self._transforms.popitem(last=False)
+        return transform
+
+    def build(self, icc_profile, mode, intent):
+        """Build transform from icc_profile for mode to sRGB, or None."""
+        try:
+            profile = ImageCms.ImageCmsProfile(io.BytesIO(icc_profile))
+            if (is_srgb(profile)):
+                return None
+            return ImageCms.buildTransform(profile, self._srgb, mode,
+                                           TRANSFORM_MODES[mode],
+                                           renderingIntent=intent)
+        except (ImageCms.PyCMSError, OSError, ValueError):
+            return None
+
+    def clear(self):
+        """Remove all transforms from cache."""
+        with self._lock:
+            self._transforms.clear()
@@ -0,0 +1,117 @@
+"""Cache of decoded source images shared between requests.
+
+A viewer will typically request many tiles of the same image within
+a short time. Rather than open and decode the source image for every
+request, a manipulator may keep decoded images in an ImageCache. The
+cache is keyed by source file path and checks the modification time so
+that a changed source is decoded afresh, has a budget for the total size of
+images held, and evicts the least recently used images to stay within
+that budget. All access is protected by a lock so that one cache may be
+shared between threads.
+
+Images in the cache are shared and so must not be modified or closed
+by the user: PIL operations that return a new image are safe.
+"""
+
+import os
+import os.path
+import threading
+from collections import OrderedDict
+
+# Bytes per pixel used by PIL in memory for modes with one band and
+# less than 32 bits, all others use 4 bytes per pixel
+MODE_PIXEL_BYTES = {
+    '1': 1,
+    'L': 1,
+    'P': 1,
+    'I;16': 2,
+    'I;16B': 2,
+    'I;16L': 2,
+    'I;16N': 2
+}
+
+
+def image_bytes(size, mode):
+    """Return approximate number of bytes in memory for decoded image."""
+    return size[0] * size[1] * MODE_PIXEL_BYTES.get(mode, 4)
+
+
+class ImageCache(object):
+    """Thread-safe LRU cache of decoded images with a size budget."""
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        """Initialize ImageCache object.
+
+        Keyword arguments:
+        max_bytes -- budget for total size of images in cache
+        """
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Return number of images in cache."""
+        return len(self._images)
+
+    def key(self, path):
+        """Get cache key for source file path, the absolute path and modification time.
+
+        Returns None if the file cannot be accessed.
+        """
+        try:
+            return (os.path.abspath(path), os.path.getmtime(path))
+        except (OSError, TypeError):
+            return None
+
+    def fits(self, size, mode):
+        """Return True if a decoded image of size and mode fits in the budget."""
+        return image_bytes(size, mode) <= self.max_bytes
+
+    def get(self, path):
+        """Get decoded image for path if in cache, else None.
+
+        An image cached for a different modification time of the source
+        file is discarded.
+        """
+        key = self.key(path)
+        with self._lock:
+            entry = None if (key is None) else self._images.pop(key[0], None)
+            if (entry is not None and entry[0] == key[1]):
+                # Reinsert as most recently used
+                self._images[key[0]] = entry
+                self.hits += 1
+                return entry[1]
+            if (entry is not None):
+                self.bytes -= image_bytes(entry[1].size, entry[1].mode)
+            self.misses += 1
+            return None
+
+    def put(self, path, image):
+        """Add decoded image for path to cache.
+
+        The image should already be loaded. Least recently used images are
+        evicted to keep within the budget, an image bigger than the whole
+        budget is not cached.
+        """
+        key = self.key(path)
+        nbytes = image_bytes(image.size, image.mode)
+        if (key is None or nbytes > self.max_bytes):
+            return
+        with self._lock:
+            old = self._images.pop(key[0], None)
+            if (old is not None):
+                self.bytes -= image_bytes(old[1].size, old[1].mode)
+            self._images[key[0]] = (key[1], image)
+            self.bytes += nbytes
+            while (self.bytes > self.max_bytes):
+                (k, old) = self._images.popitem(last=False)
+                self.bytes -= image_bytes(old[1].size, old[1].mode)
+
+    def clear(self):
+        """Remove all images from cache."""
+        with self._lock:
+            self._images.clear()
+            self.bytes = 0
@@ -0,0 +1,209 @@
+"""Image type and dimensions from the first bytes of image files.
+
+Pure python readers used by the netpbm manipulator instead of running
+external programs (or libmagic) just to read a few header bytes. The
+type of a source image is recognized from the magic bytes at the start
+of the file, and the width and height are read from the PNG IHDR chunk,
+the JPEG SOF segment, or the JPEG 2000 ihdr box or SIZ marker segment.
+pnm_header() parses the header of the P1-P7 netpbm formats, as written
+by the netpbm decoders, and pnm_header_bytes() writes one.
+"""
+
+import re
+import struct
+
+# Magic bytes at start of file for each image type
+MAGIC_BYTES = [
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'\x00\x00\x00\x0cjP  \r\n\x87\n', 'jp2'),
+    (b'\xff\x4f\xff\x51', 'jp2')
+]
+
+# JPEG SOFn markers, all 0xC0-0xCF except DHT, JPG and DAC
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - set([0xC4, 0xC8, 0xCC])
+
+# Whitespace and comments between PNM header fields (P1-P6)
+PNM_FIELD = re.compile(br'(?:\s|#[^\r\n]*[\r\n])*(\d+)')
+
+
+def image_type(head):
+    """Get image type 'png', 'jpg' or 'jp2' from first bytes head, else None."""
+    for (magic, fmt) in MAGIC_BYTES:
+        if (head.startswith(magic)):
+            return fmt
+    return None
+
+
+def file_type(filename):
+    """Get image type 'png', 'jpg' or 'jp2' of file filename, else None."""
+    try:
+        with open(filename, 'rb') as fh:
+            return image_type(fh.read(12))
+    except (TypeError, IOError):
+        return None
+
+
+def file_size(filename):
+    """Get (width, height) of image file filename from header, or None."""
+    try:
+        with open(filename, 'rb') as fh:
+            fmt = image_type(fh.read(12))
+            if (fmt == 'png'):
+                return png_size(fh)
+            elif (fmt == 'jpg'):
+                return jpeg_size(fh)
+            elif (fmt == 'jp2'):
+                return jp2_size(fh)
+    except (TypeError, IOError, struct.error):
+        pass
+    return None
+
+
+def png_size(fh):
+    """Get (width, height) from IHDR chunk of PNG file fh."""
+    fh.seek(12)
+    if (fh.read(4) != b'IHDR'):
+        return None
+    return struct.unpack('>II', fh.read(8))
+
+
+def jpeg_size(fh):
+    """Get (width, height) from SOF segment of JPEG file fh."""
+    fh.seek(2)
+    while True:
+        marker = fh.read(2)
+        if (len(marker) < 2 or marker[0:1] != b'\xff'):
+            return None
+        code = struct.unpack('>B', marker[1:2])[0]
+        if (code == 0xFF):
+            # Fill byte
+            fh.seek(-1, 1)
+            continue
+        if (code == 0x01 or 0xD0 <= code <= 0xD7):
+            # Standalone marker without length
+            continue
+        (length,) = struct.unpack('>H', fh.read(2))
+        if (code in JPEG_SOF_MARKERS):
+            (precision, height, width) = struct.unpack('>BHH', fh.read(5))
+            return (width, height)
+        elif (code == 0xDA):
+            # Start of scan without frame header
+            return None
+        fh.seek(length - 2, 1)
+
+
+def jp2_size(fh):
+    """Get (width, height) from JP2 ihdr box or J2K SIZ marker segment of fh."""
+    fh.seek(0)
+    if (fh.read(4) == b'\xff\x4f\xff\x51'):
+        (xsiz, ysiz, xosiz, yosiz) = struct.unpack('>4xIIII', fh.read(20))
+        return (xsiz - xosiz, ysiz - yosiz)
+    # Header box jp2h is a superbox containing ihdr as the first box
+    pos = 0
+    while True:
+        fh.seek(pos)
+        header = fh.read(8)
+        if (len(header) < 8):
+            return None
+        (length, box) = struct.unpack('>I4s', header)
+        if (box == b'jp2h'):
+            pos += 8
+        elif (box == b'ihdr'):
+            (height, width) = struct.unpack('>II', fh.read(8))
+            return (width, height)
+        elif (length < 8):
+            # Extended length or box to end of file, neither before ihdr
+            return None
+        else:
+            pos += length
+
+
+def pnm_header(data):
+    """Parse the header of PNM (P1-P7) image data.
+
+    Returns a dict with the magic number (e.g. 'P6'), the image size
+    (width, height), maxval (1 for P1 and P4), depth (number of samples
+    per pixel), tupltype (for P7, else None) and the length in bytes of
+    the header, or None if data
+    does not yet contain the whole header. Raises ValueError if data is
+    not a PNM image.
+    """
+    magic = data[0:2]
+    if (magic == b'P7'):
+        return pam_header(data)
+    if (len(magic) < 2 or magic[0:1] != b'P' or magic[1:2] not in b'123456'):
+        if (len(data) < 2 and b'P'.startswith(data)):
+            return None
+        raise ValueError("Not a PNM image")
+    nfields = 2 if (magic in (b'P1', b'P4')) else 3
+    fields = []
+    pos = 2
+    while (len(fields) < nfields):
+        m = PNM_FIELD.match(data, pos)
+        if (m is None or m.end() == len(data)):
+            # Header incomplete, or number may continue
+            if (len(data) - pos > 1024):
+                raise ValueError("Bad PNM header")
+            return None
+        fields.append(int(m.group(1)))
+        pos = m.end()
+    # Single whitespace character after the last field
+    if (pos >= len(data)):
+        return None
+    return {'magic': magic.decode('ascii'),
+            'size': (fields[0], fields[1]),
+            'maxval': fields[2] if (nfields == 3) else 1,
+            'depth': 3 if (magic in (b'P3', b'P6')) else 1,
+            'tupltype': None,
+            'length': pos + 1}
+
+
+def pam_header(data):
+    """Parse the header of PAM (P7) image data, see pnm_header()."""
+    end = data.find(b'\nENDHDR\n')
+    if (end < 0):
+        if (len(data) > 4096):
+            raise ValueError("Bad PAM header")
+        return None
+    values = {}
+    for line in data[3:end].split(b'\n'):
+        parts = line.split(None, 1)
+        if (len(parts) == 2 and not parts[0].startswith(b'#')):
+            values[parts[0].decode('ascii')] = parts[1].strip()
+    try:
+        return {'magic': 'P7',
+                'size': (int(values['WIDTH']), int(values['HEIGHT'])),
+                'maxval': int(values['MAXVAL']),
+                'depth': int(values['DEPTH']),
+                'tupltype': values.get('TUPLTYPE'),
+                'length': end + 8}
+    except (KeyError, ValueError):
+        raise ValueError("Bad PAM header")
+
+
+def pnm_row_bytes(header):
+    """Get bytes in each row of raw (P4-P7) PNM image with header, else None."""
+    (width, height) = header['size']
+    if (header['magic'] == 'P4'):
+        return (width + 7) // 8
+    elif (header['magic'] in ('P5', 'P6', 'P7')):
+        return width * header['depth'] * (1 if (header['maxval'] < 256) else 2)
+    return None
+
+
+def pnm_header_bytes(header, size):
+    """Make header for PNM image of the same format as header with size."""
+    magic = header['magic'].encode('ascii')
+    if (magic == b'P7'):
+        lines = [b'P7',
+                 b'WIDTH %d' % (size[0]),
+                 b'HEIGHT %d' % (size[1]),
+                 b'DEPTH %d' % (header['depth']),
+                 b'MAXVAL %d' % (header['maxval'])]
+        if (header['tupltype'] is not None):
+            lines.append(b'TUPLTYPE ' + header['tupltype'])
+        return b'\n'.join(lines) + b'\nENDHDR\n'
+    elif (magic in (b'P1', b'P4')):
+        return b'%s\n%d %d\n' % (magic, size[0], size[1])
+    return b'%s\n%d %d\n%d\n' % (magic, size[0], size[1], header['maxval'])
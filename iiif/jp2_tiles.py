@@ -0,0 +1,188 @@
+"""Reduced resolution and tile-wise reading of JPEG 2000 images with PIL.
+
+PIL's OpenJPEG decoder supports decoding at reduced resolution (the
+reduce attribute of the image) but always decodes every tile of the
+codestream. For a tiled JPEG 2000 image we can instead build a new
+codestream in memory that contains only the main header and the
+tile-parts for tiles that intersect the region of interest, and have
+PIL decode that, see jp2_region().
+
+With no reduction the image area of the new codestream is set to the
+bounding box of the tiles selected so that only the region is decoded
+and held in memory. PIL's decoder does not handle an image offset with
+reduced resolution decoding so in that case the image area is instead
+truncated at the far corner of the bounding box, with tiles outside the
+region omitted from the codestream so that they are not decoded.
+"""
+
+import io
+import math
+import struct
+
+from PIL import Image
+
+# Codestream markers used
+SOC = 0xFF4F
+SIZ = 0xFF51
+COD = 0xFF52
+COC = 0xFF53
+TLM = 0xFF55
+PPM = 0xFF60
+SOT = 0xFF90
+EOC = 0xFFD9
+
+
+def jp2_codestream(fh):
+    """Find offsets (start, end) of codestream in JP2 or J2K file fh.
+
+    The end is None if the codestream extends to the end of the file.
+    Returns None if no codestream is found.
+    """
+    fh.seek(0)
+    if (fh.read(4) == b'\xff\x4f\xff\x51'):
+        return (0, None)
+    pos = 0
+    while True:
+        fh.seek(pos)
+        header = fh.read(8)
+        if (len(header) < 8):
+            return None
+        (length, box) = struct.unpack('>I4s', header)
+        start = pos + 8
+        if (length == 1):
+            length = struct.unpack('>Q', fh.read(8))[0]
+            start += 8
+        if (box == b'jp2c'):
+            return (start, (pos + length) if length else None)
+        elif (length == 0):
+            return None
+        pos += length
+
+
+def jp2_header(fh):
+    """Read main header of codestream in JP2 or J2K file fh.
+
+    Returns a dict with the main header segments, SIZ marker values, the
+    number of decomposition levels and the codestream position of the
+    first tile-part, or None if the file does not have a codestream that
+    we can read tile-wise.
+    """
+    cs = jp2_codestream(fh)
+    if (cs is None):
+        return None
+    (start, end) = cs
+    fh.seek(start)
+    segments = [fh.read(2)]
+    header = {'end': end, 'levels': None}
+    while True:
+        data = fh.read(4)
+        if (len(data) < 4):
+            return None
+        (marker, length) = struct.unpack('>HH', data)
+        if (marker == SOT):
+            header['sot'] = fh.tell() - 4
+            break
+        segment = data + fh.read(length - 2)
+        if (marker == SIZ):
+            (xsiz, ysiz, xosiz, yosiz, xtsiz, ytsiz, xtosiz, ytosiz,
+             csiz) = struct.unpack('>IIIIIIIIH', segment[6:40])
+            header.update({'size': (xsiz, ysiz), 'origin': (xosiz, yosiz),
+                           'tile': (xtsiz, ytsiz),
+                           'tile_origin': (xtosiz, ytosiz),
+                           'components': csiz})
+            header['siz'] = len(segments)
+        elif (marker in (COD, COC)):
+            # Number of decomposition levels is the first SPcod/SPcoc byte
+            pos = 9 if (marker == COD) else (6 if header['components'] < 257 else 7)
+            levels = struct.unpack('>B', segment[pos:pos + 1])[0]
+            if (header['levels'] is None or levels < header['levels']):
+                header['levels'] = levels
+        elif (marker == PPM):
+            # Packed packet headers refer to all tiles
+            return None
+        if (marker != TLM):
+            segments.append(segment)
+    header['segments'] = segments
+    return header
+
+
+def jp2_levels(filename):
+    """Get number of decomposition levels in JPEG 2000 image file, or None."""
+    with open(filename, 'rb') as fh:
+        header = jp2_header(fh)
+    return None if (header is None) else header['levels']
+
+
+def jp2_region(filename, box, reduce=0):
+    """Make codestream with just the tiles of JPEG 2000 image that intersect box.
+
+    The box (x0, y0, x1, y1) is in full resolution image coordinates and
+    may have non-integer values. Returns (image, (ox, oy)) where image is
+    a PIL image for the new codestream, which will be decoded at reduced
+    resolution with reduce, and (ox, oy) is the position of its origin in
+    the reduced resolution image. Returns None if the image cannot be read
+    tile-wise or the tiles required cover the whole image, in which case
+    PIL should simply decode the image.
+    """
+    with open(filename, 'rb') as fh:
+        header = jp2_header(fh)
+        if (header is None or header['origin'] != (0, 0)):
+            return None
+        (width, height) = header['size']
+        (tw, th) = header['tile']
+        (tox, toy) = header['tile_origin']
+        across = (width - tox + tw - 1) // tw
+        down = (height - toy + th - 1) // th
+        tx0 = max(0, (int(box[0]) - tox) // tw)
+        ty0 = max(0, (int(box[1]) - toy) // th)
+        tx1 = min(across, int(math.ceil((box[2] - tox) / float(tw))))
+        ty1 = min(down, int(math.ceil((box[3] - toy) / float(th))))
+        if ((tx1 - tx0) * (ty1 - ty0) >= across * down or
+                tx1 <= tx0 or ty1 <= ty0):
+            return None
+        x1 = min(width, tox + tx1 * tw)
+        y1 = min(height, toy + ty1 * th)
+        if (reduce == 0):
+            # Image area is the bounding box of the tiles
+            (x0, y0) = (max(0, tox + tx0 * tw), max(0, toy + ty0 * th))
+            (ntox, ntoy) = (tox + tx0 * tw, toy + ty0 * th)
+            (nx0, ny0, nacross) = (tx0, ty0, tx1 - tx0)
+        else:
+            # Image area truncated at the far corner of the tiles
+            (x0, y0) = (0, 0)
+            (ntox, ntoy) = (tox, toy)
+            (nx0, ny0, nacross) = (0, 0, (x1 - tox + tw - 1) // tw)
+        segments = list(header['segments'])
+        siz = bytearray(segments[header['siz']])
+        struct.pack_into('>IIII', siz, 6, x1, y1, x0, y0)
+        struct.pack_into('>II', siz, 30, ntox, ntoy)
+        segments[header['siz']] = bytes(siz)
+        # Tile-parts, renumbered for the new tile grid
+        end = header['end']
+        pos = header['sot']
+        while True:
+            fh.seek(pos)
+            data = fh.read(12)
+            if (len(data) < 12):
+                break
+            (marker, length, isot, psot) = struct.unpack('>HHHI', data[:10])
+            if (marker != SOT):
+                break
+            if (psot == 0):
+                # Last tile-part extends to EOC marker
+                fh.seek(0, 2)
+                psot = (end if end is not None else fh.tell()) - pos - 2
+            (ty, tx) = divmod(isot, across)
+            if (tx0 <= tx < tx1 and ty0 <= ty < ty1):
+                fh.seek(pos)
+                part = bytearray(fh.read(psot))
+                struct.pack_into('>H', part, 4,
+                                 (ty - ny0) * nacross + (tx - nx0))
+                segments.append(bytes(part))
+            pos += psot
+    segments.append(struct.pack('>H', EOC))
+    image = Image.open(io.BytesIO(b''.join(segments)))
+    if (reduce):
+        image.reduce = reduce
+    power = 2 ** reduce
+    return (image, (x0 // power, y0 // power))
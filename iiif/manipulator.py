@@ -21,8 +21,27 @@ class IIIFManipulator(object):
 
     All exceptions are raise as IIIFError objects which directly
     determine the HTTP response.
+
+    The class attribute plan_cache holds operation plans from
+    plan_operations() for each request shape, required_operations
+    lists operations that a sub-class needs to run even if they would
+    be no-ops for the request.
+
+    The class attribute stage_timer may be set to a
+    iiif.stage_timer.StageTimer object to record timings of the stages
+    of a sample of derive() calls.
+
+    The class attribute memory_budget may be set to a
+    iiif.memory_budget.MemoryBudget object, shared by all instances, to
+    limit the memory used by concurrent derive() calls to their total
+    estimate from estimate_memory().
     """
 
+    plan_cache = {}
+    required_operations = ()
+    stage_timer = None
+    memory_budget = None
+
     def __init__(self, api_version='2.1'):
         """Initialize Manipulator object.
 
@@ -34,6 +53,15 @@ class IIIFManipulator(object):
         set this to a level number (0,1,2) appropriate to the
         facilities supported at the given API version. Use
         compliance_uri to get a URI.
+
+        Sets in_memory to False so that output is written to a file.
+        Manipulators that support it will, if in_memory is set True and
+        no outfile is specified, encode the output image to a bytes
+        object in outbytes instead of writing a temporary file.
+
+        Sets plan to None, derive() sets it to the operation plan used.
+        Sets timings to None, derive() sets it to a list of (stage,
+        seconds, image_bytes) for each stage if timed by stage_timer.
         """
         self.api_version = api_version
         self.compliance_level = None
@@ -43,6 +71,10 @@ class IIIFManipulator(object):
         self.srcfile = None
         self.request = None
         self.outfile = None
+        self.in_memory = False
+        self.outbytes = None
+        self.plan = None
+        self.timings = None
         self.logger = logging.getLogger(__name__)
 
     @property
@@ -77,12 +109,21 @@ class IIIFManipulator(object):
         request -- IIIFRequest object with parsed parameters
         outfile -- output image file. If set the the output file will be
                    written to that file, otherwise a new temporary file
-                   will be created and outfile set to its location.
+                   will be created and outfile set to its location (or,
+                   if in_memory is set and supported by the manipulator,
+                   outfile is None and the image is in outbytes).
 
         See order in spec: http://www-sul.stanford.edu/iiif/image-api/#order
 
           Region THEN Size THEN Rotation THEN Quality THEN Format
 
+        The operations actually done, and their order, are given by the
+        plan from plan_operations() which omits operations that are
+        no-ops for the request. A sub-class may reorder operations where
+        that gives the same result as the spec order. If
+        can_pass_through() says that the output would be the same as the
+        source file then do_passthrough() is used instead of the plan.
+
         Typical use:
 
             r = IIIFRequest(region=...)
@@ -108,19 +149,196 @@ class IIIFManipulator(object):
             if (not os.path.exists(dir)):
                 os.makedirs(dir)
         #
-        self.do_first()
-        (x, y, w, h) = self.region_to_apply()
-        self.do_region(x, y, w, h)
-        (w, h) = self.size_to_apply()
-        self.do_size(w, h)
-        (mirror, rot) = self.rotation_to_apply(no_mirror=True)
-        self.do_rotation(mirror, rot)
-        (quality) = self.quality_to_apply()
-        self.do_quality(quality)
-        self.do_format(self.request.format)
-        self.do_last()
+        self.timings = None
+        if (self.stage_timer is not None and self.stage_timer.sample()):
+            self.timings = []
+        self.run_stage('do_first')
+        self.plan = self.plan_operations()
+        if (self.can_pass_through()):
+            self.run_stage('do_passthrough')
+        else:
+            self.apply_plan()
+        if (self.timings is not None):
+            self.stage_timer.report(self, self.timings)
         return(self.outfile, self.mime_type)
 
+    def apply_plan(self):
+        """Apply the operations in self.plan, then format and last steps.
+
+        If memory_budget is set then the estimated memory is acquired
+        from it first and released at the end.
+        """
+        nbytes = 0
+        if (self.memory_budget is not None):
+            nbytes = self.estimate_memory()
+            self.memory_budget.acquire(nbytes)
+        try:
+            for operation in self.plan:
+                if (operation == 'region'):
+                    (x, y, w, h) = self.region_to_apply()
+                    self.run_stage('do_region', x, y, w, h)
+                elif (operation == 'size'):
+                    (w, h) = self.size_to_apply()
+                    self.run_stage('do_size', w, h)
+                elif (operation == 'rotation'):
+                    (mirror, rot) = self.rotation_to_apply(no_mirror=True)
+                    self.run_stage('do_rotation', mirror, rot)
+                elif (operation == 'quality'):
+                    (quality) = self.quality_to_apply()
+                    self.run_stage('do_quality', quality)
+            self.run_stage('do_format', self.request.format)
+            self.run_stage('do_last')
+        finally:
+            if (self.memory_budget is not None):
+                self.memory_budget.release(nbytes)
+
+    def derive_many(self, srcfile, requests, outfiles=None):
+        """Derive images for each of requests from srcfile, as a generator.
+
+        Keyword arguments:
+        srcfile -- source image file
+        requests -- iterable of IIIFRequest objects
+        outfiles -- list of output files, one for each request, or None
+                    to use temporary files (or in_memory output)
+
+        Yields (outfile, mime_type, error) for each request in turn,
+        where error is None on success else the IIIFError raised for
+        that request. The output (including self.outbytes) is available
+        until the next iteration after which self.cleanup() is called.
+        Any other exception is raised after self.cleanup().
+
+        Sub-classes may keep intermediate results, such as the decoded
+        source, between the requests by overriding begin_many() and
+        end_many() which are called before and after the requests. In
+        this base class derive() is simply called for each request.
+        """
+        self.srcfile = srcfile
+        self.begin_many()
+        try:
+            for (n, request) in enumerate(requests):
+                self.outfile = None if (outfiles is None) else outfiles[n]
+                try:
+                    try:
+                        (outfile, mime_type) = self.derive(request=request)
+                    except IIIFError as e:
+                        yield (None, None, e)
+                        continue
+                    yield (outfile, mime_type, None)
+                finally:
+                    # Also on other exceptions and if the caller stops
+                    # iterating
+                    self.cleanup()
+        finally:
+            self.end_many()
+
+    def begin_many(self):
+        """Null implementation of setup before derive_many() requests."""
+        pass
+
+    def end_many(self):
+        """Null implementation of tidy up after derive_many() requests."""
+        pass
+
+    def run_stage(self, stage, *args):
+        """Run derive() stage method with args, timed if self.timings is set."""
+        if (self.timings is None):
+            return getattr(self, stage)(*args)
+        return self.stage_timer.measure(self, stage, *args)
+
+    def image_bytes(self):
+        """Return approximate bytes of the decoded image held, or None.
+
+        Used by stage_timer after each stage. This null implementation
+        holds no image and so returns None.
+        """
+        return None
+
+    def estimate_memory(self):
+        """Estimate peak bytes of memory used by derive() for the current request.
+
+        Called after do_first() and before any other operation. This
+        null implementation does no image processing and so returns 0.
+        """
+        return 0
+
+    def can_pass_through(self):
+        """Return True if the output for the current request is the source file unchanged.
+
+        Called after do_first() and plan_operations(). This null
+        implementation returns False, its do_format() passes the source
+        through anyway.
+        """
+        return False
+
+    def plan_operations(self):
+        """Get plan of operations for the current request.
+
+        Returns a tuple of operation names from 'region', 'size',
+        'rotation' and 'quality' in the order that derive() should apply
+        them, format is always last. Plans depend only on the request
+        shape given by plan_key() and are cached in plan_cache.
+        """
+        key = self.plan_key()
+        plan = self.plan_cache.get(key)
+        if (plan is None):
+            plan = self.make_plan()
+            self.plan_cache[key] = plan
+        return plan
+
+    def plan_key(self):
+        """Get key for request shape that determines the plan of operations.
+
+        Sub-classes that override make_plan() to consider other features
+        must also override this method to add them to the key.
+        """
+        r = self.request
+        return (self.__class__.__name__, self.api_version,
+                self.required_operations, self.region_is_full(), self.size_is_full(),
+                bool(r.rotation_mirror), r.rotation_deg == 0.0,
+                self.quality_to_apply())
+
+    def make_plan(self):
+        """Make plan of operations for the current request.
+
+        Operations that are no-ops for the request shape are omitted unless
+        listed in self.required_operations. Quality is always included
+        because it may require conversion for output.
+        """
+        r = self.request
+        plan = []
+        if (not self.region_is_full() or 'region' in self.required_operations):
+            plan.append('region')
+        if (not self.size_is_full() or 'size' in self.required_operations):
+            plan.append('size')
+        if (r.rotation_mirror or r.rotation_deg != 0.0 or
+                'rotation' in self.required_operations):
+            plan.append('rotation')
+        plan.append('quality')
+        return tuple(plan)
+
+    def region_is_full(self):
+        """Return True if the region requested is the full image."""
+        return (self.request.region_full or
+                (self.request.region_pct and
+                 list(self.request.region_xywh) == [0, 0, 100, 100]))
+
+    def size_is_full(self):
+        """Return True if the size requested is always the full region size."""
+        return (self.request.size_full or self.request.size_pct == 100.0 or
+                (self.request.size_max and not self.max_area and
+                 not self.max_width))
+
+    def source_size(self):
+        """Get (width, height) of source image self.srcfile.
+
+        Used for image information requests where the pixel data is not
+        needed. This implementation simply calls do_first(), sub-classes
+        should override it with a method that reads only the image header
+        if do_first() is expensive.
+        """
+        self.do_first()
+        return (self.width, self.height)
+
     def do_first(self):
         """Simplest possible manipulator that can only handle no modification.
 
@@ -171,7 +389,17 @@ class IIIFManipulator(object):
         if (format is not None):
             raise IIIFError(code=415, parameter="format",
                             text="Null manipulator does not support specification of output format.")
-        #
+        self.do_passthrough()
+        self.mime_type = None
+
+    def do_passthrough(self):
+        """Use the source file unchanged as the output.
+
+        If no outfile is set then outfile is set to the source file
+        itself, which must not be removed by cleanup(), else the source
+        is copied to outfile. Sub-classes set mime_type.
+        """
+        self.outbytes = None
         if (self.outfile is None):
             self.outfile = self.srcfile
         else:
@@ -180,7 +408,6 @@ class IIIFManipulator(object):
             except IOError as e:
                 raise IIIFError(code=500,
                                 text="Failed to copy file (%s)." % (str(e)))
-        self.mime_type = None
 
     def do_last(self):
         """Null implementation of hook in pipeline at end of processing.
@@ -206,9 +433,7 @@ class IIIFManipulator(object):
 
         Returns (None,None,None,None) if no extraction is required.
         """
-        if (self.request.region_full or
-            (self.request.region_pct and
-             self.request.region_xywh == (0, 0, 100, 100))):
+        if (self.region_is_full()):
             return(None, None, None, None)
         # Cannot do anything else unless we know size (in self.width and
         # self.height)
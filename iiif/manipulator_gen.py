@@ -5,6 +5,11 @@ import sys
 
 from PIL import Image
 
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy not installed
+    np = None
+
 from .error import IIIFError
 from .manipulator_pil import IIIFManipulatorPIL
 
@@ -18,8 +23,19 @@ class IIIFManipulatorGen(IIIFManipulatorPIL):
 
     All exceptions are raised as IIIFError objects which directly
     determine the HTTP response.
+
+    A generator must implement pixel(x, y) which returns the color of
+    one pixel, or None for the background color. If numpy is installed
+    then a generator may also implement pixels(x, y) where x and y are
+    numpy integer arrays of pixel coordinates, which returns a numpy
+    array of the colors of all of those pixels with an extra last axis
+    of length 3, using the background color for background pixels.
     """
 
+    # The image is generated by do_size() from the region recorded by
+    # do_region() so these must always be run
+    required_operations = ('region', 'size')
+
     def __init__(self, **kwargs):
         """Initialize IIIFManipulatorGen object.
 
@@ -81,12 +97,34 @@ class IIIFManipulatorGen(IIIFManipulatorPIL):
             self.sw = w
             self.sh = h
         # Now we have region and size, generate the image
-        image = Image.new("RGB", (self.sw, self.sh), self.gen.background_color)
+        if (np is not None and hasattr(self.gen, 'pixels')):
+            self.image = self.generate_array()
+        else:
+            self.image = self.generate_pixels()
+
+    def generate_array(self):
+        """Generate image with the generator's numpy pixels() method."""
+        ix = (np.arange(self.sw) * self.rw // self.sw + self.rx).astype(np.int64)
+        iy = (np.arange(self.sh) * self.rh // self.sh + self.ry).astype(np.int64)
+        (x, y) = np.meshgrid(ix, iy)
+        colors = self.gen.pixels(x, y)
+        return Image.fromarray(np.ascontiguousarray(colors, dtype=np.uint8))
+
+    def generate_pixels(self):
+        """Generate image calling the generator's pixel() for each pixel.
+
+        Colors are written to a bytearray that is converted to the image
+        at the end, which is much faster than Image.putpixel().
+        """
+        data = bytearray(bytes(bytearray(self.gen.background_color)) * (self.sw * self.sh))
+        ixs = [int((x * self.rw) // self.sw + self.rx) for x in range(self.sw)]
+        pixel = self.gen.pixel
+        pos = 0
         for y in range(0, self.sh):
-            for x in range(0, self.sw):
-                ix = int((x * self.rw) // self.sw + self.rx)
-                iy = int((y * self.rh) // self.sh + self.ry)
-                color = self.gen.pixel(ix, iy)
+            iy = int((y * self.rh) // self.sh + self.ry)
+            for ix in ixs:
+                color = pixel(ix, iy)
                 if (color is not None):
-                    image.putpixel((x, y), color)
-        self.image = image
+                    data[pos:pos + 3] = color
+                pos += 3
+        return Image.frombytes('RGB', (self.sw, self.sh), bytes(data))
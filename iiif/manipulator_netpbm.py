@@ -1,18 +1,24 @@
 """Implementation of IIIF image manipulations using netpbm programs.
 
-This manipulator really is very very slow, it writes intermediate files
-in order to keep the manipulations modular. Starting from a JPEG seems
-especially slow. Strictly for play...
+Each manipulation adds netpbm commands to a pipeline that starts with
+the decoder of the source image and ends with the encoder of the output
+format. The pipeline is run without a shell, each command reading the
+PNM output of the previous one on stdin, so that no intermediate files
+are written. Starting from a JPEG seems especially slow. Strictly for
+play...
 """
 
-import re
 import os
 import os.path
 import glob
-import magic
+import signal
 import subprocess
+import threading
+import uuid
 
 from .error import IIIFError
+from .image_header import file_size, file_type, pnm_header, pnm_row_bytes
+from .pnm_cache import write_rows
 from .request import IIIFRequest
 from .manipulator import IIIFManipulator
 
@@ -22,10 +28,26 @@ class IIIFManipulatorNetpbm(IIIFManipulator):
 
     All exceptions are raised as IIIFError objects which directly
     determine the HTTP response.
+
+    The output image is written to self.outfile if set, else to
+    self.outbytes. Only jp2 output, via djatoka, uses temporary files,
+    named with a basename unique to the request so that manipulators in
+    different threads of one process do not share files.
+
+    If the class attribute pipeline_limit is set to a PipelineLimit
+    then a slot is acquired from it for each pipeline or command run,
+    which limits the number of concurrent converters in the process.
+
+    If the class attribute pnm_cache is set to a PNMCache then the
+    decoded source is kept in the cache and the pipeline starts from the
+    cached PNM instead of the decoder. For a region only the rows of the
+    region are read from the cached PNM and given to pnmcut.
     """
 
     tmpdir = '/tmp'
     pnmdir = None
+    pipeline_limit = None
+    pnm_cache = None
 
     def __init__(self, **kwargs):
         """Initialize IIIFManipulatorNetpbm object.
@@ -34,6 +56,8 @@ class IIIFManipulatorNetpbm(IIIFManipulator):
         """
         super(IIIFManipulatorNetpbm, self).__init__(**kwargs)
         self.complianceLevel = "http://iiif.example.org/compliance/level/1"
+        self.basename = None
+        self.source = None
         if (self.pnmdir is None):
             self.find_binaries()
 
@@ -56,7 +80,7 @@ class IIIFManipulatorNetpbm(IIIFManipulator):
         # Recklessly assume everything else under cls.pnmdir
         cls.pngtopnm = os.path.join(cls.pnmdir, 'pngtopnm')
         cls.jpegtopnm = os.path.join(cls.pnmdir, 'jpegtopnm')
-        cls.pnmfile = os.path.join(cls.pnmdir, 'pnmfile')
+        cls.jpeg2ktopam = os.path.join(cls.pnmdir, 'jpeg2ktopam')
         cls.pnmcut = os.path.join(cls.pnmdir, 'pnmcut')
         cls.pnmscale = os.path.join(cls.pnmdir, 'pnmscale')
         cls.pnmrotate = os.path.join(cls.pnmdir, 'pnmrotate')
@@ -70,62 +94,121 @@ class IIIFManipulatorNetpbm(IIIFManipulator):
         cls.djatoka_comp = '/Users/simeon/packages/adore-djatoka-1.1/bin/compress.sh'
 
     def do_first(self):
-        """Create PNM file from input image file."""
-        pid = os.getpid()
-        self.basename = os.path.join(self.tmpdir, 'iiif_netpbm_' + str(pid))
-        outfile = self.basename + '.pnm'
+        """Start pipeline with the decoder for the input image file."""
+        self.basename = os.path.join(self.tmpdir, 'iiif_netpbm_%d_%s'
+                                     % (os.getpid(), uuid.uuid4().hex))
         # Convert source file to pnm
         filetype = self.file_type(self.srcfile)
         if (filetype == 'png'):
-            if (self.shell_call(self.pngtopnm + ' ' + self.srcfile + ' > ' + outfile)):
-                raise IIIFError(text="Oops... got error from pngtopnm.")
+            decoder = self.pngtopnm
         elif (filetype == 'jpg'):
-            if (self.shell_call(self.jpegtopnm + ' ' + self.srcfile + ' > ' + outfile)):
-                raise IIIFError(text="Oops... got error from jpegtopnm.")
+            decoder = self.jpegtopnm
+        elif (filetype == 'jp2'):
+            decoder = self.jpeg2ktopam
         else:
             raise IIIFError(code='501',
-                            text='bad input file format (only know how to read png/jpeg)')
-        self.tmpfile = outfile
+                            text='bad input file format (only know how to read png/jpeg/jp2)')
+        self.close_source()
+        if (self.pnm_cache is not None and self.open_cached_source(decoder)):
+            return
+        self.pipeline = [[decoder, self.srcfile]]
         # Get size
-        (self.width, self.height) = self.image_size(self.tmpfile)
+        size = self.header_size()
+        if (size is None):
+            size = self.image_size()
+        (self.width, self.height) = size
+
+    def source_size(self):
+        """Get (width, height) of source image self.srcfile.
+
+        Uses the dimensions from the image header for PNG, JPEG and JPEG
+        2000 images to avoid converting the image to PNM, otherwise falls
+        back to do_first().
+        """
+        size = self.header_size()
+        if (size is not None):
+            return size
+        self.do_first()
+        return (self.width, self.height)
+
+    def header_size(self):
+        """Get (width, height) of self.srcfile from image header, or None."""
+        return file_size(self.srcfile)
+
+    def open_cached_source(self, decoder):
+        """Start an empty pipeline from the cached PNM of the source.
+
+        The source is decoded into self.pnm_cache with decoder if it is
+        not already cached. Sets self.source to a dict with the open PNM
+        file, its parsed header and the rows to use. Returns False if the
+        source cannot be cached.
+        """
+        fh = self.pnm_cache.get(self.srcfile)
+        if (fh is None):
+            fh = self.pnm_cache.put(
+                self.srcfile,
+                lambda out: self.run_pipeline([[decoder, self.srcfile]], stdout=out))
+            if (fh is None):
+                return False
+        try:
+            header = pnm_header(fh.read(4096))
+        except ValueError:
+            header = None
+        if (header is None):
+            fh.close()
+            raise IIIFError(text="Oops... bad PNM header in cached source.")
+        (self.width, self.height) = header['size']
+        self.source = {'fh': fh, 'header': header, 'rows': (0, self.height)}
+        self.pipeline = []
+        return True
+
+    def write_source(self, out):
+        """Write PNM of the rows to use of the cached source to out."""
+        fh = self.source['fh']
+        header = self.source['header']
+        (y, nrows) = self.source['rows']
+        if (pnm_row_bytes(header) is None):
+            # Plain PNM, give whole file
+            fh.seek(0)
+            for data in iter(lambda: fh.read(1024 * 1024), b''):
+                out.write(data)
+        else:
+            write_rows(fh, header, y, nrows, out)
+
+    def close_source(self):
+        """Close cached PNM source if open."""
+        if (self.source is not None):
+            self.source['fh'].close()
+            self.source = None
 
     def do_region(self, x, y, w, h):
-        """Apply region selection."""
-        infile = self.tmpfile
-        outfile = self.basename + '.reg'
+        """Apply region selection.
+
+        With a cached raw PNM source only rows y to y+h are read from the
+        cache and pnmcut cuts the columns.
+        """
         # simeon@ice ~>cat m.pnm | pnmcut 10 10 100 200 > m1.pnm
-        if (x is None):
-            # print "region: full"
-            self.tmpfile = infile
-        else:
+        if (x is not None):
             # print "region: (%d,%d,%d,%d)" % (x,y,w,h)
-            if (self.shell_call('cat ' + infile + ' | ' + self.pnmcut + ' ' + str(x) + ' ' + str(y) + ' ' + str(w) + ' ' + str(h) + '  > ' + outfile)):
-                raise IIIFError(text="Oops... got nonzero output from pnmcut.")
+            if (self.source is not None and not self.pipeline and
+                    pnm_row_bytes(self.source['header']) is not None):
+                self.source['rows'] = (y, h)
+                y = 0
+            self.pipeline.append([self.pnmcut, str(x), str(y), str(w), str(h)])
             self.width = w
             self.height = h
-            self.tmpfile = outfile
 
     def do_size(self, w, h):
         """Apply size scaling."""
         # simeon@ice ~>cat m1.pnm | pnmscale -width 50 > m2.pnm
-        infile = self.tmpfile
-        outfile = self.basename + '.siz'
-        if (w is None):
-            # print "size: no scaling"
-            self.tmpfile = infile
-        else:
+        if (w is not None):
             # print "size: scaling to (%d,%d)" % (w,h)
-            if (self.shell_call('cat ' + infile + ' | ' + self.pnmscale + ' -width ' + str(w) + ' -height ' + str(h) + '  > ' + outfile)):
-                raise IIIFError(
-                    text="Oops... got nonzero output from pnmscale.")
+            self.pipeline.append([self.pnmscale, '-width', str(w), '-height', str(h)])
             self.width = w
             self.height = h
-            self.tmpfile = outfile
 
     def do_rotation(self, mirror, rot):
         """Apply rotation and/or mirroring."""
-        infile = self.tmpfile
-        outfile = self.basename + '.rot'
         # NOTE: pnmrotate: angle must be between -90 and 90 and
         # rotations is CCW not CW per IIIF spec
         #
@@ -148,60 +231,45 @@ class IIIFManipulatorNetpbm(IIIFManipulator):
         #
         if (rot == 0.0):
             # print "rotation: no rotation"
-            self.tmpfile = infile
+            return
         elif (rot <= 90.0 or rot >= 270.0):
             if (rot >= 270.0):
                 rot -= 360.0
             # print "rotation: by %f degrees clockwise" % (rot)
-            if (self.shell_call('cat ' + infile + ' | ' + self.pnmrotate + ' -background=#FFF ' + str(-rot) + '  > ' + outfile)):
-                raise IIIFError(
-                    text="Oops... got nonzero output from pnmrotate.")
-            self.tmpfile = outfile
+            self.pipeline.append([self.pnmrotate, '-background=#FFF', str(-rot)])
         else:
             # Between 90 and 270 = flip and then -90 to 90
             rot -= 180.0
             # print "rotation: by %f degrees clockwise" % (rot)
-            if (self.shell_call('cat ' + infile + ' | ' + self.pnmflip + ' -rotate180 | ' + self.pnmrotate + ' ' + str(-rot) + '  > ' + outfile)):
-                raise IIIFError(
-                    text="Oops... got nonzero output from pnmrotate.")
-            self.tmpfile = outfile
+            self.pipeline.append([self.pnmflip, '-rotate180'])
+            self.pipeline.append([self.pnmrotate, str(-rot)])
         # Fixup size for 90s
         if (abs(rot % 180.0 - 90.0) < 0.001):
-            outfile2 = self.basename + '.rot2'
-            if (self.shell_call('cat ' + self.tmpfile + ' | ' + self.pnmscale + ' -width ' + str(self.height) + ' -height ' + str(self.width) + ' > ' + outfile2)):
-                raise IIIFError(
-                    text="Oops... failed to fixup size after pnmrotate.")
-            self.tmpfile = outfile2
+            self.pipeline.append([self.pnmscale, '-width', str(self.height),
+                                  '-height', str(self.width)])
 
     def do_quality(self, quality):
         """Apply value of quality parameter."""
-        infile = self.tmpfile
-        outfile = self.basename + '.col'
         # Quality (bit-depth):
         if (quality == 'grey' or quality == 'gray'):
-            if (self.shell_call('cat ' + infile + ' | ' + self.ppmtopgm + ' > ' + outfile)):
-                raise IIIFError(
-                    text="Oops... got nonzero output from ppmtopgm.")
-            self.tmpfile = outfile
+            self.pipeline.append([self.ppmtopgm])
         elif (quality == 'bitonal'):
-            if (self.shell_call('cat ' + infile + ' | ' + self.ppmtopgm + ' | ' + self.pamditherbw + ' > ' + outfile)):
-                raise IIIFError(
-                    text="Oops... got nonzero output from ppmtopgm.")
-            self.tmpfile = outfile
+            self.pipeline.append([self.ppmtopgm])
+            self.pipeline.append([self.pamditherbw])
         elif ((quality == 'native' and self.api_version < '2.0') or
               (quality == 'default' and self.api_version >= '2.0') or
               quality == 'color'):
-            self.tmpfile = infile
+            pass
         else:
             raise IIIFError(code=400, parameter='quality',
                             text="Unknown quality parameter value requested.")
 
     def do_format(self, format):
-        """Apply format selection."""
-        infile = self.tmpfile
-        outfile = self.basename + '.out'
-        outfile_jp2 = self.basename + '.jp2'
-        # Now convert finished pnm file to output format
+        """Apply format selection and run the pipeline.
+
+        Output is written to self.outfile if set, else to self.outbytes.
+        """
+        # Now convert finished pnm stream to output format
         # simeon@ice ~>cat m3.pnm | pnmtojpeg  > m4.jpg
         # simeon@ice ~>cat m3.pnm | pnmtotiff > m4.jpg
         # pnmtotiff: computing colormap...
@@ -211,79 +279,181 @@ class IIIFManipulatorNetpbm(IIIFManipulator):
         fmt = ('png' if (format is None) else format)
         if (fmt == 'png'):
             # print "format: png"
-            if (self.shell_call(self.pnmtopng + ' ' + infile + ' > ' + outfile)):
-                raise IIIFError(
-                    text="Oops... got nonzero output from pnmtopng.")
+            encoder = self.pnmtopng
             mime_type = "image/png"
         elif (fmt == 'jpg'):
             # print "format: jpg"
-            if (self.shell_call(self.pnmtojpeg + ' ' + infile + ' > ' + outfile)):
-                raise IIIFError(
-                    text="Oops... got nonzero output from pnmtojpeg.")
+            encoder = self.pnmtojpeg
             mime_type = "image/jpeg"
         elif (fmt == 'tiff' or fmt == 'jp2'):
             # print "format: tiff/jp2"
-            if (self.shell_call(self.pnmtotiff + ' ' + infile + ' > ' + outfile)):
-                raise IIIFError(
-                    text="Oops... got nonzero output from pnmtotiff.")
+            encoder = self.pnmtotiff
             mime_type = "image/tiff"
-            if (fmt == 'jp2'):
-                # use djatoka after tiff
-                if (self.shell_call(DJATOKA_COMP + ' -i ' + outfile + ' -o ' + outfile_jp2)):
-                    raise IIIFError(
-                        text="Oops... got nonzero output from DJATOKA_COMP.")
-                mime_type = "image/jp2"
-                outfile = tmpfile_jp2
         else:
             raise IIIFError(code=415, parameter='format',
                             text="Unsupported output file format (%s), only png,jpg,tiff are supported." % (fmt))
-        self.outfile = outfile
+        commands = self.pipeline + [[encoder]]
+        source = None if (self.source is None) else self.write_source
+        self.outbytes = None
+        if (fmt == 'jp2'):
+            # use djatoka after tiff, which needs files
+            tiffile = self.basename + '.tif'
+            outfile = (self.basename + '.jp2' if (self.outfile is None) else self.outfile)
+            with open(tiffile, 'wb') as fh:
+                self.run_pipeline(commands, fh, source=source)
+            if (self.shell_call(self.djatoka_comp + ' -i ' + tiffile + ' -o ' + outfile)):
+                raise IIIFError(
+                    text="Oops... got nonzero output from djatoka compress.")
+            mime_type = "image/jp2"
+            self.outfile = outfile
+        elif (self.outfile is not None):
+            with open(self.outfile, 'wb') as fh:
+                self.run_pipeline(commands, fh, source=source)
+        else:
+            self.outbytes = self.run_pipeline(commands, source=source)
         self.output_format = fmt
         self.mime_type = mime_type
 
     def file_type(self, file):
-        """Use python-magic to determine file type.
+        """Determine file type from the magic bytes at the start of file.
+
+        Returns 'png', 'jpg' or 'jp2' on success, None on failure.
+        """
+        return file_type(file)
+
+    def image_size(self):
+        """Get width and height of image from the PNM header of the pipeline.
+
+        Only the header is read, after which the pipeline is stopped.
+        """
+        header = self.run_pipeline(self.pipeline, reader=self.read_pnm_header)
+        return header['size']
+
+    def read_pnm_header(self, fh):
+        """Read and parse PNM header from start of file object fh."""
+        data = b''
+        while True:
+            chunk = fh.read(256)
+            if (not chunk):
+                raise IIIFError(text="Oops... no PNM header when trying to get size.")
+            data += chunk
+            try:
+                header = pnm_header(data)
+            except ValueError as e:
+                raise IIIFError(text="Oops... bad PNM header when trying to get size (%s)." % (str(e)))
+            if (header is not None):
+                return header
+
+    def run_pipeline(self, commands, stdout=None, reader=None, source=None):
+        """Run commands as a pipeline without a shell.
 
-        Returns 'png' or 'jpg' on success, nothing on failure.
+        Each command is a list of the program and its arguments, and
+        reads the standard output of the previous command on its standard
+        input. If source is given then source(fh) is called in a thread to
+        write the standard input of the first command to fh. The output
+        of the last command is written to the file object stdout if
+        given, else returned as bytes. If reader is given then the result
+        of reader(fh), where fh is the output of the last command, is
+        returned instead and the pipeline is stopped when reader returns.
+        Raises an IIIFError naming the first program that fails. A
+        program killed by SIGPIPE, because a later program stopped
+        reading, is not a failure. Holds a slot of pipeline_limit, if
+        set, while running.
         """
+        self.logger.debug("pipeline: " + ' | '.join([' '.join(c) for c in commands]))
+        if (self.pipeline_limit is not None):
+            self.pipeline_limit.acquire()
         try:
-            magic_text = magic.from_file(file)
-            if (isinstance(magic_text, bytes)):
-                # In python2 and travis python3 (?!) decode to get unicode string
-                magic_text = magic_text.decode('utf-8')
-        except (TypeError, IOError):
-            return
-        if (re.search('PNG image data', magic_text)):
-            return('png')
-        elif (re.search('JPEG image data', magic_text)):
-            return('jpg')
-        # failed
-        return
-
-    def image_size(self, pnmfile):
-        """Get width and height of pnm file.
-
-        simeon@homebox src>pnmfile /tmp/214-2.png
-        /tmp/214-2.png:PPM raw, 100 by 100  maxval 255
+            procs = []
+            stdin = (None if (source is None) else subprocess.PIPE)
+            feeder = None
+            try:
+                for (n, command) in enumerate(commands):
+                    last = (n == len(commands) - 1)
+                    proc = subprocess.Popen(command, stdin=stdin,
+                                            stdout=(stdout if (last and stdout is not None)
+                                                    else subprocess.PIPE))
+                    if (n > 0):
+                        # Only the next program reads the pipe, so that the
+                        # previous program gets SIGPIPE if it stops reading
+                        stdin.close()
+                    stdin = proc.stdout
+                    procs.append(proc)
+                if (source is not None):
+                    feeder = threading.Thread(target=self.feed_pipeline,
+                                              args=(source, procs[0].stdin))
+                    feeder.start()
+                if (reader is None):
+                    data = procs[-1].communicate()[0]
+                else:
+                    try:
+                        data = reader(procs[-1].stdout)
+                    finally:
+                        # Earlier programs get SIGPIPE if still writing
+                        procs[-1].stdout.close()
+            except IIIFError:
+                self.stop_pipeline(procs, feeder, source)
+                raise
+            except OSError as e:
+                if (stdin is not None and stdin is not subprocess.PIPE):
+                    stdin.close()
+                self.stop_pipeline(procs, feeder, source)
+                raise IIIFError(text="Oops... failed to run %s (%s)."
+                                % (os.path.basename(command[0]), str(e)))
+            if (feeder is not None):
+                feeder.join()
+            for (proc, command) in zip(procs, commands):
+                if (proc.wait() not in (0, -signal.SIGPIPE)):
+                    raise IIIFError(text="Oops... got nonzero output from %s."
+                                    % (os.path.basename(command[0])))
+            return data
+        finally:
+            if (self.pipeline_limit is not None):
+                self.pipeline_limit.release()
+
+    def feed_pipeline(self, source, fh):
+        """Write input of pipeline with source(fh) and close fh.
+
+        An error writing, because the first program stopped reading, is
+        ignored.
         """
-        pout = os.popen(self.shellsetup + self.pnmfile + ' ' + pnmfile, 'r')
-        pnmfileout = pout.read(200)
-        pout.close()
-        m = re.search(', (\d+) by (\d+) ', pnmfileout)
-        if (m is None):
-            raise IIIFError(
-                text="Bad output from pnmfile when trying to get size.")
-        w = int(m.group(1))
-        h = int(m.group(2))
-        # print "pnmfile output = %s" % (pnmfileout)
-        # print "image size = %d,%d" % (w,h)
-        return(w, h)
+        try:
+            source(fh)
+        except (IOError, OSError):
+            pass
+        finally:
+            try:
+                fh.close()
+            except (IOError, OSError):
+                pass
+
+    def stop_pipeline(self, procs, feeder, source):
+        """Wait for the programs of a failed pipeline to finish."""
+        if (source is not None and feeder is None and procs):
+            # Input not started, let first program see end of input
+            procs[0].stdin.close()
+        for proc in procs:
+            proc.wait()
+        if (feeder is not None):
+            feeder.join()
 
     def shell_call(self, shellcmd):
-        """Shell call with necessary setup first."""
-        return(subprocess.call(self.shellsetup + shellcmd, shell=True))
+        """Shell call with necessary setup first.
+
+        Holds a slot of pipeline_limit, if set, while running.
+        """
+        if (self.pipeline_limit is not None):
+            self.pipeline_limit.acquire()
+        try:
+            return(subprocess.call(self.shellsetup + shellcmd, shell=True))
+        finally:
+            if (self.pipeline_limit is not None):
+                self.pipeline_limit.release()
 
     def cleanup(self):
-        """Clean up any temporary files."""
+        """Clean up any temporary files, and close cached source."""
+        self.close_source()
+        if (self.basename is None):
+            return
         for file in glob.glob(self.basename + '*'):
             os.unlink(file)
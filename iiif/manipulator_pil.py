@@ -4,10 +4,13 @@ Uses the Python Image Library (PIL) for in-python manipulation:
 http://www.pythonware.com/products/pil/index.htm
 """
 
+import io
+import math
 import re
 import os
 import os.path
 import subprocess
+import sys
 import tempfile
 
 from PIL import Image
@@ -15,6 +18,126 @@ from PIL import Image
 from .error import IIIFError
 from .request import IIIFRequest
 from .manipulator import IIIFManipulator
+from .image_cache import image_bytes
+from .jp2_tiles import jp2_header, jp2_levels, jp2_region
+from .png_rows import png_rawmode, png_region
+from .strips import (default_threads, parallel_convert, parallel_reduce,
+                     parallel_resize, parallel_transpose)
+from .tiff_tiles import tiff_level, tiff_region, tiff_tile_layout
+
+# Image.reduce() and reducing_gap option of Image.resize() are new in Pillow 7.0
+PIL_HAS_REDUCE = hasattr(Image.Image, 'reduce')
+
+# Modes for which Image.reduce() averages pixel values
+REDUCE_MODES = ('L', 'LA', 'RGB', 'RGBA', 'CMYK', 'YCbCr', 'I', 'F')
+
+# Modes for which converting to gray commutes with rotation, including
+# the black background filled in by rotation
+GRAY_FIRST_MODES = ('1', 'L', 'LA', 'I', 'F', 'I;16', 'I;16B', 'I;16L',
+                    'RGB', 'RGBA', 'RGBX', 'YCbCr')
+
+# Offset of the most significant byte of each pixel in the raw data of
+# 16-bit modes
+HIGH_BYTE_OFFSETS = {
+    'I;16': 1,
+    'I;16L': 1,
+    'I;16B': 0,
+    'I;16N': 1 if (sys.byteorder == 'little') else 0
+}
+
+# Named encoder profiles giving PIL save() options for each format:
+# default uses PIL defaults, fast minimizes encode time (for small
+# tiles), small minimizes bytes (for large downloads)
+ENCODER_PROFILES = {
+    'default': {},
+    'fast': {
+        'jpeg': {'quality': 75},
+        'png': {'compress_level': 1},
+        'webp': {'quality': 75, 'method': 0}
+    },
+    'small': {
+        'jpeg': {'quality': 75, 'optimize': True, 'progressive': True},
+        'png': {'compress_level': 9, 'optimize': True},
+        'webp': {'quality': 75, 'method': 6}
+    }
+}
+
+
+def high_byte_image(image):
+    """Mode L image of the most significant bytes of 16-bit image.
+
+    This is the same as image.convert('I').point(lambda i: i / 256.0)
+    then conversion to 8-bits, but is done with a single slice of the
+    raw data instead of conversion to and scaling of 32-bit integers.
+    """
+    offset = HIGH_BYTE_OFFSETS[image.mode]
+    return Image.frombytes('L', image.size, image.tobytes()[offset::2])
+
+
+# Output format and MIME type for each PIL source format that may be
+# passed through unchanged
+PASSTHROUGH_FORMATS = {
+    'JPEG': ('jpg', 'image/jpeg'),
+    'PNG': ('png', 'image/png'),
+    'WEBP': ('webp', 'image/webp')
+}
+
+# Source modes that do_quality() leaves unchanged for each quality
+PASSTHROUGH_MODES = {
+    'default': ('1', 'L', 'RGB', 'RGBA'),
+    'color': ('1', 'L', 'RGB', 'RGBA'),
+    'gray': ('L',),
+    'grey': ('L',),
+    'bitonal': ('1',)
+}
+
+# EXIF tag for image orientation
+EXIF_ORIENTATION = 0x0112
+
+# PIL transpose() methods for (mirror, clockwise rotation) combinations
+TRANSPOSE_METHODS = {
+    (False, 0): None,
+    (False, 90): Image.ROTATE_270,
+    (False, 180): Image.ROTATE_180,
+    (False, 270): Image.ROTATE_90,
+    (True, 0): Image.FLIP_LEFT_RIGHT,
+    (True, 90): Image.TRANSVERSE,
+    (True, 180): Image.FLIP_TOP_BOTTOM,
+    (True, 270): Image.TRANSPOSE
+}
+
+
+def mirror_rotate_transform(size, mirror, rot):
+    """Affine transform for optional mirror then rotation by rot degrees.
+
+    Returns (new_size, matrix) where new_size is the expanded size of the
+    output image and matrix is the 6-tuple for PIL's Image.transform()
+    with Image.AFFINE that maps output to input coordinates. Follows
+    the calculation in PIL's Image.rotate() with expand=True, composing
+    the mirror about the vertical axis of the input image.
+    """
+    (w, h) = size
+    angle = math.radians(rot)  # clockwise rotation is -rot for PIL
+    a = round(math.cos(angle), 15)
+    b = round(math.sin(angle), 15)
+    d = -b
+    e = a
+    # Rotate about center
+    c = a * (-w / 2.0) + b * (-h / 2.0) + w / 2.0
+    f = d * (-w / 2.0) + e * (-h / 2.0) + h / 2.0
+    xx = []
+    yy = []
+    for (x, y) in ((0, 0), (w, 0), (w, h), (0, h)):
+        xx.append(a * x + b * y + c)
+        yy.append(d * x + e * y + f)
+    nw = int(math.ceil(max(xx)) - math.floor(min(xx)))
+    nh = int(math.ceil(max(yy)) - math.floor(min(yy)))
+    (tx, ty) = (-(nw - w) / 2.0, -(nh - h) / 2.0)
+    (c, f) = (a * tx + b * ty + c, d * tx + e * ty + f)
+    if (mirror):
+        # input x of mirrored image is w - x of original
+        (a, b, c) = (-a, -b, w - c)
+    return ((nw, nh), (a, b, c, d, e, f))
 
 
 class IIIFManipulatorPIL(IIIFManipulator):
@@ -22,11 +145,44 @@ class IIIFManipulatorPIL(IIIFManipulator):
 
     All exceptions are raised as IIIFError objects which directly
     determine the HTTP response.
+
+    Resize, transpose and conversion of images with at least
+    strip_min_pixels pixels are split into strips processed in
+    parallel by strip_threads threads (default the number of cores,
+    set 1 to disable).
+
+    Output is encoded with the options of the ENCODER_PROFILES profile
+    named by encoder_profile, or by encoder_profile_large if set and
+    the output image has at least encoder_large_pixels pixels.
+
+    If icc_transforms is set to an iiif.icc.TransformCache object,
+    shared by all instances, then sources with an embedded ICC profile
+    are converted to sRGB with rendering intent icc_intent (an ImageCms
+    INTENT_* value, default perceptual). The conversion is done in
+    do_quality(), after scaling, so that as few pixels as possible are
+    transformed.
+
+    If jpegtran is set to the path of the jpegtran command then region
+    requests at full resolution on JPEG sources, with rotation by a
+    multiple of 90 degrees, are done losslessly in the DCT domain by
+    jpegtran where the region is aligned to MCU boundaries (see
+    jpegtran_commands()). Otherwise, or if jpegtran fails, the image is
+    decoded and re-encoded as usual.
     """
 
     tmpdir = '/tmp'
     filecmd = None
     pnmdir = None
+    reducing_gap = 3.0
+    image_cache = None
+    strip_threads = None
+    strip_min_pixels = 16 * 1024 * 1024
+    encoder_profile = 'default'
+    encoder_profile_large = None
+    encoder_large_pixels = 1024 * 1024
+    icc_transforms = None
+    icc_intent = 0
+    jpegtran = None
 
     def __init__(self, **kwargs):
         """Initialize IIIFManipulatorPIL object.
@@ -37,7 +193,15 @@ class IIIFManipulatorPIL(IIIFManipulator):
         # Does not support jp2 output
         self.compliance_level = 2
         self.image = None
+        self.cached_image = None
+        self.image_scale = (1, 1)
+        self.image_offset = (0, 0)
+        self.region_box = None
         self.outtmp = None
+        self.shared_image = None
+        self.shared_bases = None
+        self.shared_is_cached = False
+        self.icc_profile = None
 
     def set_max_image_pixels(self, pixels):
         """Set PIL limit on pixel size of images to load if non-zero.
@@ -62,11 +226,40 @@ class IIIFManipulatorPIL(IIIFManipulator):
         Image location must be in self.srcfile. Will result in
         self.width and self.height being set to the image dimensions.
 
+        If the class has an image_cache (an iiif.image_cache.ImageCache
+        object shared by all instances) then a decoded image is taken
+        from the cache if available, otherwise the image is decoded in
+        full and added to the cache if it fits.
+
+        Within derive_many() the source decoded by begin_many() is used.
+
         Will raise an IIIFError on failure to load the image
         """
         self.logger.debug("do_first: src=%s" % (self.srcfile))
+        self.image_scale = (1, 1)
+        self.image_offset = (0, 0)
+        self.region_box = None
+        self.cached_image = None
+        if (self.shared_image is not None):
+            self.image = self.cached_image = self.shared_image
+            (self.width, self.height) = self.image.size
+            self.icc_profile = self.image.info.get('icc_profile')
+            return
+        if (self.image_cache is not None):
+            self.cached_image = self.image_cache.get(self.srcfile)
+            if (self.cached_image is not None):
+                self.logger.debug("do_first: using cached image")
+                self.image = self.cached_image
+                (self.width, self.height) = self.image.size
+                self.icc_profile = self.image.info.get('icc_profile')
+                return
         try:
             self.image = Image.open(self.srcfile)
+            if (self.image_cache is not None and
+                    self.image_cache.fits(self.image.size, self.image.mode)):
+                self.image.load()
+                self.image_cache.put(self.srcfile, self.image)
+                self.cached_image = self.image
         except Image.DecompressionBombWarning as e:
             # This exception will be raised only if PIL has been
             # configured to raise an error in the case of images
@@ -76,52 +269,549 @@ class IIIFManipulatorPIL(IIIFManipulator):
         except Exception as e:
             raise IIIFError(text=("Failed to read image (PIL: %s)" % (str(e))))
         (self.width, self.height) = self.image.size
+        # Keep profile because decoding only tiles may replace self.image
+        self.icc_profile = self.image.info.get('icc_profile')
+
+    def begin_many(self):
+        """Decode source once for all derive_many() requests.
+
+        The decoded source is kept in self.shared_image and images
+        reduced from it by integer factors, created as needed by
+        reduce_decode_shared(), in the dict self.shared_bases. Raises
+        an IIIFError on failure to read the source.
+        """
+        self.shared_image = None
+        self.do_first()
+        try:
+            self.image.load()
+        except Exception as e:
+            raise IIIFError(text=("Failed to read image (PIL: %s)" % (str(e))))
+        self.shared_image = self.image
+        self.shared_bases = {}
+        # An image from the image cache must not be closed
+        self.shared_is_cached = (self.cached_image is not None)
+
+    def end_many(self):
+        """Close the images kept by begin_many()."""
+        for base in self.shared_bases.values():
+            base.close()
+        if (not self.shared_is_cached):
+            self.shared_image.close()
+        self.shared_image = None
+        self.shared_bases = None
+
+    def source_size(self):
+        """Get (width, height) of source image self.srcfile from header.
+
+        PIL reads only the image header when an image is opened, the pixel
+        data is not decoded.
+        """
+        try:
+            image = Image.open(self.srcfile)
+        except Exception as e:
+            raise IIIFError(text=("Failed to read image (PIL: %s)" % (str(e))))
+        size = image.size
+        image.close()
+        return size
+
+    def plan_key(self):
+        """Get key for request shape, adding whether gray may be done first."""
+        return super(IIIFManipulatorPIL, self).plan_key() + (
+            getattr(self.image, 'mode', None) in GRAY_FIRST_MODES,)
+
+    def make_plan(self):
+        """Make plan of operations for the current request.
+
+        The region step is kept if there is scaling because do_region()
+        arranges reduced resolution decoding for do_size(). Conversion to
+        gray is done before rotation so that only one channel is rotated:
+        pixel-wise conversion commutes with transpose() and with the
+        nearest neighbour transform() used for other angles. Bitonal
+        conversion uses dithering and so stays in spec order.
+        """
+        plan = list(super(IIIFManipulatorPIL, self).make_plan())
+        if ('size' in plan and 'region' not in plan):
+            plan.insert(0, 'region')
+        if ('rotation' in plan and
+                self.quality_to_apply() in ('gray', 'grey') and
+                getattr(self.image, 'mode', None) in GRAY_FIRST_MODES):
+            plan.remove('quality')
+            plan.insert(plan.index('rotation'), 'quality')
+        return tuple(plan)
+
+    def estimate_memory(self):
+        """Estimate peak bytes of memory used by derive() for the current request.
+
+        Uses the source dimensions and mode from the image header with the
+        region, size, rotation and quality requested. The peak is taken as
+        the largest total of the input and output images of any step, where
+        the first step is from the decoded source (see decode_estimate())
+        to the scaled region, then rotation expands the image and quality
+        may change the mode.
+        """
+        mode = self.image.mode
+        (x, y, w, h) = self.region_to_apply()
+        if (x is None):
+            (x, y, w, h) = (0, 0, self.width, self.height)
+        size = self.lookahead_size(w, h) or (w, h)
+        decoded = 0
+        if (self.image is not self.cached_image):
+            decoded = self.decode_estimate(x, y, w, h, size)
+        sized = image_bytes(size, mode)
+        rotated = 0
+        rsize = size
+        rot = self.request.rotation_deg or 0.0
+        if (self.request.rotation_mirror or rot != 0.0):
+            if (rot % 90.0 != 0.0):
+                rsize = mirror_rotate_transform(size, False, rot)[0]
+            rotated = image_bytes(rsize, mode)
+        quality = self.quality_to_apply()
+        if (quality in ('gray', 'grey')):
+            qmode = 'L'
+        elif (quality == 'bitonal'):
+            qmode = '1'
+        else:
+            qmode = mode if (mode in ('1', 'L', 'RGB', 'RGBA')) else 'RGB'
+        converted = image_bytes(rsize, qmode) if (qmode != mode) else 0
+        return max(decoded + sized, sized + rotated,
+                   max(sized, rotated) + converted)
+
+    def image_bytes(self):
+        """Return approximate bytes of self.image decoded, or None if no image."""
+        if (self.image is None):
+            return None
+        return image_bytes(self.image.size, self.image.mode)
+
+    def decode_estimate(self, x, y, w, h, size):
+        """Estimate bytes of decoded source for region x, y, w, h scaled to size.
+
+        This follows reduce_decode(): a JPEG source may be decoded at 1/2,
+        1/4 or 1/8 scale, a tiled or stripped TIFF source decodes just the
+        tiles covering the region, a JPEG 2000 source may be decoded at
+        reduced resolution and, if tiled, just for the tiles covering the
+        region, and a PNG source is read row-wise keeping just the region,
+        which may be reduced as it is read. Otherwise the whole source is
+        decoded. Reduced resolution levels of pyramidal TIFF are not
+        considered so the estimate is high for scaled requests on them.
+        """
+        (width, height) = self.image.size
+        mode = self.image.mode
+        factor = max(1, min(w // size[0], h // size[1]))
+        scale = 1
+        tile = None
+        if (self.image.format == 'JPEG'):
+            for scale in (8, 4, 2, 1):
+                if (factor >= scale):
+                    break
+        elif (self.image.format == 'TIFF'):
+            layout = tiff_tile_layout(self.image)
+            if (layout is not None):
+                tile = layout[0:2]
+        elif (self.image.format == 'PNG' and png_rawmode(self.image) is not None):
+            # Rows read in a stream keeping just the region
+            (width, height) = (w, h)
+            scale = self.png_reduce_factor(w, h, size)
+        elif (self.image.format == 'JPEG2000'):
+            try:
+                with open(self.srcfile, 'rb') as fh:
+                    header = jp2_header(fh)
+            except (IOError, OSError):
+                header = None
+            if (header is not None):
+                levels = header['levels'] or 0
+                while (scale * 2 <= factor and scale * 2 <= 2 ** levels):
+                    scale *= 2
+                if (header['tile'] != (width, height)):
+                    tile = header['tile']
+        if (tile is not None):
+            # Region expanded to whole tiles
+            (tw, th) = tile
+            width = min(width, (int(math.ceil(float(x + w) / tw)) - x // tw) * tw)
+            height = min(height, (int(math.ceil(float(y + h) / th)) - y // th) * th)
+        return image_bytes(((width + scale - 1) // scale,
+                            (height + scale - 1) // scale), mode)
 
     def do_region(self, x, y, w, h):
-        """Apply region selection."""
+        """Apply region selection.
+
+        Before any pixels are decoded we look ahead at the size that
+        will be requested for this region so that reduce_decode() can
+        arrange for the source to be decoded at reduced resolution, and
+        for just the part of the source covering the region. The region
+        is then mapped into the coordinates of the decoded image.
+
+        If the region will be scaled then the crop is not done here,
+        instead the box is recorded in self.region_box so that do_size()
+        can extract and resample the region in one pass.
+        """
         if (x is None):
-            self.logger.debug("region: full (nop)")
+            self.logger.debug("region: full")
+            (rx, ry, rw, rh) = (0, 0, self.width, self.height)
         else:
             self.logger.debug("region: (%d,%d,%d,%d)" % (x, y, w, h))
-            self.image = self.image.crop((x, y, x + w, y + h))
+            (rx, ry, rw, rh) = (x, y, w, h)
+        size = self.lookahead_size(rw, rh)
+        self.reduce_decode(rx, ry, rw, rh, size)
+        (sx, sy) = self.image_scale
+        (ox, oy) = self.image_offset
+        box = (rx / sx - ox, ry / sy - oy,
+               (rx + rw) / sx - ox, (ry + rh) / sy - oy)
+        # A region reaching the right or bottom edge of the source reaches
+        # the edge of the decoded image, which is rounded up when reduced
+        if (rx + rw == self.width):
+            box = box[:2] + (self.image.size[0], box[3])
+        if (ry + rh == self.height):
+            box = box[:3] + (self.image.size[1],)
+        if (size is not None):
+            self.logger.debug("region: deferred to size")
+            self.region_box = box
+        elif (box == (0, 0) + self.image.size):
+            self.logger.debug("region: full (nop)")
+        else:
+            self.image = self.image.crop(tuple(int(v + 0.5) for v in box))
+        self.width = rw
+        self.height = rh
+
+    def lookahead_size(self, w, h):
+        """Size that the request will scale a region of w by h pixels to.
+
+        Uses size_to_apply() with the region dimensions, returns None if
+        there is no request, no scaling, or the size parameter is in
+        error (in which case do_size() will raise the error).
+        """
+        if (self.request is None):
+            return None
+        (width, height) = (self.width, self.height)
+        try:
             self.width = w
             self.height = h
+            (sw, sh) = self.size_to_apply()
+        except IIIFError:
+            return None
+        finally:
+            self.width = width
+            self.height = height
+        if (sw is None):
+            return None
+        return (sw, sh)
+
+    def reduce_decode(self, x, y, w, h, size):
+        """Arrange to decode only what is needed of the source image.
+
+        The region x, y, w, h of the source will be scaled to size, which
+        is None if there is no scaling. Before the source image has been
+        decoded we may be able to select a reduced resolution version
+        and/or decode only part of the image. Sets self.image_scale to the
+        (x, y) reduction factors applied and self.image_offset to the
+        position of the decoded image in the (reduced) source image.
+        An image that has already been decoded for the image cache, or
+        by begin_many(), is used as is except that within derive_many()
+        a shared reduced image may be used.
+        """
+        if (self.image_scale != (1, 1) or self.image_offset != (0, 0)):
+            return
+        if (self.image is self.cached_image):
+            if (self.shared_bases is not None and size is not None):
+                self.reduce_decode_shared(w, h, size[0], size[1])
+            return
+        if (self.image.format == 'JPEG'):
+            if (size is not None):
+                self.reduce_decode_jpeg(w, h, size[0], size[1])
+        elif (self.image.format == 'TIFF'):
+            self.reduce_decode_tiff(x, y, w, h, size)
+        elif (self.image.format == 'JPEG2000'):
+            self.reduce_decode_jp2(x, y, w, h, size)
+        elif (self.image.format == 'PNG'):
+            self.reduce_decode_png(x, y, w, h, size)
+
+    def reduce_decode_jpeg(self, rw, rh, sw, sh):
+        """Arrange to decode JPEG source at reduced resolution if possible.
+
+        Where a region of rw by rh pixels of the source will be scaled down
+        to sw by sh pixels use libjpeg DCT scaling (via PIL's Image.draft)
+        to decode at 1/2, 1/4 or 1/8 scale. The largest reduction that
+        still gives at least sw by sh pixels for the region is chosen.
+        """
+        factor = min(rw // sw, rh // sh)
+        for scale in (8, 4, 2):
+            if (factor >= scale):
+                break
+        else:
+            return
+        size = self.image.size
+        self.image.draft(None, (size[0] // scale, size[1] // scale))
+        if (self.image.size != size):
+            self.logger.debug("reduce_decode: JPEG draft at 1/%d scale" % (scale))
+            self.image_scale = (float(size[0]) / self.image.size[0],
+                                float(size[1]) / self.image.size[1])
+
+    def png_reduce_factor(self, rw, rh, size):
+        """Get factor to reduce rows of PNG source by as they are read.
+
+        Where a region of rw by rh pixels will be scaled down to size this
+        is the factor that PIL's resize() would first reduce by with
+        reducing_gap, so that the result is much the same.
+        """
+        if (size is None or not self.reducing_gap or not PIL_HAS_REDUCE or
+                self.image.mode not in REDUCE_MODES):
+            return 1
+        return max(1, int(min(float(rw) / size[0], float(rh) / size[1]) / self.reducing_gap))
+
+    def reduce_decode_png(self, x, y, w, h, size):
+        """Decode just the rows and columns of PNG source covering the region.
+
+        Rows are decompressed and unfiltered in a stream that stops at the
+        bottom edge of the region, keeping only the columns of the region,
+        and are reduced as they are read if the region will be scaled
+        down enough (see png_reduce_factor()).
+        """
+        reduce = self.png_reduce_factor(w, h, size)
+        try:
+            region = png_region(self.srcfile, self.image, (x, y, x + w, y + h), reduce)
+        except Exception as e:
+            raise IIIFError(text=("Failed to read PNG rows (%s)" % (str(e))))
+        if (region is not None):
+            self.logger.debug("reduce_decode: PNG rows at (%d,%d) size %dx%d reduced by %d"
+                              % (region[1] + region[0].size + (reduce,)))
+            self.image.close()
+            (self.image, self.image_offset) = region
+            self.image_scale = (reduce, reduce)
+
+    def reduce_decode_shared(self, rw, rh, sw, sh):
+        """Use a shared reduced image within derive_many() if possible.
+
+        Where a region of rw by rh pixels of the source will be scaled down
+        to sw by sh pixels by an integer factor of 2 or more, use the
+        source reduced by that factor with Image.reduce(). Each reduced
+        image is made once and kept in self.shared_bases for the other
+        requests at the same scale factor, such as all tiles of one level.
+        """
+        factor = min(rw // sw, rh // sh)
+        if (factor < 2 or not PIL_HAS_REDUCE or
+                self.image.mode not in REDUCE_MODES):
+            return
+        base = self.shared_bases.get(factor)
+        if (base is None):
+            self.logger.debug("reduce_decode: making shared base reduced by %d" % (factor))
+            base = self.image.reduce(factor)
+            self.shared_bases[factor] = base
+        self.image = self.cached_image = base
+        self.image_scale = (factor, factor)
+
+    def reduce_decode_tiff(self, x, y, w, h, size):
+        """Select resolution level and tiles to decode from TIFF source.
+
+        If the region of w by h pixels will be scaled down to size, select
+        the smallest reduced resolution level of a pyramidal TIFF that
+        still gives at least that many pixels for the region. Then, if the
+        image is tiled (or stripped) read only the tiles that intersect
+        the region.
+        """
+        scale = (1, 1)
+        if (size is not None):
+            level = tiff_level(
+                self.image,
+                int(math.ceil(float(size[0]) * self.width / w)),
+                int(math.ceil(float(size[1]) * self.height / h)))
+            if (level.size[0] < self.width):
+                scale = (float(self.width) / level.size[0],
+                         float(self.height) / level.size[1])
+                self.logger.debug("reduce_decode: TIFF level %dx%d" % level.size)
+            if (level is not self.image):
+                self.image.close()
+                self.image = level
+        box = (x / scale[0], y / scale[1],
+               (x + w) / scale[0], (y + h) / scale[1])
+        try:
+            region = tiff_region(self.srcfile, self.image, box)
+        except Exception as e:
+            raise IIIFError(text=("Failed to read TIFF tiles (%s)" % (str(e))))
+        if (region is not None):
+            self.logger.debug("reduce_decode: TIFF tiles at (%d,%d) size %dx%d"
+                              % (region[1] + region[0].size))
+            self.image.close()
+            (self.image, self.image_offset) = region
+        self.image_scale = scale
+
+    def reduce_decode_jp2(self, x, y, w, h, size):
+        """Select reduction level and tiles to decode from JPEG 2000 source.
+
+        If the region of w by h pixels will be scaled down to size then
+        use the largest reduction by a power of 2 (up to the number of
+        decomposition levels in the codestream) that still gives at least
+        that many pixels for the region. Then, if the image is tiled,
+        decode only the tiles that intersect the region.
+        """
+        reduce = 0
+        if (size is not None):
+            factor = min(w // size[0], h // size[1])
+            levels = jp2_levels(self.srcfile) or 0
+            while ((2 << reduce) <= factor and reduce < levels):
+                reduce += 1
+        try:
+            region = jp2_region(self.srcfile, (x, y, x + w, y + h), reduce)
+        except Exception as e:
+            raise IIIFError(text=("Failed to read JPEG 2000 tiles (%s)" % (str(e))))
+        if (region is not None and region[0].mode == self.image.mode):
+            self.logger.debug("reduce_decode: JPEG 2000 tiles at (%d,%d) size %dx%d"
+                              % (region[1] + region[0].size))
+            self.image.close()
+            (self.image, self.image_offset) = region
+        elif (reduce > 0):
+            self.image.reduce = reduce
+        if (reduce > 0):
+            self.logger.debug("reduce_decode: JPEG 2000 reduce %d" % (reduce))
+            # Decode now so that image.size is the reduced size
+            self.image.load()
+            self.image_scale = (float(2 ** reduce), float(2 ** reduce))
 
     def do_size(self, w, h):
-        """Apply size scaling."""
+        """Apply size scaling.
+
+        If do_region() has recorded a region box then the region is
+        extracted as part of the resize operation.
+
+        Where the region is reduced by an exact integer factor in each
+        dimension, as for tiles at the scale_factors levels, we use
+        PIL's Image.reduce() which is much faster than a general resize.
+        Otherwise the resize first reduces by an integer factor where
+        that is possible within self.reducing_gap, and then does the
+        final fractional resample.
+        """
+        box = self.region_box
+        self.region_box = None
         if (w is None):
             self.logger.debug("size: no scaling (nop)")
+            if (box is not None):
+                self.image = self.image.crop(tuple(int(v + 0.5) for v in box))
+        elif (box is not None and all(v == int(v) for v in box) and
+              (box[2] - box[0], box[3] - box[1]) == (w, h)):
+            self.logger.debug("size: region is already (%d,%d)" % (w, h))
+            self.image = self.image.crop(tuple(int(v) for v in box))
+            self.width = w
+            self.height = h
         else:
-            self.logger.debug("size: scaling to (%d,%d)" % (w, h))
-            self.image = self.image.resize((w, h))
+            factors = self.reduce_factors(box, w, h)
+            if (factors is not None):
+                self.logger.debug("size: reducing by (%d,%d) to (%d,%d)" %
+                                  (factors[0], factors[1], w, h))
+                if (box is not None):
+                    box = tuple(int(v) for v in box)
+                strips = self.strips()
+                if (strips):
+                    self.image = parallel_reduce(self.image, factors, box,
+                                                 strips, strips)
+                else:
+                    # Not self.image.reduce() which a JPEG 2000 source shadows
+                    # with the reduction level set by reduce_decode_jp2()
+                    self.image = Image.Image.reduce(self.image, factors, box=box)
+            elif (PIL_HAS_REDUCE):
+                self.logger.debug("size: scaling to (%d,%d)" % (w, h))
+                image = None
+                strips = self.strips()
+                if (strips and self.image.mode in REDUCE_MODES):
+                    image = parallel_resize(self.image, (w, h), box,
+                                            self.reducing_gap, strips, strips)
+                if (image is None and self.image.mode in REDUCE_MODES):
+                    image = self.image.resize((w, h), box=box,
+                                              reducing_gap=self.reducing_gap)
+                elif (image is None):
+                    # reducing_gap uses Image.reduce() which does not
+                    # support other modes such as I;16
+                    image = self.image.resize((w, h), box=box)
+                self.image = image
+            else:
+                self.logger.debug("size: scaling to (%d,%d)" % (w, h))
+                self.image = self.image.resize((w, h), box=box)
             self.width = w
             self.height = h
 
+    def strips(self):
+        """Return number of strips to split an operation on self.image into.
+
+        Returns 0 if the image has fewer than self.strip_min_pixels pixels
+        or there is only one thread, in which case operations are not
+        split.
+        """
+        threads = self.strip_threads or default_threads()
+        if (threads < 2 or
+                self.image.size[0] * self.image.size[1] < self.strip_min_pixels):
+            return 0
+        return threads
+
+    def convert(self, mode):
+        """Convert self.image to mode, in strips if large."""
+        strips = self.strips()
+        if (strips):
+            self.image = parallel_convert(self.image, mode, strips, strips)
+        else:
+            self.image = self.image.convert(mode)
+
+    def reduce_factors(self, box, w, h):
+        """Integer reduction factors to scale box in self.image to w by h.
+
+        Returns (xfactor, yfactor) if the box (or whole image if box is
+        None) has integer coordinates and scaling to w by h pixels is an
+        exact integer reduction in each dimension that can be done with
+        Image.reduce(), else None.
+        """
+        if (not PIL_HAS_REDUCE or self.image.mode not in REDUCE_MODES):
+            return None
+        if (box is None):
+            box = (0, 0) + self.image.size
+        if (any(v != int(v) for v in box)):
+            return None
+        (bw, bh) = (int(box[2] - box[0]), int(box[3] - box[1]))
+        if (bw % w != 0 or bh % h != 0):
+            return None
+        (xf, yf) = (bw // w, bh // h)
+        if (xf < 2 and yf < 2):
+            return None
+        return (xf, yf)
+
     def do_rotation(self, mirror, rot):
-        """Apply rotation and/or mirroring."""
+        """Apply rotation and/or mirroring.
+
+        Mirroring and rotation are combined into a single operation: a
+        transpose() for multiples of 90 degrees, otherwise one affine
+        transform() equivalent to a mirror followed by PIL's rotate()
+        with expand=True.
+        """
         if (not mirror and rot == 0.0):
             self.logger.debug("rotation: no rotation (nop)")
+        elif (rot % 90.0 == 0.0):
+            self.logger.debug("rotation: mirror=%s, by %f degrees clockwise"
+                              % (str(mirror), rot))
+            method = TRANSPOSE_METHODS[(bool(mirror), int(rot) % 360)]
+            strips = self.strips()
+            if (method is None):
+                pass
+            elif (strips):
+                self.image = parallel_transpose(self.image, method, strips, strips)
+            else:
+                self.image = self.image.transpose(method)
         else:
-            # FIXME - with PIL one can use the transpose() method to do 90deg
-            # FIXME - rotations as well as mirroring. This would be more efficient
-            # FIXME - for these cases than mirror _then_ rotate.
-            if (mirror):
-                self.logger.debug("rotation: mirror (about vertical axis)")
-                self.image = self.image.transpose(Image.FLIP_LEFT_RIGHT)
-            if (rot != 0.0):
-                self.logger.debug("rotation: by %f degrees clockwise" % (rot))
-                self.image = self.image.rotate(-rot, expand=True)
+            self.logger.debug("rotation: mirror=%s, by %f degrees clockwise"
+                              % (str(mirror), rot))
+            (size, matrix) = mirror_rotate_transform(self.image.size, mirror, rot)
+            self.image = self.image.transform(size, Image.AFFINE, matrix,
+                                              Image.NEAREST)
 
     def do_quality(self, quality):
         """Apply value of quality parameter.
 
         For PIL docs see
         <http://pillow.readthedocs.org/en/latest/reference/Image.html#PIL.Image.Image.convert>
+
+        Palette, CMYK and other modes are converted directly by PIL.
+        A colour-managed source is first converted to sRGB.
         """
+        self.convert_to_srgb()
         if (quality == 'grey' or quality == 'gray'):
             # Checking for 1.1 gray or 20.0 grey elsewhere
             self.logger.debug("quality: converting to gray")
-            self.image = self.image.convert('L')
+            if (self.image.mode != 'L'):
+                self.convert('L')
         elif (quality == 'bitonal'):
             self.logger.debug("quality: converting to bitonal")
             self.image = self.image.convert('1')
@@ -130,24 +820,190 @@ class IIIFManipulatorPIL(IIIFManipulator):
             # appears not to handle properly, resulting in mostly white images
             # if we convert directly. See:
             # <http://stackoverflow.com/questions/7247371/python-and-16-bit-tiff>
-            if (self.image.mode.startswith('I;16')):
-                self.logger.debug("quality: fudged conversion from mode %s to I"
+            sixteen_bit = self.image.mode.startswith('I;16')
+            if (sixteen_bit):
+                self.logger.debug("quality: fudged conversion from mode %s to L"
                                   % (self.image.mode))
-                self.image = self.image.convert('I')
-                self.image = self.image.point(lambda i: i * (1.0 / 256.0))
-            if (self.image.mode not in ('1', 'L', 'RGB', 'RGBA')):
+                if (self.image.mode in HIGH_BYTE_OFFSETS):
+                    self.image = high_byte_image(self.image)
+                else:
+                    self.image = self.image.convert('I')
+                    self.image = self.image.point(lambda i: i * (1.0 / 256.0))
+            if (sixteen_bit or self.image.mode not in ('1', 'L', 'RGB', 'RGBA')):
                 # Need to convert from palette etc. in order to write out
                 self.logger.debug("quality: converting from mode %s to RGB"
                                   % (self.image.mode))
-                self.image = self.image.convert('RGB')
+                self.convert('RGB')
             else:
                 self.logger.debug("quality: quality (nop)")
 
+    def convert_to_srgb(self):
+        """Convert self.image to sRGB if the source has an ICC profile.
+
+        Does nothing unless icc_transforms is set. The transform for the
+        profile is taken from icc_transforms, which returns None if the
+        profile is sRGB already or the image mode is not supported.
+        """
+        if (self.icc_transforms is None or not self.icc_profile):
+            return
+        transform = self.icc_transforms.get(self.icc_profile, self.image.mode,
+                                            self.icc_intent)
+        if (transform is not None):
+            self.logger.debug("quality: converting from ICC profile to sRGB")
+            self.image = transform.apply(self.image)
+
+    def can_pass_through(self):
+        """Return True if the source file can be served unchanged for the current request.
+
+        This is the case if the plan has no region, size or rotation
+        operation, the quality conversion leaves the source mode
+        unchanged, the requested format is the source format, and there
+        is no colour conversion to sRGB to do. Sources with more than one
+        frame, or with EXIF orientation that a viewer would apply to the
+        source but not to a re-encoded image, are not passed through.
+        """
+        return (self.plan == ('quality',) and self.keeps_source_pixels() and
+                self.image.getexif().get(EXIF_ORIENTATION, 1) == 1)
+
+    def keeps_source_pixels(self):
+        """Return True if quality and format for the current request keep the source pixels.
+
+        The requested format must be the source format, the quality
+        conversion must leave the source mode unchanged, the source must
+        have a single frame, and there must be no colour conversion to
+        sRGB to do.
+        """
+        if (self.image is None):
+            return False
+        fmt = PASSTHROUGH_FORMATS.get(self.image.format, (None,))[0]
+        if (fmt is None or fmt != (self.request.format or 'jpg')):
+            return False
+        if (self.image.mode not in PASSTHROUGH_MODES.get(self.quality_to_apply(), ())):
+            return False
+        if (getattr(self.image, 'n_frames', 1) > 1):
+            return False
+        if (self.icc_transforms is not None and self.icc_profile and
+                self.icc_transforms.get(self.icc_profile, self.image.mode,
+                                        self.icc_intent) is not None):
+            return False
+        return True
+
+    def do_passthrough(self):
+        """Serve the source file unchanged, without decoding it."""
+        (self.output_format, self.mime_type) = PASSTHROUGH_FORMATS[self.image.format]
+        self.logger.debug("passthrough: source %s served as %s"
+                          % (self.srcfile, self.output_format))
+        super(IIIFManipulatorPIL, self).do_passthrough()
+
+    def apply_plan(self):
+        """Apply plan, losslessly with jpegtran if possible."""
+        commands = self.jpegtran_commands()
+        if (commands is not None and self.run_stage('do_jpegtran', commands)):
+            return
+        super(IIIFManipulatorPIL, self).apply_plan()
+
+    def jpeg_mcu_size(self):
+        """Get size (width, height) in pixels of the MCU of a JPEG source.
+
+        From the largest horizontal and vertical sampling factors of the
+        components, which PIL gives in image.layer.
+        """
+        layer = getattr(self.image, 'layer', None) or [(1, 1, 1, 0)]
+        return (8 * max(c[1] for c in layer), 8 * max(c[2] for c in layer))
+
+    def jpegtran_commands(self):
+        """Make list of jpegtran commands for the output for the current request.
+
+        Returns None unless jpegtran is set and the request can be done
+        losslessly on a JPEG source: region with top-left corner on an
+        MCU boundary, no scaling, rotation by 90, 180 or 270 degrees and
+        no mirroring, quality and format that keep the source pixels.
+        The first command crops the region and the second, if needed,
+        rotates it with -perfect so that it fails rather than leaving
+        partial edge MCUs untransformed. Requests that can be passed
+        through are not considered.
+        """
+        if (self.jpegtran is None or self.image is None or
+                self.image.format != 'JPEG' or not self.keeps_source_pixels()):
+            return None
+        r = self.request
+        rot = r.rotation_deg or 0.0
+        if (r.rotation_mirror or rot not in (0.0, 90.0, 180.0, 270.0)):
+            return None
+        (x, y, w, h) = self.region_to_apply()
+        if (x is None):
+            (w, h) = (self.width, self.height)
+        elif (w <= 0 or h <= 0):
+            return None
+        else:
+            (mw, mh) = self.jpeg_mcu_size()
+            if (x % mw != 0 or y % mh != 0):
+                return None
+        size = self.lookahead_size(w, h)
+        if (size is not None and size != (w, h)):
+            return None
+        commands = []
+        if (x is not None):
+            commands.append([self.jpegtran, '-copy', 'none',
+                             '-crop', '%dx%d+%d+%d' % (w, h, x, y)])
+        if (rot != 0.0):
+            commands.append([self.jpegtran, '-copy', 'none', '-perfect',
+                             '-rotate', '%d' % (rot)])
+        if (not commands):
+            return None
+        # First command reads the source file
+        commands[0].append(self.srcfile)
+        return commands
+
+    def do_jpegtran(self, commands):
+        """Make output by running jpegtran commands on the source.
+
+        The first command reads the source file and each other command
+        reads the output of the previous one. Output is
+        written to self.outfile if set, else to self.outbytes if
+        self.in_memory is set, else to a new temporary file. Returns True
+        on success, False if a command fails, in which case there is no
+        output.
+        """
+        data = None
+        for command in commands:
+            self.logger.debug("jpegtran: %s" % (' '.join(command)))
+            try:
+                proc = subprocess.Popen(command, stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE)
+                (data, err) = proc.communicate(data)
+            except OSError as e:
+                self.logger.warning("jpegtran: failed to run (%s)" % (str(e)))
+                return False
+            if (proc.returncode != 0 or not data):
+                self.logger.debug("jpegtran: failed, falling back (%s)"
+                                  % (err.decode('utf-8', 'replace').strip()))
+                return False
+        self.mime_type = 'image/jpeg'
+        self.output_format = 'jpg'
+        self.outbytes = None
+        if (self.outfile is None and self.in_memory):
+            self.outbytes = data
+        else:
+            if (self.outfile is None):
+                f = tempfile.NamedTemporaryFile(delete=False)
+                self.outfile = f.name
+                self.outtmp = f.name
+            else:
+                f = open(self.outfile, 'wb')
+            with f:
+                f.write(data)
+        return True
+
     def do_format(self, format):
         """Apply format selection.
 
         Assume that for tiling applications we want jpg so return
         that unless an explicit format is requested.
+
+        Output is written to self.outfile if set, else to self.outbytes
+        if self.in_memory is set, else to a new temporary file.
         """
         fmt = ('jpg' if (format is None) else format)
         if (fmt == 'png'):
@@ -168,19 +1024,51 @@ class IIIFManipulatorPIL(IIIFManipulator):
         else:
             raise IIIFError(code=415, parameter='format',
                             text="Unsupported output file format (%s), only png,jpg,webp are supported." % (fmt))
-        if (self.outfile is None):
+        options = self.encoder_options(format)
+        image = self.image
+        if (image is self.cached_image):
+            # save() sets encoderinfo and encoderconfig on the image so
+            # save from a new image object sharing the decoded pixels
+            # rather than the image shared with other requests
+            image = image._new(image.im)
+        self.outbytes = None
+        if (self.outfile is None and self.in_memory):
+            # Encode to bytes in memory
+            buf = io.BytesIO()
+            image.save(buf, format=format, **options)
+            self.outbytes = buf.getvalue()
+        elif (self.outfile is None):
             # Create temp
             f = tempfile.NamedTemporaryFile(delete=False)
             self.outfile = f.name
             self.outtmp = f.name
-            self.image.save(f, format=format)
+            image.save(f, format=format, **options)
         else:
             # Save to specified location
-            self.image.save(self.outfile, format=format)
+            image.save(self.outfile, format=format, **options)
+
+    def encoder_options(self, format):
+        """PIL save() options for format from the encoder profile to use.
+
+        The profile is self.encoder_profile unless self.image is large
+        and self.encoder_profile_large is set. Raises an IIIFError if
+        the profile is not known.
+        """
+        profile = self.encoder_profile
+        if (self.encoder_profile_large is not None and
+                self.image.size[0] * self.image.size[1] >= self.encoder_large_pixels):
+            profile = self.encoder_profile_large
+        if (profile not in ENCODER_PROFILES):
+            raise IIIFError(code=500, text="Unknown encoder profile %s" % (profile))
+        return dict(ENCODER_PROFILES[profile].get(format, {}))
 
     def cleanup(self):
-        """Cleanup: ensure image closed and remove temporary output file."""
-        if self.image:
+        """Cleanup: ensure image closed and remove temporary output file.
+
+        An image from the image cache, or shared by derive_many()
+        requests, is not closed.
+        """
+        if (self.image and self.image is not self.cached_image):
             try:
                 self.image.close()
             except Exception:
@@ -188,6 +1076,7 @@ class IIIFManipulatorPIL(IIIFManipulator):
         if (self.outtmp is not None):
             try:
                 os.unlink(self.outtmp)
+                self.outtmp = None
             except OSError as e:
                 self.logger.warning("Failed to cleanup tmp output file %s"
                                     % (self.outtmp))
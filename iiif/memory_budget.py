@@ -0,0 +1,65 @@
+"""Process-wide budget for memory used by image manipulations.
+
+A manipulator with a MemoryBudget estimates the peak memory of a request
+before any pixels are decoded and acquires that many bytes from the
+budget, releasing them when the request is done. A request that would
+exceed the budget waits until other requests release enough memory, up
+to a timeout, and is otherwise rejected with a 503 response with a
+Retry-After header. A request that is bigger than the whole budget is
+rejected immediately. Cheap requests, such as tiles, need little of
+the budget so that one heavy request cannot starve them, or use so
+much memory that the process is killed.
+"""
+
+import threading
+from timeit import default_timer
+
+from .error import IIIFError
+
+
+class MemoryBudget(object):
+    """Thread-safe counting semaphore of bytes of memory."""
+
+    def __init__(self, max_bytes, timeout=10.0, retry_after=5):
+        """Initialize MemoryBudget object.
+
+        Keyword arguments:
+        max_bytes -- total bytes that may be acquired at once
+        timeout -- seconds that acquire() waits for memory to be released
+        retry_after -- seconds given in Retry-After header when rejected
+        """
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.bytes = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, nbytes):
+        """Acquire nbytes from the budget, waiting up to self.timeout.
+
+        Raises an IIIFError with code 503 and a Retry-After header if the
+        memory cannot be acquired.
+        """
+        if (nbytes > self.max_bytes):
+            raise self.error("Request needs %d bytes, more than memory budget of %d bytes"
+                             % (nbytes, self.max_bytes))
+        deadline = default_timer() + self.timeout
+        with self._cond:
+            while (self.bytes + nbytes > self.max_bytes):
+                remaining = deadline - default_timer()
+                if (remaining <= 0):
+                    raise self.error("Timed out waiting for %d bytes of memory budget"
+                                     % (nbytes))
+                self._cond.wait(remaining)
+            self.bytes += nbytes
+
+    def release(self, nbytes):
+        """Release nbytes back to the budget."""
+        with self._cond:
+            self.bytes -= nbytes
+            self._cond.notify_all()
+
+    def error(self, text):
+        """Make IIIFError for request rejected with text."""
+        return IIIFError(code=503, parameter='memory', text=text,
+                         headers={'Retry-After': str(self.retry_after)})
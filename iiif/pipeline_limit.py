@@ -0,0 +1,73 @@
+"""Process-wide limit on the number of concurrent subprocess pipelines.
+
+Each netpbm request runs a pipeline of several converter processes. In
+a threaded server a burst of requests would otherwise fork hundreds of
+converters at once. A manipulator with a PipelineLimit acquires a slot
+before starting a pipeline and releases it when the pipeline has
+finished. Requests beyond the limit queue for a slot, up to a timeout,
+and are otherwise rejected with a 503 response with a Retry-After
+header. The queue may also be bounded so that a request is rejected
+immediately rather than wait behind too many others.
+"""
+
+import threading
+from timeit import default_timer
+
+from .error import IIIFError
+
+
+class PipelineLimit(object):
+    """Thread-safe counting semaphore of pipeline slots with a queue."""
+
+    def __init__(self, max_pipelines, timeout=10.0, retry_after=5, max_waiting=None):
+        """Initialize PipelineLimit object.
+
+        Keyword arguments:
+        max_pipelines -- number of pipelines that may run at once
+        timeout -- seconds that acquire() waits for a slot
+        retry_after -- seconds given in Retry-After header when rejected
+        max_waiting -- number of requests that may wait for a slot, or
+                       None for no limit
+        """
+        self.max_pipelines = max_pipelines
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.max_waiting = max_waiting
+        self.running = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """Acquire a pipeline slot, waiting up to self.timeout.
+
+        Raises an IIIFError with code 503 and a Retry-After header if no
+        slot can be acquired.
+        """
+        deadline = default_timer() + self.timeout
+        with self._cond:
+            if (self.running < self.max_pipelines):
+                self.running += 1
+                return
+            if (self.max_waiting is not None and self.waiting >= self.max_waiting):
+                raise self.error("Too many requests waiting for a pipeline slot")
+            self.waiting += 1
+            try:
+                while (self.running >= self.max_pipelines):
+                    remaining = deadline - default_timer()
+                    if (remaining <= 0):
+                        raise self.error("Timed out waiting for a pipeline slot")
+                    self._cond.wait(remaining)
+                self.running += 1
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        """Release a pipeline slot."""
+        with self._cond:
+            self.running -= 1
+            self._cond.notify()
+
+    def error(self, text):
+        """Make IIIFError for request rejected with text."""
+        return IIIFError(code=503, parameter='pipeline', text=text,
+                         headers={'Retry-After': str(self.retry_after)})
@@ -0,0 +1,202 @@
+"""Row-streaming reading of regions of PNG images with PIL.
+
+PNG has no random access: the image is a single zlib stream of rows,
+each filtered with reference to the row above. PIL will decode the
+whole image to read any region of it, so for a large PNG a small tile
+costs the time and memory of the whole image. Instead png_region()
+decompresses rows in a stream, stopping at the bottom edge of the
+region, and has PIL unfilter them in bands of rows. Only the columns
+of the region are kept from each band, optionally reduced in size as
+they arrive, so that the memory used is proportional to the region
+and a band rather than to the whole image.
+
+Each band is decoded by PIL's PNG row decoder as a small image made of
+the filtered rows of the band preceded by the unfiltered last row of
+the previous band (with filter type None), which the filters of the
+first row of the band may refer to. Rows above the region need to be
+unfiltered only from the last row that has filter type None or Sub,
+neither of which refer to the row above.
+
+Non-interlaced images with the PIL raw modes in PNG_RAWMODES, which
+include 8-bit L, LA, RGB and RGBA, palette images of any bit depth,
+bilevel and 16-bit gray, are supported. Other images are left for PIL
+to decode.
+"""
+
+import math
+import struct
+import zlib
+
+from PIL import Image
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# PIL raw modes of PNG rows that can also be written from PIL images
+PNG_RAWMODES = ('1', 'L', 'LA', 'RGB', 'RGBA', 'P', 'P;1', 'P;2', 'P;4',
+                'I;16B')
+
+# Bits per pixel for each color type (number of samples) with bit depth
+PNG_SAMPLES = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+# Bytes of raw rows in each band decoded
+BAND_BYTES = 4 * 1024 * 1024
+
+# Bytes of compressed data read at a time
+READ_BYTES = 64 * 1024
+
+
+def png_rawmode(image):
+    """Get PIL raw mode of rows of PNG image if it can be read row-wise, else None."""
+    if (image.format != 'PNG' or len(image.tile) != 1 or image.info.get('interlace')):
+        return None
+    rawmode = image.tile[0][3]
+    if (isinstance(rawmode, tuple)):
+        rawmode = rawmode[0]
+    return rawmode if (rawmode in PNG_RAWMODES) else None
+
+
+def png_header(fh):
+    """Read header of PNG file fh.
+
+    Returns a dict with the image size, bit depth, color type and
+    interlace method from IHDR, the number of bytes in each raw row
+    (without the filter type byte), and a list of (offset, length) for
+    the data of the IDAT chunks. Returns None if fh is not a PNG file.
+    """
+    fh.seek(0)
+    if (fh.read(8) != PNG_SIGNATURE):
+        return None
+    header = {'idat': []}
+    pos = 8
+    while True:
+        fh.seek(pos)
+        data = fh.read(8)
+        if (len(data) < 8):
+            break
+        (length, chunk) = struct.unpack('>I4s', data)
+        if (chunk == b'IHDR'):
+            (width, height, depth, color_type, compression, filter_method,
+             interlace) = struct.unpack('>IIBBBBB', fh.read(13))
+            header.update({'size': (width, height), 'depth': depth,
+                           'color_type': color_type, 'interlace': interlace})
+        elif (chunk == b'IDAT'):
+            header['idat'].append((pos + 8, length))
+        elif (chunk == b'IEND'):
+            break
+        pos += length + 12
+    if ('size' not in header or header['color_type'] not in PNG_SAMPLES):
+        return None
+    bits = header['size'][0] * header['depth'] * PNG_SAMPLES[header['color_type']]
+    header['row_bytes'] = (bits + 7) // 8
+    return header
+
+
+def png_rows(fh, header, nrows):
+    """Generate the first nrows filtered rows of PNG image fh.
+
+    Each row is bytes with the filter type followed by the filtered row.
+    Compressed data is read and decompressed only as needed, and at most
+    BAND_BYTES are decompressed at a time because the data of a simple
+    image may be very highly compressed.
+    """
+    stride = header['row_bytes'] + 1
+    inflate = zlib.decompressobj()
+    buf = b''
+    y = 0
+    for (offset, length) in header['idat']:
+        fh.seek(offset)
+        while (length > 0):
+            data = fh.read(min(length, READ_BYTES))
+            if (not data):
+                return
+            length -= len(data)
+            while (data):
+                buf += inflate.decompress(data, BAND_BYTES)
+                data = inflate.unconsumed_tail
+                n = len(buf) // stride
+                for j in range(min(n, nrows - y)):
+                    yield buf[j * stride:(j + 1) * stride]
+                y += n
+                if (y >= nrows):
+                    return
+                buf = buf[n * stride:]
+
+
+def decode_rows(image, rawmode, rows, prev=None):
+    """Decode filtered PNG rows to an image with PIL.
+
+    If prev is given it is the unfiltered raw row before the rows, and is
+    included as the first row of the image returned.
+    """
+    data = b''.join(rows)
+    height = len(rows)
+    if (prev is not None):
+        data = b'\x00' + prev + data
+        height += 1
+    return Image.frombytes(image.mode, (image.size[0], height),
+                           zlib.compress(data, 0), 'zip', rawmode)
+
+
+def png_region(filename, image, box, reduce=1):
+    """Read just the rows and columns of PNG image that cover box.
+
+    The image must be a PIL image opened from filename that has not yet
+    been loaded. The box (x0, y0, x1, y1) may have non-integer
+    coordinates. If reduce is more than 1 then the region read is
+    reduced by that factor with Image.reduce(), the box is first
+    expanded to multiples of reduce. Returns (region_image, (ox, oy))
+    where the region image covers box and has origin at (ox, oy) in the
+    (reduced) image. Returns None if the image cannot be read row-wise or
+    if the region is the whole image and there is no reduction, in which
+    case PIL should simply decode the image.
+    """
+    rawmode = png_rawmode(image)
+    if (rawmode is None):
+        return None
+    (width, height) = image.size
+    x0 = max(0, int(box[0]) // reduce * reduce)
+    y0 = max(0, int(box[1]) // reduce * reduce)
+    x1 = min(width, int(math.ceil(box[2])))
+    y1 = min(height, int(math.ceil(box[3])))
+    if (x1 <= x0 or y1 <= y0 or
+            ((x0, y0, x1, y1) == (0, 0, width, height) and reduce == 1)):
+        return None
+    with open(filename, 'rb') as fh:
+        header = png_header(fh)
+        if (header is None or header['interlace'] != 0 or
+                header['size'] != (width, height)):
+            return None
+        band = max(1, BAND_BYTES // (header['row_bytes'] + 1) // reduce) * reduce
+        size = ((x1 - x0 + reduce - 1) // reduce, (y1 - y0 + reduce - 1) // reduce)
+        region = Image.new(image.mode, size)
+        if (image.mode == 'P' and image.palette is not None):
+            region.putpalette(image.palette.palette, image.palette.mode)
+        if ('transparency' in image.info):
+            region.info['transparency'] = image.info['transparency']
+        # Filtered rows not yet decoded starting at row start, and the
+        # unfiltered row before them
+        (rows, start, prev) = ([], 0, None)
+        for (y, row) in enumerate(png_rows(fh, header, y1)):
+            if (y <= y0 and row[0:1] in (b'\x00', b'\x01')):
+                # Row does not refer to the row above, skip rows before it
+                (rows, start, prev) = ([], y, None)
+            rows.append(row)
+            if ((y < y0 and len(rows) < band) or
+                    (y >= y0 and (y + 1 - y0) % band != 0 and y + 1 < y1)):
+                continue
+            decoded = decode_rows(image, rawmode, rows, prev)
+            top = 0 if (prev is None) else 1
+            last = decoded.size[1] - 1
+            prev = decoded.crop((0, last, width, last + 1)).tobytes('raw', rawmode)
+            if (y >= y0):
+                # Keep region columns of rows from y0
+                skip = max(0, y0 - start)
+                part = decoded.crop((x0, top + skip, x1, decoded.size[1]))
+                if (reduce > 1):
+                    part = part.reduce(reduce)
+                region.paste(part, (0, (start + skip - y0) // reduce))
+            (rows, start) = ([], y + 1)
+        if (start < y1):
+            # Image data ended early
+            return None
+    return (region, (x0 // reduce, y0 // reduce))
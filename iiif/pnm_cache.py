@@ -0,0 +1,174 @@
+"""Cache on disk of decoded PNM source images for the netpbm manipulator.
+
+The netpbm manipulator otherwise decodes the source image with
+jpegtopnm, pngtopnm or jpeg2ktopam for every request, even for the
+neighbouring tiles of one image that a viewer requests together. A
+PNMCache keeps the decoded PNM of each source in a directory, keyed by
+source file path and modification time so that a changed source is
+decoded afresh. The files are used as least recently used by their
+modification time, which is updated on each use, and the oldest are
+removed to keep the total size within a budget. The directory may be
+shared by several processes.
+
+Because raw PNM has fixed size rows, write_rows() can hand the next
+program in a pipeline just the rows of a region, read via mmap, rather
+than the whole image.
+"""
+
+import hashlib
+import mmap
+import os
+import os.path
+import tempfile
+import threading
+
+from .image_header import pnm_header_bytes, pnm_row_bytes
+
+# Bytes written at a time by write_rows()
+WRITE_BYTES = 1024 * 1024
+
+
+def write_rows(fh, header, y, nrows, out):
+    """Write PNM image with rows y to y+nrows of PNM file fh to out.
+
+    The header is the parsed header of fh, which must be a raw (P4-P7)
+    PNM image. Only the pages of the file with the rows written are read.
+    """
+    row_bytes = pnm_row_bytes(header)
+    out.write(pnm_header_bytes(header, (header['size'][0], nrows)))
+    start = header['length'] + y * row_bytes
+    end = start + nrows * row_bytes
+    mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        for pos in range(start, end, WRITE_BYTES):
+            out.write(mm[pos:min(end, pos + WRITE_BYTES)])
+    finally:
+        mm.close()
+
+
+class PNMCache(object):
+    """Thread-safe LRU cache of decoded PNM files with a size budget."""
+
+    def __init__(self, directory, max_bytes=1024 * 1024 * 1024):
+        """Initialize PNMCache object.
+
+        Keyword arguments:
+        directory -- directory for PNM files, created if necessary
+        max_bytes -- budget for total size of PNM files in cache
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if (not os.path.isdir(self.directory)):
+            os.makedirs(self.directory)
+
+    def __len__(self):
+        """Return number of PNM files in cache."""
+        return len(self.entries())
+
+    def key(self, path):
+        """Get cache key for source file path, the absolute path and modification time.
+
+        Returns None if the file cannot be accessed.
+        """
+        try:
+            return (os.path.abspath(path), os.path.getmtime(path))
+        except (OSError, TypeError):
+            return None
+
+    def filename(self, key):
+        """Get PNM file in cache for key."""
+        name = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name + '.pnm')
+
+    def get(self, path):
+        """Open PNM file for source file path if in cache, else None.
+
+        The file is returned open so that it may still be read if it is
+        evicted, and should be closed by the caller.
+        """
+        key = self.key(path)
+        fh = None
+        if (key is not None):
+            filename = self.filename(key)
+            try:
+                fh = open(filename, 'rb')
+                # Mark as most recently used
+                os.utime(filename, None)
+            except (IOError, OSError):
+                pass
+        with self._lock:
+            if (fh is None):
+                self.misses += 1
+            else:
+                self.hits += 1
+        return fh
+
+    def put(self, path, write):
+        """Add PNM for source file path to cache, written by write(fh).
+
+        The PNM is written to a temporary file in the cache directory
+        which is renamed once complete so that a partly written PNM is
+        never used. Least recently used files are then evicted to keep
+        within the budget. Returns the PNM file open for reading, or None
+        if the source file cannot be accessed.
+        """
+        key = self.key(path)
+        if (key is None):
+            return None
+        filename = self.filename(key)
+        (fd, tmpfile) = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                write(fh)
+            os.rename(tmpfile, filename)
+        except BaseException:
+            os.unlink(tmpfile)
+            raise
+        fh = open(filename, 'rb')
+        self.evict(keep=filename)
+        return fh
+
+    def entries(self):
+        """Get list of (mtime, bytes, filename) for PNM files in cache."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if (name.endswith('.pnm')):
+                filename = os.path.join(self.directory, name)
+                try:
+                    st = os.stat(filename)
+                except OSError:
+                    # Removed by another process
+                    continue
+                entries.append((st.st_mtime, st.st_size, filename))
+        return entries
+
+    def evict(self, keep=None):
+        """Remove least recently used PNM files to keep within budget.
+
+        The file keep, which has just been added, is not removed.
+        """
+        with self._lock:
+            entries = sorted(self.entries())
+            total = sum([entry[1] for entry in entries])
+            for (mtime, nbytes, filename) in entries:
+                if (total <= self.max_bytes):
+                    break
+                if (filename == keep):
+                    continue
+                try:
+                    os.unlink(filename)
+                except OSError:
+                    pass
+                total -= nbytes
+
+    def clear(self):
+        """Remove all PNM files from cache."""
+        with self._lock:
+            for (mtime, nbytes, filename) in self.entries():
+                try:
+                    os.unlink(filename)
+                except OSError:
+                    pass
@@ -0,0 +1,104 @@
+"""Pool of worker processes to run image manipulations.
+
+In a threaded server the python parts of image manipulations are
+serialized by the GIL. A ManipulatorPool runs derive() in a pool of
+worker processes so that image requests are processed in parallel on
+all cores. The request is sent to a worker as a pickled IIIFRequest
+object and the encoded image is returned as bytes, the source image is
+read by the worker.
+
+Class attributes of the manipulator classes, such as image_cache and
+stage_timer, are inherited by the workers when processes are started
+with fork (the default on Linux for python < 3.14). Each worker then
+has its own copy of any cache.
+
+The memory limit, if set, is applied to each worker process with
+resource.setrlimit(RLIMIT_AS, ...) where available (Unix). A worker
+runs one manipulation at a time so this is a per-task limit: an
+allocation beyond it raises a MemoryError which is returned as an
+IIIFError.
+"""
+
+import multiprocessing
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - not Unix
+    resource = None
+
+from .error import IIIFError
+
+
+def limit_memory(memory_limit):
+    """Limit address space of worker to memory_limit bytes, as initializer."""
+    if (memory_limit and resource is not None):
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+
+def derive_in_worker(klass, srcfile, request, settings=None):
+    """Derive image for request from srcfile with manipulator class klass.
+
+    The manipulator attributes in the dict settings are set first.
+    Returns (content, mime_type) where content is the encoded image as
+    bytes. Raises an IIIFError on failure.
+    """
+    m = klass(api_version=request.api_version)
+    for (name, value) in (settings or {}).items():
+        setattr(m, name, value)
+    m.in_memory = True
+    try:
+        (outfile, mime_type) = m.derive(srcfile, request)
+        if (m.outbytes is not None):
+            content = m.outbytes
+        else:
+            # Manipulator that writes to files only
+            with open(outfile, 'rb') as fh:
+                content = fh.read()
+        return (content, mime_type)
+    except MemoryError:
+        raise IIIFError(code=500, text="Memory limit exceeded in image manipulation")
+    finally:
+        m.cleanup()
+
+
+class ManipulatorPool(object):
+    """Pool of worker processes for derive()."""
+
+    def __init__(self, processes=None, maxtasksperchild=None, memory_limit=None):
+        """Initialize ManipulatorPool object and start worker processes.
+
+        Keyword arguments:
+        processes -- number of worker processes, default is the number
+            of cores
+        maxtasksperchild -- number of manipulations after which a worker
+            is replaced with a new process, default is no limit
+        memory_limit -- limit in bytes on memory of each worker process,
+            default is no limit
+        """
+        self.processes = processes or multiprocessing.cpu_count()
+        self.maxtasksperchild = maxtasksperchild
+        self.memory_limit = memory_limit
+        self.pool = multiprocessing.Pool(processes=self.processes,
+                                         initializer=limit_memory,
+                                         initargs=(memory_limit,),
+                                         maxtasksperchild=maxtasksperchild)
+
+    def derive(self, klass, srcfile, request, settings=None):
+        """Derive image for request from srcfile in a worker process.
+
+        The manipulator attributes in the dict settings are set before
+        the manipulation. Blocks until the worker has finished. Returns
+        (content, mime_type) where content is the encoded image as bytes,
+        raises an IIIFError on failure.
+        """
+        try:
+            return self.pool.apply(derive_in_worker, (klass, srcfile, request, settings))
+        except IIIFError:
+            raise
+        except Exception as e:
+            raise IIIFError(code=500, text="Image manipulation failed in worker process (%s)" % (str(e)))
+
+    def close(self):
+        """Stop worker processes once all pending manipulations are done."""
+        self.pool.close()
+        self.pool.join()
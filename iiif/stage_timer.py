@@ -0,0 +1,80 @@
+"""Sampled timing of the stages of IIIFManipulator.derive().
+
+A StageTimer set as the stage_timer attribute of a manipulator class
+records, for a sample of derive() calls, the wall time and image buffer
+size of each of the do_first, do_region, do_size, do_rotation,
+do_quality, do_format and do_last stages. The timings are available in
+the timings attribute of the manipulator after derive() and are passed
+to an optional sink, any callable taking the manipulator and the
+timings. Whether a derive() call is sampled is decided once at its
+start and calls that are not sampled are not instrumented at all, so a
+low sample rate keeps the overhead negligible.
+
+The image buffer size is the approximate number of bytes of the
+decoded image held by the manipulator at the end of the stage, from
+the manipulator's image_bytes() method. It is a property of the request
+alone, unaffected by concurrent requests, and cheap to read, but it is
+not the memory used by the process: other python objects, encoder
+buffers and memory of external programs are not counted. It is None
+for manipulators that do not hold a decoded image, or with memory set
+False.
+"""
+
+import logging
+import random
+from timeit import default_timer
+
+
+def log_timings(manipulator, timings):
+    """Log timings for manipulator at INFO level, a sink for StageTimer."""
+    logging.getLogger(__name__).info(
+        "derive %s %s: %s" % (
+            manipulator.srcfile, manipulator.request.url(),
+            ' '.join(['%s=%.2fms%s' % (
+                stage, seconds * 1000.0,
+                '' if (nbytes is None) else '/%dkB' % (nbytes // 1024))
+                for (stage, seconds, nbytes) in timings])))
+
+
+class StageTimer(object):
+    """Sampled recorder of derive() stage timings."""
+
+    def __init__(self, sample_rate=1.0, sink=None, memory=True):
+        """Initialize StageTimer object.
+
+        Keyword arguments:
+        sample_rate -- fraction of derive() calls to time, 0.0 to 1.0
+        sink -- callable sink(manipulator, timings) called with the
+            timings of each sampled derive(), or None
+        memory -- set False to not record image buffer bytes
+        """
+        self.sample_rate = sample_rate
+        self.sink = sink
+        self.memory = memory
+
+    def sample(self):
+        """Return True if the next derive() should be timed."""
+        return (self.sample_rate >= 1.0 or
+                (self.sample_rate > 0.0 and random.random() < self.sample_rate))
+
+    def measure(self, manipulator, stage, *args):
+        """Call stage method of manipulator with args, timing it.
+
+        Appends (stage, seconds, image_bytes) to manipulator.timings and
+        returns the value returned by the method.
+        """
+        method = getattr(manipulator, stage)
+        start = default_timer()
+        try:
+            return method(*args)
+        finally:
+            seconds = default_timer() - start
+            nbytes = None
+            if (self.memory):
+                nbytes = manipulator.image_bytes()
+            manipulator.timings.append((stage, seconds, nbytes))
+
+    def report(self, manipulator, timings):
+        """Pass timings for manipulator to the sink, if any."""
+        if (self.sink is not None):
+            self.sink(manipulator, timings)
@@ -225,20 +225,22 @@ class IIIFStatic(object):
         scale_factors = im.scale_factors(self.tilesize)
         # Setup destination and IIIF identifier
         self.setup_destination()
-        # Write out images
+        # Write out images, all from one decode of the source
+        requests = []
         for (region, size) in static_partial_tile_sizes(width, height, self.tilesize, scale_factors):
-            self.generate_tile(region, size)
+            requests.append((self.tile_request(region, size), True))
         sizes = []
         for size in static_full_sizes(width, height, self.tilesize):
             # See https://github.com/zimeon/iiif/issues/9
             sizes.append({'width': size[0], 'height': size[1]})
-            self.generate_tile('full', size)
+            requests.append((self.tile_request('full', size), True))
         for request in self.extras:
             request.identifier = self.identifier
             if (request.is_scaled_full_image()):
                 sizes.append({'width': request.size_wh[0],
                               'height': request.size_wh[1]})
-            self.generate_file(request)
+            requests.append((request, False))
+        self.generate_files(requests)
         # Write info.json
         qualities = ['default'] if (self.api_version > '1.1') else ['native']
         info = IIIFInfo(level=0, server_and_prefix=self.prefix, identifier=self.identifier,
@@ -262,6 +264,10 @@ class IIIFStatic(object):
 
     def generate_tile(self, region, size):
         """Generate one tile for this given region, size of this image."""
+        self.generate_file(self.tile_request(region, size), True)
+
+    def tile_request(self, region, size):
+        """Make IIIFRequest object for tile with given region and size."""
         r = IIIFRequest(identifier=self.identifier,
                         api_version=self.api_version)
         if (region == 'full'):
@@ -270,11 +276,21 @@ class IIIFStatic(object):
             r.region_xywh = region  # [rx,ry,rw,rh]
         r.size_wh = size  # [sw,sh]
         r.format = 'jpg'
-        self.generate_file(r, True)
+        return(r)
 
     def generate_file(self, r, undistorted=False):
         """Generate file for IIIFRequest object r from this image.
 
+        See generate_files().
+        """
+        self.generate_files([(r, undistorted)])
+
+    def generate_files(self, requests):
+        """Generate files for list of (IIIFRequest, undistorted) from this image.
+
+        The files are derived with one call to the manipulator's
+        derive_many() so that the source image is decoded only once.
+
         FIXME - Would be nicer to have the test for an undistorted image request
         based on the IIIFRequest object, and then know whether to apply canonicalization
         or not.
@@ -286,24 +302,39 @@ class IIIFStatic(object):
         solely on the setting of osd_version.
         """
         use_canonical = self.get_osd_config(self.osd_version)['use_canonical']
-        height = None
-        if (undistorted and use_canonical):
-            height = r.size_wh[1]
-            r.size_wh = [r.size_wh[0], None]  # [sw,sh] -> [sw,]
-        path = r.url()
+        heights = []
+        paths = []
+        for (r, undistorted) in requests:
+            height = None
+            if (undistorted and use_canonical):
+                height = r.size_wh[1]
+                r.size_wh = [r.size_wh[0], None]  # [sw,sh] -> [sw,]
+            heights.append(height)
+            paths.append(r.url())
         # Generate...
         if (self.dryrun):
-            self.logger.info("%s / %s" % (self.dst, path))
+            results = [(None, None, None)] * len(paths)
         else:
             m = self.manipulator_klass(api_version=self.api_version)
-            try:
-                m.derive(srcfile=self.src, request=r,
-                         outfile=os.path.join(self.dst, path))
-                self.logger.info("%s / %s" % (self.dst, path))
-            except IIIFZeroSizeError:
+            results = m.derive_many(
+                self.src, [r for (r, undistorted) in requests],
+                outfiles=[os.path.join(self.dst, path) for path in paths])
+        for (n, (outfile, mime_type, error)) in enumerate(results):
+            if (isinstance(error, IIIFZeroSizeError)):
                 self.logger.info("%s / %s - zero size, skipped" %
-                                 (self.dst, path))
-                return  # done if zero size
+                                 (self.dst, paths[n]))
+                continue  # done if zero size
+            elif (error is not None):
+                raise error
+            self.logger.info("%s / %s" % (self.dst, paths[n]))
+            self.link_canonical(requests[n][0], heights[n], use_canonical)
+
+    def link_canonical(self, r, height, use_canonical):
+        """Link `w,h` form to canonical `w,` form of full region request r.
+
+        The height is the height of the image, or None if not an
+        undistorted image.
+        """
         if (r.region_full and use_canonical and height is not None):
             # In v2.0 of the spec, the canonical URI form `w,` for scaled
             # images of the full region was introduced. This is somewhat at
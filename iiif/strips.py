@@ -0,0 +1,179 @@
+"""Strip-parallel image operations with PIL.
+
+PIL releases the GIL in its C loops so an operation on a large image can
+be split into horizontal strips of the output image that are processed
+in parallel by a pool of threads and then pasted together. Only splits
+that give exactly the same result as the operation on the whole image
+are made:
+
+  * resize() where each strip maps to whole rows of the source at the
+    same scale, so that the filter coefficients (which include any
+    overlap of the filter support into neighbouring strips, read from
+    the source) are identical to those of the whole image resize
+  * reduce() with strips of whole blocks of source rows
+  * convert() and other pixel-wise operations
+  * transpose() where each strip maps to whole rows or columns of the
+    source
+
+The thread pool is created on first use in each process so that the
+module may be used in forked worker processes.
+"""
+
+import multiprocessing
+import os
+import threading
+from multiprocessing.pool import ThreadPool
+
+from PIL import Image
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def thread_pool(threads):
+    """Get shared pool of threads for this process, creating if necessary.
+
+    The pool is created with threads threads on first use in a process.
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        if (_pool is None or _pool_pid != os.getpid()):
+            _pool = ThreadPool(threads)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def default_threads():
+    """Return default number of threads, the number of cores."""
+    return multiprocessing.cpu_count()
+
+
+def strip_rows(height, strips, align=1):
+    """Split height rows into up to strips strips, return row boundaries.
+
+    Boundaries other than the last are multiples of align. Returns
+    [0, height] if the image cannot be split.
+    """
+    blocks = height // align
+    strips = min(strips, blocks)
+    if (strips < 2):
+        return [0, height]
+    return [align * (blocks * n // strips) for n in range(strips)] + [height]
+
+
+def map_strips(mode, size, func, rows, threads):
+    """Make image of mode and size from strips made by func in parallel.
+
+    The function func(y0, y1) must return the image for output rows y0
+    to y1, rows is the list of row boundaries from strip_rows(). Any
+    source image used by func must already be loaded because PIL's lazy
+    loading is not thread safe.
+    """
+    pool = thread_pool(threads)
+    bounds = list(zip(rows[:-1], rows[1:]))
+    parts = pool.map(lambda b: func(b[0], b[1]), bounds)
+    image = Image.new(mode, size)
+    for ((y0, y1), part) in zip(bounds, parts):
+        image.paste(part, (0, y0))
+    return image
+
+
+def resize_strip_rows(box, size, strips):
+    """Get row boundaries for strip-parallel resize of box to size.
+
+    The box must have integer vertical coordinates. Strips are aligned so
+    that each starts at a whole row of the source: if the box height is
+    p/q times the output height (in lowest terms) then boundaries are
+    multiples of q output rows, corresponding to p source rows.
+    """
+    (bh, h) = (int(box[3] - box[1]), size[1])
+    (p, q) = (bh, h)
+    while (q):
+        (p, q) = (q, p % q)
+    return strip_rows(h, strips, align=h // p)
+
+
+def parallel_resize(image, size, box, reducing_gap, strips, threads):
+    """Strip-parallel equivalent of image.resize(size, box=box, ...).
+
+    Returns None if the resize cannot be split exactly: if the box has
+    fractional vertical coordinates, if reducing_gap would make PIL
+    reduce first (the reduction blocks would not align across strips),
+    or if the scaling gives no whole-row alignment.
+    """
+    if (box is None):
+        box = (0, 0) + image.size
+    if (box[1] != int(box[1]) or box[3] != int(box[3])):
+        return None
+    if (reducing_gap is not None and
+            ((box[2] - box[0]) / size[0] / reducing_gap >= 2 or
+             (box[3] - box[1]) / size[1] / reducing_gap >= 2)):
+        return None
+    rows = resize_strip_rows(box, size, strips)
+    if (len(rows) < 3):
+        return None
+    image.load()
+    (bh, h) = (int(box[3] - box[1]), size[1])
+
+    def resize_strip(y0, y1):
+        src = (box[0], box[1] + y0 * bh // h, box[2], box[1] + y1 * bh // h)
+        if (reducing_gap is None):
+            return image.resize((size[0], y1 - y0), box=src)
+        return image.resize((size[0], y1 - y0), box=src,
+                            reducing_gap=reducing_gap)
+    return map_strips(image.mode, size, resize_strip, rows, threads)
+
+
+def parallel_reduce(image, factors, box, strips, threads):
+    """Strip-parallel equivalent of image.reduce(factors, box=box)."""
+    if (box is None):
+        box = (0, 0) + image.size
+    (xf, yf) = factors
+    size = ((box[2] - box[0] + xf - 1) // xf, (box[3] - box[1] + yf - 1) // yf)
+    rows = strip_rows(size[1], strips)
+    image.load()
+
+    def reduce_strip(y0, y1):
+        src = (box[0], box[1] + y0 * yf, box[2], min(box[1] + y1 * yf, box[3]))
+        # Not image.reduce() which a JPEG 2000 source shadows
+        return Image.Image.reduce(image, factors, box=src)
+    return map_strips(image.mode, size, reduce_strip, rows, threads)
+
+
+def parallel_convert(image, mode, strips, threads):
+    """Strip-parallel equivalent of image.convert(mode) for pixel-wise conversion."""
+    rows = strip_rows(image.size[1], strips)
+    image.load()
+
+    def convert_strip(y0, y1):
+        return image.crop((0, y0, image.size[0], y1)).convert(mode)
+    return map_strips(mode, image.size, convert_strip, rows, threads)
+
+
+def transpose_source_box(method, size, y0, y1):
+    """Get box in source of size that transposes with method to output rows y0 to y1."""
+    (w, h) = size
+    if (method == Image.FLIP_LEFT_RIGHT):
+        return (0, y0, w, y1)
+    elif (method in (Image.FLIP_TOP_BOTTOM, Image.ROTATE_180)):
+        return (0, h - y1, w, h - y0)
+    elif (method in (Image.ROTATE_90, Image.TRANSVERSE)):
+        return (w - y1, 0, w - y0, h)
+    else:  # ROTATE_270, TRANSPOSE
+        return (y0, 0, y1, h)
+
+
+def parallel_transpose(image, method, strips, threads):
+    """Strip-parallel equivalent of image.transpose(method)."""
+    if (method in (Image.FLIP_LEFT_RIGHT, Image.FLIP_TOP_BOTTOM, Image.ROTATE_180)):
+        size = image.size
+    else:
+        size = (image.size[1], image.size[0])
+    rows = strip_rows(size[1], strips)
+    image.load()
+
+    def transpose_strip(y0, y1):
+        box = transpose_source_box(method, image.size, y0, y1)
+        return image.crop(box).transpose(method)
+    return map_strips(image.mode, size, transpose_strip, rows, threads)
@@ -0,0 +1,218 @@
+"""Reduced resolution and tile-wise reading of TIFF images with PIL.
+
+Large TIFF masters are typically stored tiled and pyramidal, with
+reduced resolution copies of the image either as further pages (IFDs)
+in the file or as SubIFDs of the full resolution image. PIL will
+otherwise decode the whole of the first page, so these functions
+allow the IIIFManipulatorPIL to:
+
+  - select the smallest resolution level that covers a requested
+    output size, see tiff_level()
+  - read and decode only the tiles (or strips) of that level that
+    intersect the requested region, see tiff_region()
+
+Tile-wise reading is supported for 8 bits per sample, chunky,
+L/RGB/RGBA images that are uncompressed or use deflate, packbits
+or JPEG compression. Other images are left for PIL to decode.
+"""
+
+import io
+import math
+import zlib
+
+from PIL import Image
+
+# TIFF tags used
+NEWSUBFILETYPE = 254
+BITSPERSAMPLE = 258
+COMPRESSION = 259
+PHOTOMETRIC = 262
+STRIPOFFSETS = 273
+ROWSPERSTRIP = 278
+STRIPBYTECOUNTS = 279
+PLANARCONFIG = 284
+PREDICTOR = 317
+TILEWIDTH = 322
+TILELENGTH = 323
+TILEOFFSETS = 324
+TILEBYTECOUNTS = 325
+SUBIFDS = 330
+JPEGTABLES = 347
+
+# Compression values we can decode tile by tile, mapped to PIL decoder
+COMPRESSION_DECODERS = {
+    1: 'raw',
+    8: 'deflate',
+    32946: 'deflate',
+    32773: 'packbits',
+    7: 'jpeg'
+}
+
+# Photometric interpretation values: 1 = BlackIsZero, 2 = RGB, 6 = YCbCr
+TILE_MODES = {
+    'L': (1,),
+    'RGB': (2, 6),
+    'RGBA': (2,)
+}
+
+
+def tiff_level(image, width, height):
+    """Get smallest resolution level of TIFF image at least width by height.
+
+    Reduced resolution levels are the other pages of the image, and the
+    SubIFDs of the first page, that are marked as reduced resolution
+    images by bit 0 of NewSubfileType and that have the same mode and
+    aspect ratio as the first page but are smaller. Other pages of a
+    multi-page TIFF are not levels. Only the headers of levels are read.
+    Returns the PIL image for the level selected: either image itself,
+    possibly after seek() to another page, or an image opened at the
+    SubIFD.
+    """
+    (full_w, full_h) = image.size
+    # Recorded here as image itself changes mode with seek()
+    full_mode = image.mode
+    best = None
+    best_width = full_w
+
+    def covers(level):
+        (lw, lh) = level.size
+        return (level.tag_v2.get(NEWSUBFILETYPE, 0) & 1 and
+                level.mode == full_mode and
+                lw < best_width and lw >= width and lh >= height and
+                abs(lw * full_h - lh * full_w) <= max(full_w, full_h))
+
+    for n in range(1, getattr(image, 'n_frames', 1)):
+        image.seek(n)
+        if (covers(image)):
+            (best, best_width) = (n, image.size[0])
+    if (image.tell() != 0):
+        image.seek(0)
+    offsets = image.tag_v2.get(SUBIFDS, ())
+    if (not isinstance(offsets, tuple)):
+        offsets = (offsets,)
+    for offset in offsets:
+        child = open_subifd(image, offset)
+        if (child is None):
+            continue
+        if (covers(child)):
+            if (isinstance(best, Image.Image)):
+                best.close()
+            (best, best_width) = (child, child.size[0])
+        else:
+            child.close()
+    if (best is None):
+        return image
+    elif (isinstance(best, int)):
+        image.seek(best)
+        return image
+    return best
+
+
+def open_subifd(image, offset):
+    """Open the SubIFD at offset in TIFF image, or None if not possible.
+
+    The file is opened again and only the header of the SubIFD is read,
+    as by PIL's get_child_images() but without loading the image data.
+    """
+    filename = getattr(image, 'filename', None)
+    if (not filename):
+        return None
+    try:
+        child = Image.open(filename)
+    except (IOError, OSError):
+        return None
+    try:
+        child._frame_pos = [offset]
+        child._seek(0)
+    except Exception:
+        child.close()
+        return None
+    return child
+
+
+def tiff_tile_layout(image):
+    """Get tile layout for tile-wise reading of TIFF image, or None.
+
+    Returns (tile_width, tile_height, offsets, bytecounts, decoder) where
+    strips are treated as tiles that are the full image width. Returns
+    None if the image is not one that we can read tile-wise.
+    """
+    tags = getattr(image, 'tag_v2', None)
+    if (tags is None or image.mode not in TILE_MODES):
+        return None
+    decoder = COMPRESSION_DECODERS.get(tags.get(COMPRESSION, 1))
+    photometric = tags.get(PHOTOMETRIC)
+    bits = tags.get(BITSPERSAMPLE, (1,))
+    if (not isinstance(bits, tuple)):
+        bits = (bits,)
+    if (decoder is None or
+            photometric not in TILE_MODES[image.mode] or
+            (photometric == 6 and decoder != 'jpeg') or
+            any(b != 8 for b in bits) or
+            tags.get(PLANARCONFIG, 1) != 1 or
+            tags.get(PREDICTOR, 1) != 1):
+        return None
+    if (TILEOFFSETS in tags):
+        return (tags[TILEWIDTH], tags[TILELENGTH],
+                tags[TILEOFFSETS], tags[TILEBYTECOUNTS], decoder)
+    elif (STRIPOFFSETS in tags):
+        return (image.size[0], tags.get(ROWSPERSTRIP, image.size[1]),
+                tags[STRIPOFFSETS], tags[STRIPBYTECOUNTS], decoder)
+    return None
+
+
+def decode_tile(image, data, size, decoder):
+    """Decode data for one tile of image to PIL image of given size."""
+    if (decoder == 'jpeg'):
+        # Abbreviated JPEG stream, tables are in the JPEGTables tag
+        tables = image.tag_v2.get(JPEGTABLES)
+        if (tables):
+            data = tables[:-2] + data[2:]
+        tile = Image.open(io.BytesIO(data))
+        if (tile.mode != image.mode):
+            tile = tile.convert(image.mode)
+        return tile
+    elif (decoder == 'deflate'):
+        data = zlib.decompress(data)
+        decoder = 'raw'
+    return Image.frombytes(image.mode, size, data, decoder, image.mode)
+
+
+def tiff_region(filename, image, box):
+    """Read just the tiles of TIFF image that intersect box.
+
+    The image must be a PIL image opened from filename that has not
+    yet been loaded. The box (x0, y0, x1, y1) may have non-integer
+    coordinates. Returns (region_image, (ox, oy)) where the region image
+    covers all tiles that intersect box and has origin at (ox, oy) in
+    image. Returns None if the image cannot be read tile-wise or if
+    the tiles required cover the whole image, in which case PIL should
+    simply decode the image.
+    """
+    layout = tiff_tile_layout(image)
+    if (layout is None):
+        return None
+    (tw, th, offsets, bytecounts, decoder) = layout
+    (width, height) = image.size
+    across = (width + tw - 1) // tw
+    # Tile grid indexes covering box
+    tx0 = max(0, int(box[0]) // tw)
+    ty0 = max(0, int(box[1]) // th)
+    tx1 = min(across, int(math.ceil(box[2] / float(tw))))
+    ty1 = min((height + th - 1) // th, int(math.ceil(box[3] / float(th))))
+    (ox, oy) = (tx0 * tw, ty0 * th)
+    size = (min(tx1 * tw, width) - ox, min(ty1 * th, height) - oy)
+    if (size == (width, height) or size[0] <= 0 or size[1] <= 0):
+        return None
+    region = Image.new(image.mode, size)
+    with open(filename, 'rb') as fh:
+        for ty in range(ty0, ty1):
+            for tx in range(tx0, tx1):
+                n = ty * across + tx
+                fh.seek(offsets[n])
+                data = fh.read(bytecounts[n])
+                # Strips may be short at the bottom of the image
+                tsize = (tw, min(th, height - ty * th) if tw == width else th)
+                tile = decode_tile(image, data, tsize, decoder)
+                region.paste(tile, (tx * tw - ox, ty * th - oy))
+    return (region, (ox, oy))
@@ -37,8 +37,13 @@ class CGI_responder(object):
         print("%s: %s\r" % (header, value))
 
     def end_headers(self):
-        """End HTTP headers with blank line."""
+        """End HTTP headers with blank line.
+
+        Flush so that headers are written before any body written
+        to the underlying binary stream.
+        """
         print("\r")
+        sys.stdout.flush()
 
 
 class IIIFRequestHandler(CGI_responder):
@@ -59,7 +64,7 @@ class IIIFRequestHandler(CGI_responder):
         # BaseHTTPServer.BaseHTTPRequestHandler.__init__(self, request, client_address, server)
         self.path = (os.environ['PATH_INFO'] if (
             'PATH_INFO' in os.environ) else '/bogus')
-        self.wfile = sys.stdout
+        self.wfile = getattr(sys.stdout, 'buffer', sys.stdout)
 
     def error_response(self, code, content=''):
         """Construct and send error response."""
@@ -67,7 +72,7 @@ class IIIFRequestHandler(CGI_responder):
         self.send_header('Content-Type', 'text/xml')
         self.add_compliance_header()
         self.end_headers()
-        self.wfile.write(content)
+        self.wfile.write(content.encode('utf-8'))
 
     def add_compliance_header(self):
         """Add IIIF compliance level header."""
@@ -85,19 +90,16 @@ class IIIFRequestHandler(CGI_responder):
         self.compliance_uri = None
         self.iiif = IIIFRequest(baseurl='/')
         try:
-            (of, mime_type) = self.do_GET_body()
-            if (not of):
+            (content, mime_type) = self.do_GET_body()
+            if (not content):
                 raise IIIFError("Unexpected failure to open result image")
             self.send_response(200, 'OK')
             if (mime_type is not None):
                 self.send_header('Content-Type', mime_type)
+            self.send_header('Content-Length', str(len(content)))
             self.add_compliance_header()
             self.end_headers()
-            while (1):
-                buffer = of.read(8192)
-                if (not buffer):
-                    break
-                self.wfile.write(buffer)
+            self.wfile.write(content)
             # Now cleanup
             self.manipulator.cleanup()
         except IIIFError as e:
@@ -113,7 +115,11 @@ class IIIFRequestHandler(CGI_responder):
             self.error_response(e.code, str(e))
 
     def do_GET_body(self):
-        """Create body of GET."""
+        """Create body of GET.
+
+        Returns (content, mime_type) where content is the bytes of the
+        response body.
+        """
         iiif = self.iiif
         if (len(self.path) > 1024):
             raise IIIFError(code=414,
@@ -146,20 +152,23 @@ class IIIFRequestHandler(CGI_responder):
         self.manipulator = manipulator
         self.compliance_uri = manipulator.compliance_uri
         if (iiif.info):
-            # get size
+            # get size from image header
             manipulator.srcfile = file
-            manipulator.do_first()
+            (width, height) = manipulator.source_size()
             # most of info.json comes from config, a few things
             # specific to image
             i = IIIFInfo()
             i.identifier = self.iiif.identifier
-            i.width = manipulator.width
-            i.height = manipulator.height
-            import io
-            return(io.StringIO(i.as_json()), "application/json")
+            i.width = width
+            i.height = height
+            return(i.as_json().encode('utf-8'), "application/json")
         else:
+            manipulator.in_memory = True
             (outfile, mime_type) = manipulator.derive(file, iiif)
-            return(open(outfile, 'r'), mime_type)
+            if (manipulator.outbytes is not None):
+                return(manipulator.outbytes, mime_type)
+            with open(outfile, 'rb') as of:
+                return(of.read(), mime_type)
 
 myname = (os.environ['SCRIPT_NAME'] if (
     'SCRIPT_NAME' in os.environ) else '/iiif_dummy.cgi')
@@ -80,7 +80,6 @@ setup(
     long_description=open('README').read(),
     install_requires=[
         "Pillow",
-        "python-magic",
         "Flask",
         "ConfigArgParse>=0.13.0"
     ],
@@ -0,0 +1,84 @@
+"""Test code for iiif/dimension_cache.py."""
+import json
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from iiif.dimension_cache import DimensionCache
+
+
+class TestAll(unittest.TestCase):
+    """Tests."""
+
+    def setUp(self):
+        """Make temp dir with source file."""
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, 'src.png')
+        with open(self.src, 'w') as fh:
+            fh.write('not really')
+
+    def tearDown(self):
+        """Remove temp dir."""
+        shutil.rmtree(self.tmp)
+
+    def test01_get_put(self):
+        """Add and get dimensions."""
+        c = DimensionCache()
+        self.assertEqual(c.get(self.src), None)
+        c.put(self.src, (100, 200))
+        self.assertEqual(len(c), 1)
+        self.assertEqual(c.get(self.src), (100, 200))
+        self.assertEqual(c.get(os.path.join(self.tmp, '.', 'src.png')), (100, 200))
+        # Changed file
+        os.utime(self.src, (1000000, 1000000))
+        self.assertEqual(c.get(self.src), None)
+        # Missing file
+        c.put(os.path.join(self.tmp, 'none.png'), (1, 1))
+        self.assertEqual(len(c), 1)
+        self.assertEqual(c.get(os.path.join(self.tmp, 'none.png')), None)
+
+    def test02_sidecar(self):
+        """Save and load sidecar file."""
+        sidecar = os.path.join(self.tmp, 'dims.json')
+        c = DimensionCache(filename=sidecar)
+        self.assertEqual(len(c), 0)
+        c.put(self.src, (100, 200))
+        # Not saved until flushed or save_interval has passed
+        self.assertFalse(os.path.exists(sidecar))
+        c.flush()
+        self.assertTrue(os.path.exists(sidecar))
+        self.assertEqual(sorted(os.listdir(self.tmp)), ['dims.json', 'src.png'])
+        with open(sidecar, 'r') as fh:
+            self.assertEqual(len(json.load(fh)), 1)
+        c = DimensionCache(filename=sidecar)
+        self.assertEqual(len(c), 1)
+        self.assertEqual(c.get(self.src), (100, 200))
+        # Bad sidecar ignored
+        with open(sidecar, 'w') as fh:
+            fh.write('{bad json')
+        c = DimensionCache(filename=sidecar)
+        self.assertEqual(len(c), 0)
+        # Unwritable sidecar ignored
+        c = DimensionCache(filename=os.path.join(self.tmp, 'none', 'dims.json'),
+                           save_interval=0)
+        c.put(self.src, (100, 200))
+        self.assertEqual(c.get(self.src), (100, 200))
+
+    def test03_save_interval(self):
+        """Save sidecar file only when changed and interval has passed."""
+        sidecar = os.path.join(self.tmp, 'dims.json')
+        c = DimensionCache(filename=sidecar, save_interval=0)
+        c.put(self.src, (100, 200))
+        self.assertTrue(os.path.exists(sidecar))
+        os.unlink(sidecar)
+        # Unchanged cache is not saved
+        c.flush()
+        self.assertFalse(os.path.exists(sidecar))
+        c.save_interval = 3600
+        c.put(self.src, (100, 300))
+        self.assertFalse(os.path.exists(sidecar))
+        c.flush()
+        with open(sidecar, 'r') as fh:
+            self.assertEqual(list(json.load(fh).values())[0][1:], [100, 300])
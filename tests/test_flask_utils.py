@@ -5,11 +5,16 @@ import flask
 import mock
 import os.path
 import json
+import shutil
+import tempfile
 
 from iiif.auth_basic import IIIFAuthBasic
+from iiif.dimension_cache import DimensionCache
 from iiif.error import IIIFError
 from iiif.manipulator import IIIFManipulator
+from iiif.manipulator_netpbm import IIIFManipulatorNetpbm
 from iiif.manipulator_pil import IIIFManipulatorPIL
+from iiif.process_pool import ManipulatorPool
 
 from iiif.flask_utils import (Config, html_page, top_level_index_page, identifiers,
                               prefix_index_page, host_port_prefix,
@@ -260,6 +265,23 @@ class TestAll(unittest.TestCase):
             resp = i.image_information_response()
             jsonb = resp.response[0]
             self.assertIn(b'starfish-deg', jsonb)
+        # size from dimension cache
+        IIIFHandler.dimension_cache = DimensionCache()
+        try:
+            i = IIIFHandler(prefix='p', identifier='starfish', config=c,
+                            klass=IIIFManipulatorPIL, auth=None)
+            with self.test_app.request_context(environ):
+                resp = i.image_information_response()
+                self.assertIn(b'"width": 3000', resp.response[0])
+            self.assertEqual(len(IIIFHandler.dimension_cache), 1)
+            i = IIIFHandler(prefix='p', identifier='starfish', config=c,
+                            klass=IIIFManipulatorPIL, auth=None)
+            i.manipulator.source_size = mock.Mock(side_effect=IIIFError())
+            with self.test_app.request_context(environ):
+                resp = i.image_information_response()
+                self.assertIn(b'"height": 4000', resp.response[0])
+        finally:
+            IIIFHandler.dimension_cache = None
 
     def test26_IIIFHandler_image_request_response(self):
         """Test IIIFHandler.image_request_response()."""
@@ -306,6 +328,35 @@ class TestAll(unittest.TestCase):
             resp.direct_passthrough = False  # avoid Flask complaint when reading .data
             self.assertTrue(len(resp.data) > 1000000)
             self.assertEqual(resp.mimetype, 'image/png')
+        # Encode in memory
+        c.api_version = '2.1'
+        c.encode_in_memory = True
+        i = IIIFHandler(prefix='p', identifier='starfish', config=c,
+                        klass=IIIFManipulatorPIL, auth=None)
+        environ = WSGI_ENVIRON()
+        with self.test_app.request_context(environ):
+            resp = i.image_request_response('full/100,/0/default.png')
+            self.assertEqual(resp.mimetype, 'image/png')
+            self.assertEqual(resp.headers['Content-Length'], str(len(resp.data)))
+            self.assertTrue(resp.data.startswith(b'\x89PNG'))
+            self.assertEqual(i.manipulator.outfile, None)
+        # Worker process pool, with settings for manipulator
+        c.encoder_profile = 'fast'
+        IIIFHandler.pool = ManipulatorPool(processes=1)
+        try:
+            i = IIIFHandler(prefix='p', identifier='starfish', config=c,
+                            klass=IIIFManipulatorPIL, auth=None)
+            self.assertEqual(i.manipulator.encoder_profile, 'fast')
+            self.assertEqual(i.manipulator_settings, {'encoder_profile': 'fast'})
+            environ = WSGI_ENVIRON()
+            with self.test_app.request_context(environ):
+                resp = i.image_request_response('full/100,/0/default.png')
+                self.assertEqual(resp.mimetype, 'image/png')
+                self.assertEqual(resp.headers['Content-Length'], str(len(resp.data)))
+                self.assertTrue(resp.data.startswith(b'\x89PNG'))
+        finally:
+            IIIFHandler.pool.close()
+            IIIFHandler.pool = None
 
     def test27_IIIFHandler_error_response(self):
         """Test IIIFHandler.error_response()."""
@@ -504,6 +555,106 @@ class TestAll(unittest.TestCase):
             c.prefix = 'pfx2_' + klass
             c.client_prefix = c.prefix
             self.assertTrue(add_handler(self.test_app, Config(c)))
+        # Decoded image cache for PIL manipulator
+        c.klass_name = 'pil'
+        c.prefix = 'pfx3_cache'
+        c.client_prefix = c.prefix
+        c.image_cache_size = 2
+        try:
+            self.assertTrue(add_handler(self.test_app, Config(c)))
+            self.assertEqual(IIIFManipulatorPIL.image_cache.max_bytes, 2 * 1024 * 1024)
+        finally:
+            IIIFManipulatorPIL.image_cache = None
+        c.image_cache_size = 0
+        # ICC conversion to sRGB
+        c.prefix = 'pfx3_icc'
+        c.client_prefix = c.prefix
+        c.icc_to_srgb = True
+        try:
+            self.assertTrue(add_handler(self.test_app, Config(c)))
+            self.assertEqual(len(IIIFManipulatorPIL.icc_transforms), 0)
+        finally:
+            IIIFManipulatorPIL.icc_transforms = None
+        c.icc_to_srgb = False
+        # Lossless JPEG operations with jpegtran
+        c.prefix = 'pfx3_jpegtran'
+        c.client_prefix = c.prefix
+        c.jpegtran = '/usr/bin/jpegtran'
+        try:
+            self.assertTrue(add_handler(self.test_app, Config(c)))
+            self.assertEqual(IIIFManipulatorPIL.jpegtran, '/usr/bin/jpegtran')
+        finally:
+            IIIFManipulatorPIL.jpegtran = None
+        c.jpegtran = None
+        # Limit on concurrent netpbm pipelines
+        c.klass_name = 'netpbm'
+        c.prefix = 'pfx3_pipelines'
+        c.client_prefix = c.prefix
+        c.netpbm_max_pipelines = 4
+        c.netpbm_pipeline_timeout = 2.0
+        try:
+            self.assertTrue(add_handler(self.test_app, Config(c)))
+            self.assertEqual(IIIFManipulatorNetpbm.pipeline_limit.max_pipelines, 4)
+            self.assertEqual(IIIFManipulatorNetpbm.pipeline_limit.timeout, 2.0)
+        finally:
+            IIIFManipulatorNetpbm.pipeline_limit = None
+        c.netpbm_max_pipelines = 0
+        # Decoded PNM cache for netpbm manipulator
+        c.prefix = 'pfx3_pnm_cache'
+        c.client_prefix = c.prefix
+        tmp = tempfile.mkdtemp()
+        c.netpbm_cache_dir = os.path.join(tmp, 'pnm')
+        c.netpbm_cache_size = 3
+        try:
+            self.assertTrue(add_handler(self.test_app, Config(c)))
+            self.assertEqual(IIIFManipulatorNetpbm.pnm_cache.max_bytes, 3 * 1024 * 1024)
+            self.assertTrue(os.path.isdir(c.netpbm_cache_dir))
+        finally:
+            IIIFManipulatorNetpbm.pnm_cache = None
+            shutil.rmtree(tmp)
+        c.netpbm_cache_dir = None
+        c.klass_name = 'pil'
+        # Stage timings
+        c.prefix = 'pfx3_timing'
+        c.client_prefix = c.prefix
+        c.timing_sample_rate = 0.1
+        try:
+            self.assertTrue(add_handler(self.test_app, Config(c)))
+            self.assertEqual(IIIFManipulatorPIL.stage_timer.sample_rate, 0.1)
+        finally:
+            IIIFManipulatorPIL.stage_timer = None
+        c.timing_sample_rate = 0.0
+        # Worker process pool
+        c.prefix = 'pfx3_pool'
+        c.client_prefix = c.prefix
+        c.process_pool_size = 1
+        c.process_pool_maxtasksperchild = 10
+        c.process_pool_memory_limit = 1000
+        try:
+            self.assertTrue(add_handler(self.test_app, Config(c)))
+            self.assertEqual(IIIFHandler.pool.processes, 1)
+            self.assertEqual(IIIFHandler.pool.maxtasksperchild, 10)
+            self.assertEqual(IIIFHandler.pool.memory_limit, 1000 * 1024 * 1024)
+        finally:
+            IIIFHandler.pool.close()
+            IIIFHandler.pool = None
+        c.process_pool_size = 0
+        # Memory budget
+        c.prefix = 'pfx3_budget'
+        c.client_prefix = c.prefix
+        c.memory_budget = 100
+        c.memory_budget_timeout = 2.5
+        try:
+            self.assertTrue(add_handler(self.test_app, Config(c)))
+            self.assertEqual(IIIFManipulator.memory_budget.max_bytes, 100 * 1024 * 1024)
+            self.assertEqual(IIIFManipulator.memory_budget.timeout, 2.5)
+            self.assertIs(IIIFManipulatorPIL.memory_budget, IIIFManipulator.memory_budget)
+        finally:
+            IIIFManipulator.memory_budget = None
+        c.memory_budget = 0
+        # Dimension cache is set up
+        self.assertTrue(IIIFHandler.dimension_cache is not None)
+        IIIFHandler.dimension_cache = None
         # Include OSD
         c.include_osd = True
         self.assertTrue(add_handler(self.test_app, Config(c)))
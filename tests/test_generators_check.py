@@ -2,6 +2,7 @@
 import unittest
 
 from iiif.generators.check import PixelGen
+from .testlib.generators import check_pixels, np
 
 
 class TestAll(unittest.TestCase):
@@ -31,3 +32,8 @@ class TestAll(unittest.TestCase):
         # n%2 and not
         self.assertEqual(gen.pixel(0, 0, 9, 55), (55, 0, 0))
         self.assertEqual(gen.pixel(3, 0, 9, 55), None)
+
+    @unittest.skipIf(np is None, "numpy not installed")
+    def test04_pixels(self):
+        """Test pixels matches pixel."""
+        check_pixels(self, PixelGen(), (0, 19683, 281), (7, 19683, 263))
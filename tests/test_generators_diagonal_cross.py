@@ -2,6 +2,7 @@
 import unittest
 
 from iiif.generators.diagonal_cross import PixelGen
+from .testlib.generators import check_pixels, np
 
 
 class TestAll(unittest.TestCase):
@@ -27,3 +28,8 @@ class TestAll(unittest.TestCase):
         self.assertEqual(gen.pixel(1, 0, 3), None)
         # off diag
         self.assertEqual(gen.pixel(3, 0, 9), None)
+
+    @unittest.skipIf(np is None, "numpy not installed")
+    def test04_pixels(self):
+        """Test pixels matches pixel."""
+        check_pixels(self, PixelGen(), (0, 6561, 97), (40, 6561, 89))
@@ -3,6 +3,7 @@ import unittest
 import cmath
 
 from iiif.generators.julia_p28_p008 import PixelGen
+from .testlib.generators import check_pixels, np
 
 
 class TestAll(unittest.TestCase):
@@ -14,3 +15,8 @@ class TestAll(unittest.TestCase):
         gen.set_c(complex(0, 1))
         self.assertAlmostEqual(gen.c.real, 0.28)
         self.assertAlmostEqual(gen.c.imag, 0.008)
+
+    @unittest.skipIf(np is None, "numpy not installed")
+    def test02_pixels(self):
+        """Test pixels matches pixel."""
+        check_pixels(self, PixelGen(), (0, 100001, 1999), (3, 100001, 2011))
@@ -3,6 +3,7 @@ import unittest
 import cmath
 
 from iiif.generators.mandlebrot_100k import PixelGen
+from .testlib.generators import check_pixels, np
 
 
 class TestAll(unittest.TestCase):
@@ -38,3 +39,8 @@ class TestAll(unittest.TestCase):
         self.assertEqual(gen.mpixel(complex(0, 0), 9999), None)
         # next iter
         self.assertEqual(gen.mpixel(complex(0.5, 0.5), 0), None)
+
+    @unittest.skipIf(np is None, "numpy not installed")
+    def test06_pixels(self):
+        """Test pixels matches pixel."""
+        check_pixels(self, PixelGen(), (0, 100001, 1999), (3, 100001, 2011))
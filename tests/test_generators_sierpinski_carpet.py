@@ -2,6 +2,7 @@
 import unittest
 
 from iiif.generators.sierpinski_carpet import PixelGen
+from .testlib.generators import check_pixels, np
 
 
 class TestAll(unittest.TestCase):
@@ -28,3 +29,8 @@ class TestAll(unittest.TestCase):
         self.assertEqual(gen.pixel(1, 1, 3), None)
         # next iter
         self.assertEqual(gen.pixel(3, 3, 9), None)
+
+    @unittest.skipIf(np is None, "numpy not installed")
+    def test04_pixels(self):
+        """Test pixels matches pixel."""
+        check_pixels(self, PixelGen(), (0, 6561, 97), (40, 6561, 89))
@@ -0,0 +1,48 @@
+"""Test code for iiif/icc.py."""
+import unittest
+
+from PIL import Image, ImageCms
+
+from iiif.icc import TransformCache, is_srgb
+from .testlib.icc import swapped_rgb_profile
+
+
+class TestAll(unittest.TestCase):
+    """Tests."""
+
+    def test01_is_srgb(self):
+        """Recognize sRGB profile."""
+        self.assertTrue(is_srgb(ImageCms.createProfile('sRGB')))
+        self.assertFalse(is_srgb(ImageCms.createProfile('LAB')))
+
+    def test02_get(self):
+        """Get transforms from cache."""
+        c = TransformCache(max_entries=2)
+        profile = swapped_rgb_profile()
+        t = c.get(profile, 'RGB')
+        self.assertTrue(t is not None)
+        self.assertEqual((c.hits, c.misses), (0, 1))
+        self.assertTrue(c.get(profile, 'RGB') is t)
+        self.assertEqual((c.hits, c.misses), (1, 1))
+        image = Image.new('RGB', (1, 1), (10, 100, 200))
+        self.assertEqual(t.apply(image).getpixel((0, 0)), (200, 100, 10))
+        # Different intent is a different transform
+        self.assertTrue(c.get(profile, 'RGB', ImageCms.Intent.RELATIVE_COLORIMETRIC) is not t)
+        self.assertEqual(len(c), 2)
+        # LRU eviction
+        c.get(profile, 'RGBA')
+        self.assertEqual(len(c), 2)
+        c.get(profile, 'RGB')
+        self.assertEqual(c.misses, 4)
+        c.clear()
+        self.assertEqual(len(c), 0)
+
+    def test03_no_transform(self):
+        """No transform for sRGB, bad profile or unsupported mode."""
+        c = TransformCache()
+        srgb = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB')).tobytes()
+        self.assertEqual(c.get(srgb, 'RGB'), None)
+        self.assertEqual(c.get(b'not a profile', 'RGB'), None)
+        self.assertEqual(c.get(swapped_rgb_profile(), 'P'), None)
+        # Unsupported mode is not cached
+        self.assertEqual(len(c), 2)
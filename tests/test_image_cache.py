@@ -0,0 +1,106 @@
+"""Test code for iiif/image_cache.py."""
+import os
+import os.path
+import shutil
+import tempfile
+import threading
+import unittest
+
+from PIL import Image
+
+from iiif.image_cache import image_bytes, ImageCache
+
+
+class TestAll(unittest.TestCase):
+    """Tests."""
+
+    def setUp(self):
+        """Make temp dir with test images."""
+        self.tmp = tempfile.mkdtemp()
+        self.files = []
+        for n in range(4):
+            f = os.path.join(self.tmp, 'img%d.png' % (n))
+            Image.new('RGB', (100, 100), (n, n, n)).save(f)
+            self.files.append(f)
+
+    def tearDown(self):
+        """Remove temp dir."""
+        shutil.rmtree(self.tmp)
+
+    def test01_image_bytes(self):
+        """Image size in memory."""
+        self.assertEqual(image_bytes((10, 10), 'L'), 100)
+        self.assertEqual(image_bytes((10, 10), 'I;16'), 200)
+        self.assertEqual(image_bytes((10, 10), 'RGB'), 400)
+        self.assertEqual(image_bytes((10, 10), 'F'), 400)
+
+    def test02_get_put(self):
+        """Add and get images."""
+        c = ImageCache(max_bytes=100000)
+        self.assertEqual(c.get(self.files[0]), None)
+        self.assertEqual(c.misses, 1)
+        im = Image.open(self.files[0])
+        im.load()
+        c.put(self.files[0], im)
+        self.assertEqual(len(c), 1)
+        self.assertEqual(c.bytes, 40000)
+        self.assertIs(c.get(self.files[0]), im)
+        self.assertEqual(c.hits, 1)
+        # Same file by different path
+        self.assertIs(c.get(os.path.join(self.tmp, '.', 'img0.png')), im)
+        # Replace
+        c.put(self.files[0], im)
+        self.assertEqual(len(c), 1)
+        self.assertEqual(c.bytes, 40000)
+        # Modified file is not a hit, entry discarded
+        os.utime(self.files[0], (1000000, 1000000))
+        self.assertEqual(c.get(self.files[0]), None)
+        self.assertEqual(len(c), 0)
+        self.assertEqual(c.bytes, 0)
+        # Missing file
+        c.put(os.path.join(self.tmp, 'none.png'), im)
+        self.assertEqual(len(c), 0)
+        self.assertEqual(c.get(os.path.join(self.tmp, 'none.png')), None)
+        # Too big
+        self.assertFalse(c.fits((1000, 1000), 'L'))
+        self.assertTrue(c.fits((100, 100), 'RGB'))
+        c.put(self.files[1], Image.new('L', (1000, 1000)))
+        self.assertEqual(len(c), 0)
+        c.put(self.files[1], im)
+        c.clear()
+        self.assertEqual(len(c), 0)
+        self.assertEqual(c.bytes, 0)
+
+    def test03_eviction(self):
+        """Evict least recently used."""
+        c = ImageCache(max_bytes=100000)
+        images = [Image.open(f) for f in self.files]
+        c.put(self.files[0], images[0])
+        c.put(self.files[1], images[1])
+        self.assertIs(c.get(self.files[0]), images[0])
+        c.put(self.files[2], images[2])
+        self.assertEqual(len(c), 2)
+        self.assertEqual(c.bytes, 80000)
+        self.assertIs(c.get(self.files[0]), images[0])
+        self.assertEqual(c.get(self.files[1]), None)
+        self.assertIs(c.get(self.files[2]), images[2])
+
+    def test04_threads(self):
+        """Shared between threads."""
+        c = ImageCache(max_bytes=100000)
+        images = [Image.open(f) for f in self.files]
+
+        def worker():
+            for n in range(200):
+                f = n % 4
+                if (c.get(self.files[f]) is None):
+                    c.put(self.files[f], images[f])
+
+        threads = [threading.Thread(target=worker) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(c.hits + c.misses, 800)
+        self.assertLessEqual(c.bytes, 100000)
+        self.assertEqual(c.bytes, 40000 * len(c))
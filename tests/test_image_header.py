@@ -0,0 +1,90 @@
+"""Test code for iiif/image_header.py."""
+import io
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from PIL import Image
+
+from iiif.image_header import image_type, file_type, file_size, pnm_header
+
+
+class TestAll(unittest.TestCase):
+    """Tests."""
+
+    def setUp(self):
+        """Make temporary directory."""
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Remove temporary directory."""
+        shutil.rmtree(self.tmp)
+
+    def test01_image_type(self):
+        """Image type from magic bytes."""
+        self.assertEqual(image_type(b'\x89PNG\r\n\x1a\n\x00'), 'png')
+        self.assertEqual(image_type(b'\xff\xd8\xff\xe0'), 'jpg')
+        self.assertEqual(image_type(b'\x00\x00\x00\x0cjP  \r\n\x87\n'), 'jp2')
+        self.assertEqual(image_type(b'\xff\x4f\xff\x51'), 'jp2')
+        self.assertEqual(image_type(b'GIF89a'), None)
+        self.assertEqual(image_type(b''), None)
+        self.assertEqual(file_type('testimages/starfish.jpg'), 'jpg')
+        self.assertEqual(file_type('testimages/robot_palette_320x200.gif'), None)
+        self.assertEqual(file_type('testimages/does_not_exist'), None)
+        self.assertEqual(file_type(None), None)
+
+    def test02_file_size(self):
+        """Size from image headers."""
+        self.assertEqual(file_size('testimages/starfish_1500x2000.png'), (1500, 2000))
+        self.assertEqual(file_size('testimages/tetons.jpg'), (4000, 3000))
+        self.assertEqual(file_size('testimages/robot_palette_320x200.gif'), None)
+        self.assertEqual(file_size('testimages/does_not_exist'), None)
+        image = Image.open('testimages/test1.png').convert('RGB')
+        for (name, options) in [('a.jp2', {}), ('a.j2k', {}),
+                                ('a.jpg', {'progressive': True}),
+                                ('b.jpg', {'exif': Image.Exif().tobytes()})]:
+            filename = os.path.join(self.tmp, name)
+            image.save(filename, **options)
+            self.assertEqual(file_size(filename), (175, 131), name)
+        # Truncated JPEG
+        filename = os.path.join(self.tmp, 'c.jpg')
+        with open(filename, 'wb') as fh:
+            fh.write(open(os.path.join(self.tmp, 'a.jpg'), 'rb').read()[:30])
+        self.assertEqual(file_size(filename), None)
+
+    def test03_pnm_header(self):
+        """Parse PNM headers."""
+        for mode in ('1', 'L', 'RGB'):
+            buf = io.BytesIO()
+            Image.new(mode, (12, 34)).save(buf, format='PPM')
+            data = buf.getvalue()
+            header = pnm_header(data)
+            self.assertEqual(header['size'], (12, 34))
+            self.assertEqual(header['depth'], 3 if (mode == 'RGB') else 1)
+            self.assertEqual(header['maxval'], 1 if (mode == '1') else 255)
+            self.assertEqual(len(data) - header['length'],
+                             len(Image.new(mode, (12, 34)).tobytes()))
+            # Incomplete header
+            self.assertEqual(pnm_header(data[:header['length'] - 1]), None)
+        header = pnm_header(b'P3\n# comment\n  100 # width\n200\n65535\n1 2 3')
+        self.assertEqual((header['magic'], header['size'], header['maxval']),
+                         ('P3', (100, 200), 65535))
+        self.assertEqual(header['length'], 37)
+        self.assertEqual(pnm_header(b'P1 3 4\n0 1'),
+                         {'magic': 'P1', 'size': (3, 4), 'maxval': 1,
+                          'depth': 1, 'tupltype': None, 'length': 7})
+        self.assertEqual(pnm_header(b''), None)
+        self.assertEqual(pnm_header(b'P'), None)
+        self.assertEqual(pnm_header(b'P5 10 2'), None)
+        self.assertRaises(ValueError, pnm_header, b'GIF89a')
+        self.assertRaises(ValueError, pnm_header, b'P9 1 1 1 ')
+        # PAM
+        data = (b'P7\nWIDTH 227\nHEIGHT 149\nDEPTH 4\nMAXVAL 255\n'
+                b'# comment\nTUPLTYPE RGB_ALPHA\nENDHDR\n\x00\x00')
+        self.assertEqual(pnm_header(data),
+                         {'magic': 'P7', 'size': (227, 149), 'maxval': 255,
+                          'depth': 4, 'tupltype': b'RGB_ALPHA',
+                          'length': len(data) - 2})
+        self.assertEqual(pnm_header(data[:30]), None)
+        self.assertRaises(ValueError, pnm_header, b'P7\nWIDTH 1\nENDHDR\n')
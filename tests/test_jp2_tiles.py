@@ -0,0 +1,81 @@
+"""Test code for iiif/jp2_tiles.py."""
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from PIL import Image, ImageChops
+
+from iiif.jp2_tiles import jp2_codestream, jp2_header, jp2_levels, jp2_region
+
+
+class TestAll(unittest.TestCase):
+    """Tests."""
+
+    def setUp(self):
+        """Make temp dir and tiled JPEG 2000 test image."""
+        self.tmp = tempfile.mkdtemp()
+        self.image = Image.open('testimages/starfish_1500x2000.png').convert('RGB').crop((0, 0, 700, 500))
+        self.jp2 = os.path.join(self.tmp, 'tiled.jp2')
+        self.image.save(self.jp2, tile_size=(128, 128), num_resolutions=4)
+
+    def tearDown(self):
+        """Remove temp dir."""
+        shutil.rmtree(self.tmp)
+
+    def test01_jp2_codestream(self):
+        """Find codestream."""
+        with open(self.jp2, 'rb') as fh:
+            (start, end) = jp2_codestream(fh)
+            fh.seek(start)
+            self.assertEqual(fh.read(4), b'\xff\x4f\xff\x51')
+        j2k = os.path.join(self.tmp, 'raw.j2k')
+        self.image.save(j2k)
+        with open(j2k, 'rb') as fh:
+            self.assertEqual(jp2_codestream(fh), (0, None))
+        with open('testimages/starfish.jpg', 'rb') as fh:
+            self.assertEqual(jp2_codestream(fh), None)
+
+    def test02_jp2_header(self):
+        """Read main header."""
+        with open(self.jp2, 'rb') as fh:
+            header = jp2_header(fh)
+        self.assertEqual(header['size'], (700, 500))
+        self.assertEqual(header['origin'], (0, 0))
+        self.assertEqual(header['tile'], (128, 128))
+        self.assertEqual(header['components'], 3)
+        self.assertEqual(header['levels'], 3)
+        self.assertEqual(jp2_levels(self.jp2), 3)
+
+    def test03_jp2_region(self):
+        """Read region tiles."""
+        # Full resolution, just the tiles
+        (image, offset) = jp2_region(self.jp2, (300, 150.5, 500, 250))
+        self.assertEqual(offset, (256, 128))
+        self.assertEqual(image.size, (256, 128))
+        expected = self.image.crop((256, 128, 512, 256))
+        self.assertEqual(ImageChops.difference(image, expected).getbbox(), None)
+        # Edge tiles
+        (image, offset) = jp2_region(self.jp2, (650, 450, 700, 500))
+        self.assertEqual(offset, (640, 384))
+        self.assertEqual(image.size, (60, 116))
+        expected = self.image.crop((640, 384, 700, 500))
+        self.assertEqual(ImageChops.difference(image, expected).getbbox(), None)
+        # Reduced resolution, truncated image with same origin
+        full = Image.open(self.jp2)
+        full.reduce = 2
+        full.load()
+        (image, offset) = jp2_region(self.jp2, (300, 150, 500, 250), 2)
+        self.assertEqual(offset, (0, 0))
+        image.load()
+        self.assertEqual(image.size, (128, 64))
+        diff = ImageChops.difference(image.crop((64, 32, 128, 64)),
+                                     full.crop((64, 32, 128, 64)))
+        self.assertEqual(diff.getbbox(), None)
+        # Whole image needed
+        self.assertEqual(jp2_region(self.jp2, (0, 0, 700, 500)), None)
+        # Untiled
+        f = os.path.join(self.tmp, 'untiled.jp2')
+        self.image.save(f)
+        self.assertEqual(jp2_region(f, (0, 0, 10, 10)), None)
@@ -59,6 +59,11 @@ class TestAll(unittest.TestCase):
         self.assertEqual(m.width, -1)
         self.assertEqual(m.height, -1)
 
+    def test03_source_size(self):
+        """Test source_size."""
+        m = IIIFManipulator()
+        self.assertEqual(m.source_size(), (-1, -1))
+
     def test04_do_region(self):
         """Test do_region, error if anything but full."""
         m = IIIFManipulator()
@@ -396,3 +401,79 @@ class TestAll(unittest.TestCase):
         self.assertEqual(m.compliance_uri, None)
         m.compliance_level = 2
         self.assertEqual(m.compliance_uri, None)
+
+    def test17_plan_operations(self):
+        """Test plan_operations, make_plan and plan_key."""
+        m = IIIFManipulator()
+        for (url, plan) in (
+                ('id/full/full/0/default', ('quality',)),
+                ('id/pct:0,0,100,100/pct:100/0/default', ('quality',)),
+                ('id/full/max/0/default', ('quality',)),
+                ('id/0,0,10,10/full/0/default', ('region', 'quality')),
+                ('id/full/10,/0/default', ('size', 'quality')),
+                ('id/full/full/90/default', ('rotation', 'quality')),
+                ('id/full/full/!0/default', ('rotation', 'quality')),
+                ('id/1,2,3,4/5,/6/gray', ('region', 'size', 'rotation', 'quality'))):
+            m.request = IIIFRequest(api_version='2.1')
+            m.request.parse_url(url)
+            self.assertEqual(m.make_plan(), plan)
+            self.assertEqual(m.plan_operations(), plan)
+            self.assertIn(m.plan_key(), m.plan_cache)
+        # max not full if there are limits
+        m.max_width = 100
+        m.request = IIIFRequest(api_version='2.1')
+        m.request.parse_url('id/full/max/0/default')
+        self.assertEqual(m.make_plan(), ('size', 'quality'))
+        # Same shape gives same plan
+        m.request = IIIFRequest(api_version='2.1')
+        m.request.parse_url('id/1,1,1,1/2,2/0/color')
+        key = m.plan_key()
+        m.request = IIIFRequest(api_version='2.1')
+        m.request.parse_url('id/5,5,9,9/3,/0/color')
+        self.assertEqual(m.plan_key(), key)
+        # Required operations
+        m.required_operations = ('region', 'size', 'rotation')
+        m.request = IIIFRequest(api_version='2.1')
+        m.request.parse_url('id/full/full/0/default')
+        self.assertEqual(m.make_plan(), ('region', 'size', 'rotation', 'quality'))
+        # derive records plan
+        m = IIIFManipulator()
+        m.request = IIIFRequest(api_version='2.1')
+        m.request.parse_url('id/full/full/0/default')
+        m.derive(srcfile='testimages/test1.png', outfile=None)
+        self.assertEqual(m.plan, ('quality',))
+
+    def test18_derive_many(self):
+        """Test derive_many."""
+        tmp = tempfile.mkdtemp()
+        try:
+            requests = []
+            for url in ('id/full/full/0/default', 'id/0,0,10,10/full/0/default',
+                        'id/full/max/0/default'):
+                r = IIIFRequest(api_version='2.1')
+                r.parse_url(url)
+                requests.append(r)
+            outfiles = [os.path.join(tmp, str(n)) for n in range(3)]
+            m = IIIFManipulator()
+            results = list(m.derive_many('testimages/starfish.jpg', requests, outfiles))
+            self.assertEqual(len(results), 3)
+            self.assertEqual(results[0], (outfiles[0], None, None))
+            self.assertTrue(os.path.isfile(outfiles[0]))
+            # Region needs image size so is an error
+            self.assertEqual(results[1][:2], (None, None))
+            self.assertTrue(isinstance(results[1][2], IIIFError))
+            self.assertEqual(results[2], (outfiles[2], None, None))
+            # Cleanup on other exceptions and when iteration stops early
+            cleanups = []
+            m.cleanup = lambda: cleanups.append(1)
+            m.do_last = lambda: int('x')
+            self.assertRaises(ValueError, list,
+                              m.derive_many('testimages/starfish.jpg', requests[:1], outfiles))
+            self.assertEqual(len(cleanups), 1)
+            del m.do_last
+            g = m.derive_many('testimages/starfish.jpg', requests, outfiles)
+            next(g)
+            g.close()
+            self.assertEqual(len(cleanups), 2)
+        finally:
+            shutil.rmtree(tmp)
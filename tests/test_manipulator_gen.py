@@ -5,6 +5,10 @@ import os
 import os.path
 
 from PIL import Image
+try:
+    import numpy as np
+except ImportError:  # numpy not installed
+    np = None
 
 from iiif.error import IIIFError
 from iiif.manipulator_gen import IIIFManipulatorGen
@@ -85,3 +89,28 @@ class TestAll(unittest.TestCase):
         m.do_size(101, 102)
         self.assertEqual(m.sw, 101)
         self.assertEqual(m.sh, 102)
+        # Generator with only pixel()
+        m.rx = 200
+        m.ry = 100
+        m.rw = 100
+        m.rh = 200
+        m.do_size(50, 50)
+        self.assertEqual(m.image.size, (50, 50))
+        self.assertEqual(m.image.getpixel((0, 0)), (200, 100, 0))
+        self.assertEqual(m.image.getpixel((10, 20)), (220, 180, 0))
+        self.assertEqual(m.image.getpixel((49, 49)), (255, 255, 255))
+
+    def test_generate_array(self):
+        """Test generate_array matches generate_pixels."""
+        for gen in ('check', 'diagonal_cross', 'sierpinski_carpet', 'mandlebrot_100k'):
+            m = IIIFManipulatorGen()
+            m.srcfile = gen
+            m.do_first()
+            m.do_region(m.width // 3, m.height // 4, m.width // 3, m.height // 2)
+            (m.sw, m.sh) = (64, 96)
+            if (np is not None):
+                self.assertEqual(m.generate_array().tobytes(),
+                                 m.generate_pixels().tobytes())
+            m.do_size(64, 96)
+            self.assertEqual(m.image.size, (64, 96))
+            self.assertEqual(m.image.mode, 'RGB')
@@ -1,8 +1,22 @@
 """Test code for netpbm based IIIF Image manipulator."""
+import io
+import os
+import shutil
+import sys
+import tempfile
 import unittest
+try:
+    from shutil import which
+except ImportError:  # python2
+    from distutils.spawn import find_executable as which
+
+from PIL import Image
 
 from iiif.error import IIIFError
+from iiif.request import IIIFRequest
 from iiif.manipulator_netpbm import IIIFManipulatorNetpbm
+from iiif.pipeline_limit import PipelineLimit
+from iiif.pnm_cache import PNMCache
 
 
 class TestAll(unittest.TestCase):
@@ -26,3 +40,164 @@ class TestAll(unittest.TestCase):
         # self.assertEqual(m.do_first(), None)
         # self.assertEqual(m.width, 175)
         # self.assertEqual(m.height, 131)
+
+    def test_source_size(self):
+        """Size from image header without netpbm."""
+        m = IIIFManipulatorNetpbm()
+        m.srcfile = 'testimages/starfish_1500x2000.png'
+        self.assertEqual(m.source_size(), (1500, 2000))
+        m.srcfile = 'testimages/tetons.jpg'
+        self.assertEqual(m.source_size(), (4000, 3000))
+
+    def test_pipeline(self):
+        """Manipulations build a pipeline of commands."""
+        m = IIIFManipulatorNetpbm()
+        m.srcfile = 'testimages/starfish_1500x2000.png'
+        m.do_first()
+        self.assertEqual(m.pipeline, [[m.pngtopnm, m.srcfile]])
+        self.assertEqual((m.width, m.height), (1500, 2000))
+        m.do_region(None, None, None, None)
+        m.do_size(None, None)
+        m.do_rotation(False, 0.0)
+        m.do_quality('default')
+        self.assertEqual(len(m.pipeline), 1)
+        m.do_region(10, 20, 100, 200)
+        m.do_size(50, 100)
+        m.do_rotation(False, 90.0)
+        m.do_quality('bitonal')
+        self.assertEqual(m.pipeline[1:], [
+            [m.pnmcut, '10', '20', '100', '200'],
+            [m.pnmscale, '-width', '50', '-height', '100'],
+            [m.pnmrotate, '-background=#FFF', '-90.0'],
+            [m.pnmscale, '-width', '100', '-height', '50'],
+            [m.ppmtopgm],
+            [m.pamditherbw]])
+        m.pipeline = m.pipeline[:1]
+        m.do_rotation(False, 200.0)
+        self.assertEqual(m.pipeline[1:], [[m.pnmflip, '-rotate180'],
+                                          [m.pnmrotate, '-20.0']])
+        self.assertRaises(IIIFError, m.do_quality, 'bogus')
+        self.assertRaises(IIIFError, m.do_format, 'gif')
+
+    def test_run_pipeline(self):
+        """Run pipeline without shell."""
+        m = IIIFManipulatorNetpbm()
+        py = sys.executable
+        upper = [py, '-c', 'import sys; sys.stdout.write(sys.stdin.read().upper())']
+        self.assertEqual(m.run_pipeline([[py, '-c', 'import sys; sys.stdout.write("abc")'],
+                                         upper, upper]), b'ABC')
+        # Output to file
+        with tempfile.TemporaryFile() as fh:
+            self.assertEqual(m.run_pipeline([[py, '-c', 'print(123)']], fh), None)
+            fh.seek(0)
+            self.assertEqual(fh.read().strip(), b'123')
+        # Later program stops reading, writer killed by SIGPIPE like
+        # the netpbm programs (python itself ignores SIGPIPE)
+        writer = ('import signal; signal.signal(signal.SIGPIPE, signal.SIG_DFL)\n'
+                  'while True: print("x" * 1000)')
+        self.assertEqual(m.run_pipeline([[py, '-c', writer],
+                                         [py, '-c', 'import sys; sys.stdout.write(sys.stdin.read(3))']]),
+                         b'xxx')
+        # Input written by source
+        self.assertEqual(m.run_pipeline([upper, upper], source=lambda fh: fh.write(b'def')),
+                         b'DEF')
+        self.assertEqual(m.run_pipeline([[py, '-c', 'import sys; sys.stdout.write(sys.stdin.read(2))']],
+                                        source=lambda fh: fh.write(b'x' * 10000000)),
+                         b'xx')
+        # Failures
+        self.assertRaises(IIIFError, m.run_pipeline,
+                          [[py, '-c', 'import sys; sys.exit(3)'], upper])
+        self.assertRaises(IIIFError, m.run_pipeline,
+                          [upper, ['/nonexistent/pnmcut']], source=lambda fh: fh.write(b'abc'))
+        self.assertRaises(IIIFError, m.run_pipeline,
+                          [upper, ['/nonexistent/pnmcut']])
+
+    @unittest.skipUnless(which('pngtopnm'), "netpbm not installed")
+    def test_derive(self):
+        """Derive image in memory with netpbm pipeline."""
+        m = IIIFManipulatorNetpbm()
+        r = IIIFRequest(api_version='2.1')
+        r.parse_url('id/10,20,300,400/150,/0/gray.png')
+        (outfile, mime_type) = m.derive('testimages/starfish_1500x2000.png', r)
+        self.assertEqual((outfile, mime_type), (None, 'image/png'))
+        image = Image.open(io.BytesIO(m.outbytes))
+        self.assertEqual(image.size, (150, 200))
+        self.assertEqual(image.mode, 'L')
+
+    def test_unique_basename(self):
+        """Working files are unique to each request."""
+        m1 = IIIFManipulatorNetpbm()
+        m2 = IIIFManipulatorNetpbm()
+        m1.cleanup()  # nothing to clean up before do_first()
+        for m in (m1, m2):
+            m.srcfile = 'testimages/starfish_1500x2000.png'
+            m.do_first()
+        self.assertNotEqual(m1.basename, m2.basename)
+        self.assertTrue(os.path.basename(m1.basename).startswith('iiif_netpbm_%d_' % os.getpid()))
+
+    def test_pipeline_limit(self):
+        """Pipelines hold a slot of pipeline_limit while running."""
+        m = IIIFManipulatorNetpbm()
+        m.pipeline_limit = PipelineLimit(1, timeout=0.05)
+        py = sys.executable
+        out = m.run_pipeline([[py, '-c', 'print(1)']])
+        self.assertEqual((m.pipeline_limit.running, out.strip()), (0, b'1'))
+        self.assertRaises(IIIFError, m.run_pipeline, [[py, '-c', 'import sys; sys.exit(1)']])
+        self.assertEqual(m.pipeline_limit.running, 0)
+        self.assertEqual(m.shell_call('exit 0'), 0)
+        self.assertEqual(m.pipeline_limit.running, 0)
+        # No slot free
+        m.pipeline_limit.acquire()
+        with self.assertRaises(IIIFError) as cm:
+            m.run_pipeline([[py, '-c', 'print(1)']])
+        self.assertEqual(cm.exception.code, 503)
+
+    def test_image_size(self):
+        """Size from PNM header at start of pipeline output."""
+        m = IIIFManipulatorNetpbm()
+        py = sys.executable
+        writer = ('import signal, sys; signal.signal(signal.SIGPIPE, signal.SIG_DFL)\n'
+                  'sys.stdout.write("P6\\n# comment\\n1500 2000\\n255\\n")\n'
+                  'while True: sys.stdout.write("x" * 1000)')
+        m.pipeline = [[py, '-c', writer]]
+        self.assertEqual(m.image_size(), (1500, 2000))
+        m.pipeline = [[py, '-c', 'print("GIF89a")']]
+        self.assertRaises(IIIFError, m.image_size)
+        m.pipeline = [[py, '-c', 'print("P5")']]
+        self.assertRaises(IIIFError, m.image_size)
+
+    def test_pnm_cache(self):
+        """Decoded source cached and region rows read from cache."""
+        tmp = tempfile.mkdtemp()
+        try:
+            # Decoder writing PNM with PIL in place of pngtopnm
+            decoder = os.path.join(tmp, 'topnm')
+            with open(decoder, 'w') as fh:
+                fh.write('#!%s\n'
+                         'import sys\n'
+                         'from PIL import Image\n'
+                         'out = getattr(sys.stdout, "buffer", sys.stdout)\n'
+                         'Image.open(sys.argv[1]).save(out, format="PPM")\n' % (sys.executable))
+            os.chmod(decoder, 0o755)
+            cache = PNMCache(os.path.join(tmp, 'cache'))
+            for n in range(2):
+                m = IIIFManipulatorNetpbm()
+                m.pnm_cache = cache
+                m.pngtopnm = decoder
+                m.srcfile = 'testimages/test1.png'
+                m.do_first()
+                self.assertEqual((m.width, m.height), (175, 131))
+                self.assertEqual(m.pipeline, [])
+                self.assertEqual((cache.hits, cache.misses), (n, 1))
+                m.do_region(10, 20, 30, 40)
+                self.assertEqual(m.pipeline, [[m.pnmcut, '10', '0', '30', '40']])
+                self.assertEqual(m.source['rows'], (20, 40))
+                out = io.BytesIO()
+                m.write_source(out)
+                image = Image.open(io.BytesIO(out.getvalue()))
+                expected = Image.open('testimages/test1.png').crop((0, 20, 175, 60))
+                self.assertEqual(image.tobytes(), expected.tobytes())
+                m.cleanup()
+                self.assertEqual(m.source, None)
+        finally:
+            shutil.rmtree(tmp)
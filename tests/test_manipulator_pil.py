@@ -1,17 +1,28 @@
 """Test code for PIL based IIIF image manipulator."""
 import unittest
+import io
 import tempfile
 import os
 import os.path
 import re
+import shutil
 import sys
 from testfixtures import LogCapture
+try:
+    from shutil import which
+except ImportError:  # Python 2
+    from distutils.spawn import find_executable as which
 
-from PIL import Image
+from PIL import Image, ImageChops, ImageStat
 
 from iiif.error import IIIFError
+from iiif.icc import TransformCache
+from iiif.image_cache import ImageCache
 from iiif.manipulator_pil import IIIFManipulatorPIL
+from iiif.memory_budget import MemoryBudget
 from iiif.request import IIIFRequest
+from .testlib.icc import swapped_rgb_profile
+from .testlib.tiff import write_tiled_tiff, pyramid
 
 
 class TestAll(unittest.TestCase):
@@ -95,6 +106,26 @@ class TestAll(unittest.TestCase):
         self.assertEqual(m.image.size, (88, 66))
         self.assertEqual(m.width, 88)
         self.assertEqual(m.height, 66)
+        # 16-bit source, which Image.reduce() does not support, with a
+        # large non-integer reduction
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        src = os.path.join(tmp, 'i16.png')
+        gray = Image.open('testimages/starfish_1500x2000.png').convert('L').resize((400, 300))
+        gray.point(lambda i: i * 257).convert('I;16').save(src)
+        self.assertEqual(Image.open(src).mode, 'I;16')
+        m = IIIFManipulatorPIL()
+        m.srcfile = src
+        m.do_first()
+        m.do_size(37, 28)
+        self.assertEqual(m.image.size, (37, 28))
+        expected = Image.open(src).resize((37, 28))
+        self.assertEqual(m.image.tobytes(), expected.tobytes())
+        r = IIIFRequest(api_version='2.1')
+        r.parse_url('id/full/37,/0/default.png')
+        outfile = os.path.join(tmp, 'out.png')
+        IIIFManipulatorPIL().derive(srcfile=src, request=r, outfile=outfile)
+        self.assertEqual(Image.open(outfile).size, (37, 28))
 
     def test06_do_rotation(self):
         """Test rotation."""
@@ -146,6 +177,35 @@ class TestAll(unittest.TestCase):
         m.do_first()
         self.assertEqual(m.do_quality('color'), None)
         self.assertEqual(m.image.mode, 'RGB')
+        # 16-bit images give the same result as conversion via mode I
+        # and scaling, the most significant byte of each pixel
+        gray = Image.open('testimages/starfish_1500x2000.png').convert('L').crop((0, 0, 300, 200))
+        low = Image.new('L', gray.size, 0x5a)
+        for mode in ('I;16', 'I;16B', 'I;16N'):
+            # Interleave high bytes from gray with constant low bytes
+            data = bytearray(2 * gray.size[0] * gray.size[1])
+            if (mode == 'I;16B' or (mode == 'I;16N' and sys.byteorder == 'big')):
+                (data[0::2], data[1::2]) = (gray.tobytes(), low.tobytes())
+            else:
+                (data[0::2], data[1::2]) = (low.tobytes(), gray.tobytes())
+            image16 = Image.frombytes(mode, gray.size, bytes(data))
+            m = IIIFManipulatorPIL()
+            m.image = image16
+            m.do_quality('color')
+            self.assertEqual(m.image.mode, 'RGB')
+            self.assertEqual(m.image.tobytes(), gray.convert('RGB').tobytes())
+            if (mode != 'I;16N'):
+                # PIL conversion of I;16N to I gives a white image
+                old = image16.convert('I').point(lambda i: i * (1.0 / 256.0))
+                self.assertEqual(m.image.tobytes(), old.convert('RGB').tobytes())
+            # Gray and bitonal are PIL's direct conversions as before
+            m.image = image16
+            m.do_quality('gray')
+            self.assertEqual(m.image.mode, 'L')
+            self.assertEqual(m.image.tobytes(), image16.convert('L').tobytes())
+            m.image = image16
+            m.do_quality('bitonal')
+            self.assertEqual(m.image.tobytes(), image16.convert('1').tobytes())
 
     def test08_do_format(self):
         """Test format selection."""
@@ -190,6 +250,18 @@ class TestAll(unittest.TestCase):
         m.do_first()
         self.assertEqual(m.do_format(None), None)
         self.assertTrue(os.path.exists(m.outfile))
+        os.unlink(m.outfile)
+        # encode in memory
+        m = IIIFManipulatorPIL()
+        m.srcfile = 'testimages/test1.png'
+        m.in_memory = True
+        m.do_first()
+        self.assertEqual(m.do_format('png'), None)
+        self.assertEqual(m.outfile, None)
+        self.assertEqual(m.outtmp, None)
+        self.assertTrue(m.outbytes.startswith(b'\x89PNG'))
+        img = Image.open(io.BytesIO(m.outbytes))
+        self.assertEqual(img.size, (175, 131))
 
     def test09_cleanup(self):
         """Test cleanup."""
@@ -201,3 +273,643 @@ class TestAll(unittest.TestCase):
             self.assertEqual(m.cleanup(), None)
             self.assertEqual(lc.records[-1].msg,
                              'Failed to cleanup tmp output file /this_will_not_exist_really_I_hope')
+
+    def test10_reduce_decode(self):
+        """Test reduced resolution decode of JPEG source."""
+        # No request so no lookahead, full decode
+        m = IIIFManipulatorPIL()
+        m.srcfile = 'testimages/tetons.jpg'
+        m.do_first()
+        m.do_region(1000, 1000, 2000, 1000)
+        self.assertEqual(m.image_scale, (1, 1))
+        self.assertEqual(m.image.size, (2000, 1000))
+        # Region scaled down by 8, decode at 1/8
+        m = IIIFManipulatorPIL()
+        m.request = IIIFRequest(api_version='2.1')
+        m.request.parse_url('id/1000,1000,2000,1000/250,/0/default.jpg')
+        m.srcfile = 'testimages/tetons.jpg'
+        m.do_first()
+        m.do_region(1000, 1000, 2000, 1000)
+        self.assertEqual(m.image_scale, (8, 8))
+        self.assertEqual(m.image.size, (500, 375))
+        self.assertEqual(m.region_box, (125, 125, 375, 250))
+        self.assertEqual(m.width, 2000)
+        self.assertEqual(m.height, 1000)
+        m.do_size(250, 125)
+        self.assertEqual(m.image.size, (250, 125))
+        # Compare with full decode
+        full = Image.open('testimages/tetons.jpg')
+        full = full.crop((1000, 1000, 3000, 2000)).resize((250, 125))
+        diff = ImageStat.Stat(ImageChops.difference(full, m.image))
+        self.assertLess(max(diff.mean), 4.0)
+        # Full region scaled by 3, decode at 1/2
+        m.request = IIIFRequest(api_version='2.1')
+        m.request.parse_url('id/full/1300,/0/default.jpg')
+        m.do_first()
+        m.do_region(None, None, None, None)
+        self.assertEqual(m.image_scale, (2, 2))
+        self.assertEqual(m.image.size, (2000, 1500))
+        # Not a format with reduced decoding, no change
+        m.srcfile = 'testimages/robot_palette_320x200.gif'
+        m.request = IIIFRequest(api_version='2.1')
+        m.request.parse_url('id/full/100,/0/default.jpg')
+        m.do_first()
+        m.do_region(None, None, None, None)
+        self.assertEqual(m.image_scale, (1, 1))
+        self.assertEqual(m.image.size, (320, 200))
+
+    def test11_fused_region_size_rotation(self):
+        """Test region+size and mirror+rotation match separate steps."""
+        src = Image.open('testimages/starfish_1500x2000.png')
+        src.load()
+        m = IIIFManipulatorPIL()
+        m.request = IIIFRequest(api_version='2.1')
+        m.request.parse_url('id/100,200,900,600/320,/0/default.jpg')
+        m.srcfile = 'testimages/starfish_1500x2000.png'
+        m.do_first()
+        m.do_region(100, 200, 900, 600)
+        # PNG rows read just for the region, not resized yet
+        self.assertEqual(m.image_offset, (100, 200))
+        self.assertEqual(m.region_box, (0, 0, 900, 600))
+        self.assertEqual(m.image.size, (900, 600))
+        m.do_size(320, 213)
+        self.assertEqual(m.region_box, None)
+        self.assertEqual(m.image.size, (320, 213))
+        expected = src.crop((100, 200, 1000, 800)).resize((320, 213))
+        self.assertEqual(ImageChops.difference(expected, m.image).getbbox(), None)
+        # Region box within decoded image
+        m.request = IIIFRequest(api_version='2.1')
+        m.request.parse_url('id/100,200,480,320/320,/0/default.jpg')
+        m.srcfile = 'testimages/starfish.jpg'
+        m.do_first()
+        m.do_region(100, 200, 480, 320)
+        self.assertEqual(m.region_box, (100, 200, 580, 520))
+        self.assertEqual(m.image.size, (3000, 4000))  # not cropped yet
+        m.do_size(320, 213)
+        self.assertEqual(m.region_box, None)
+        self.assertEqual(m.image.size, (320, 213))
+        src = Image.open('testimages/starfish.jpg')
+        expected = src.crop((100, 200, 580, 520)).resize((320, 213))
+        # identical away from edges where resize(box=...) has the benefit
+        # of filter support from outside the region
+        diff = ImageChops.difference(expected, m.image)
+        self.assertEqual(diff.crop((2, 2, 318, 211)).getbbox(), None)
+        self.assertLess(max(ImageStat.Stat(diff).mean), 0.1)
+        src = Image.open('testimages/starfish_1500x2000.png')
+        # Mirror and rotation
+        region = src.crop((0, 0, 150, 100))
+        for mirror in (False, True):
+            for rot in (0.0, 30.0, 90.0, 180.0, 270.0, 123.4):
+                expected = region
+                if (mirror):
+                    expected = expected.transpose(Image.FLIP_LEFT_RIGHT)
+                if (rot != 0.0):
+                    expected = expected.rotate(-rot, expand=True)
+                m.image = region
+                m.do_rotation(mirror, rot)
+                self.assertEqual(m.image.size, expected.size)
+                diff = ImageStat.Stat(ImageChops.difference(expected, m.image))
+                self.assertLess(max(diff.mean), 0.5)
+
+    def test12_reduce_factors(self):
+        """Test integer reduction fast path."""
+        src = Image.open('testimages/starfish_1500x2000.png')
+        src.load()
+        m = IIIFManipulatorPIL()
+        m.image = src
+        self.assertEqual(m.reduce_factors(None, 750, 1000), (2, 2))
+        self.assertEqual(m.reduce_factors(None, 375, 1000), (4, 2))
+        self.assertEqual(m.reduce_factors((0, 0, 1024, 1024), 256, 256), (4, 4))
+        self.assertEqual(m.reduce_factors((0, 0, 1024, 1024), 300, 300), None)
+        self.assertEqual(m.reduce_factors((0, 0, 1024, 1024), 1024, 1024), None)
+        self.assertEqual(m.reduce_factors((0.5, 0, 1024.5, 1024), 256, 256), None)
+        m.image = src.convert('P')
+        self.assertEqual(m.reduce_factors(None, 750, 1000), None)
+        # Tile at scale factor 4 uses reduce
+        m.image = src
+        m.region_box = (1024, 1024, 1500, 2000)
+        m.do_size(119, 244)
+        self.assertEqual(m.image.size, (119, 244))
+        expected = src.reduce(4, box=(1024, 1024, 1500, 2000))
+        self.assertEqual(ImageChops.difference(expected, m.image).getbbox(), None)
+        # Non-integer reduction still close to plain resize
+        m.image = src
+        m.region_box = (0, 0, 1500, 2000)
+        m.do_size(123, 164)
+        self.assertEqual(m.image.size, (123, 164))
+        diff = ImageStat.Stat(ImageChops.difference(src.resize((123, 164)), m.image))
+        self.assertLess(max(diff.mean), 1.0)
+
+    def test13_reduce_decode_tiff(self):
+        """Test resolution level and tile selection for TIFF source."""
+        src = Image.open('testimages/starfish_1500x2000.png')
+        src.load()
+        tmp = tempfile.mkdtemp()
+        try:
+            f = os.path.join(tmp, 'pyramid.tif')
+            write_tiled_tiff(f, pyramid(src, 4), tile=128)
+            # Tile at full resolution, decode only tiles in region
+            m = IIIFManipulatorPIL()
+            m.request = IIIFRequest(api_version='2.1')
+            m.request.parse_url('id/512,1024,512,512/512,/0/default.png')
+            m.derive(srcfile=f, outfile=os.path.join(tmp, 'out.png'))
+            self.assertEqual(m.image_scale, (1, 1))
+            self.assertEqual(m.image_offset, (512, 1024))
+            self.assertEqual(m.image.size, (512, 512))
+            diff = ImageChops.difference(src.crop((512, 1024, 1024, 1536)), m.image)
+            self.assertEqual(diff.getbbox(), None)
+            # Tile at scale factor 4 from 1/4 resolution level
+            m = IIIFManipulatorPIL()
+            m.request = IIIFRequest(api_version='2.1')
+            m.request.parse_url('id/0,1024,1024,976/256,/0/default.png')
+            m.srcfile = f
+            m.do_first()
+            m.do_region(0, 1024, 1024, 976)
+            self.assertEqual(m.image_scale, (4, 4))
+            self.assertEqual(m.image_offset, (0, 256))
+            self.assertEqual(m.image.size, (256, 244))
+            self.assertEqual(m.region_box, (0, 0, 256, 244))
+            m.do_size(256, 244)
+            self.assertEqual(m.image.size, (256, 244))
+            # Full image thumbnail from smallest level, decoded whole
+            m = IIIFManipulatorPIL()
+            m.request = IIIFRequest(api_version='2.1')
+            m.request.parse_url('id/full/150,/0/default.png')
+            m.srcfile = f
+            m.do_first()
+            m.do_region(None, None, None, None)
+            self.assertEqual(m.image_scale, (1500 / 188.0, 8))
+            self.assertEqual(m.image_offset, (0, 0))
+            self.assertEqual(m.image.size, (188, 250))
+            m.do_size(150, 200)
+            diff = ImageStat.Stat(ImageChops.difference(src.resize((150, 200)), m.image))
+            self.assertLess(max(diff.mean), 4.0)
+        finally:
+            shutil.rmtree(tmp)
+
+    def test14_reduce_decode_jp2(self):
+        """Test reduction level and tile selection for JPEG 2000 source."""
+        src = Image.open('testimages/starfish_1500x2000.png').convert('RGB').crop((0, 0, 700, 500))
+        tmp = tempfile.mkdtemp()
+        try:
+            f = os.path.join(tmp, 'tiled.jp2')
+            src.save(f, tile_size=(128, 128), num_resolutions=4)
+            # Tile at full resolution, decode only tiles in region
+            m = IIIFManipulatorPIL()
+            m.request = IIIFRequest(api_version='2.1')
+            m.request.parse_url('id/256,128,256,256/256,/0/default.png')
+            m.derive(srcfile=f, outfile=os.path.join(tmp, 'out.png'))
+            self.assertEqual(m.image_scale, (1, 1))
+            self.assertEqual(m.image_offset, (256, 128))
+            self.assertEqual(m.image.size, (256, 256))
+            diff = ImageChops.difference(src.crop((256, 128, 512, 384)), m.image)
+            self.assertEqual(diff.getbbox(), None)
+            # Scaled down by 4, decode at reduce 2
+            m = IIIFManipulatorPIL()
+            m.request = IIIFRequest(api_version='2.1')
+            m.request.parse_url('id/0,0,512,256/128,/0/default.png')
+            m.srcfile = f
+            m.do_first()
+            m.do_region(0, 0, 512, 256)
+            self.assertEqual(m.image_scale, (4, 4))
+            self.assertEqual(m.region_box, (0, 0, 128, 64))
+            m.do_size(128, 64)
+            self.assertEqual(m.image.size, (128, 64))
+            full = Image.open(f)
+            full.reduce = 2
+            diff = ImageChops.difference(full.crop((0, 0, 128, 64)), m.image)
+            self.assertEqual(diff.getbbox(), None)
+            # Full image scaled beyond levels available, reduce 3
+            m = IIIFManipulatorPIL()
+            m.request = IIIFRequest(api_version='2.1')
+            m.request.parse_url('id/full/35,/0/default.png')
+            m.srcfile = f
+            m.do_first()
+            m.do_region(None, None, None, None)
+            self.assertEqual(m.image_scale, (8, 8))
+            self.assertEqual(m.image_offset, (0, 0))
+            m.do_size(35, 25)
+            self.assertEqual(m.image.size, (35, 25))
+        finally:
+            shutil.rmtree(tmp)
+
+    def test15_image_cache(self):
+        """Test use of decoded image cache."""
+        IIIFManipulatorPIL.image_cache = ImageCache(max_bytes=13000000)
+        try:
+            m = IIIFManipulatorPIL()
+            m.request = IIIFRequest(api_version='2.1')
+            m.request.parse_url('id/0,0,100,100/50,/0/default.png')
+            m.derive(srcfile='testimages/starfish_1500x2000.png', outfile=None)
+            self.assertEqual(m.image_cache.misses, 1)
+            self.assertEqual(len(m.image_cache), 1)
+            self.assertEqual(m.image_scale, (1, 1))
+            self.assertEqual(m.image.size, (50, 50))
+            cached = m.cached_image
+            m.cleanup()
+            # Same source again uses cached image
+            m = IIIFManipulatorPIL()
+            m.request = IIIFRequest(api_version='2.1')
+            m.request.parse_url('id/full/full/0/default.png')
+            m.srcfile = 'testimages/starfish_1500x2000.png'
+            m.do_first()
+            self.assertEqual(m.image_cache.hits, 1)
+            self.assertIs(m.image, cached)
+            # Output saved from another image object sharing the pixels
+            m.do_format('png')
+            self.assertFalse(hasattr(cached, 'encoderinfo'))
+            self.assertEqual(Image.open(m.outfile).size, (1500, 2000))
+            m.cleanup()
+            # Not closed by cleanup
+            self.assertEqual(cached.getpixel((0, 0)), Image.open('testimages/starfish_1500x2000.png').getpixel((0, 0)))
+            # Too big for cache
+            m = IIIFManipulatorPIL()
+            m.srcfile = 'testimages/tetons.jpg'
+            m.do_first()
+            self.assertEqual(m.cached_image, None)
+            self.assertEqual(len(m.image_cache), 1)
+        finally:
+            IIIFManipulatorPIL.image_cache = None
+
+    def test16_source_size(self):
+        """Test size from image header."""
+        m = IIIFManipulatorPIL()
+        m.srcfile = 'testimages/tetons.jpg'
+        self.assertEqual(m.source_size(), (4000, 3000))
+        self.assertEqual(m.image, None)
+        m.srcfile = 'testimages/nonexistent.png'
+        self.assertRaises(IIIFError, m.source_size)
+
+    def test17_plan_operations(self):
+        """Test planned operations give same result as spec order."""
+        src = Image.open('testimages/starfish_1500x2000.png').crop((0, 0, 400, 300))
+        tmp = tempfile.mkdtemp()
+        try:
+            srcfile = os.path.join(tmp, 'src.png')
+            src.save(srcfile)
+            src.convert('P').save(os.path.join(tmp, 'pal.png'))
+            for (url, plan) in (
+                    ('id/full/full/0/default.png', ('quality',)),
+                    ('id/full/200,/0/default.png', ('region', 'size', 'quality')),
+                    ('id/10,20,300,200/full/0/gray.png', ('region', 'quality')),
+                    ('id/10,20,300,200/150,/90/gray.png', ('region', 'size', 'quality', 'rotation')),
+                    ('id/full/full/33/gray.png', ('quality', 'rotation')),
+                    ('id/full/full/180/color.png', ('rotation', 'quality')),
+                    ('id/full/full/22.5/bitonal.png', ('rotation', 'quality'))):
+                m = IIIFManipulatorPIL()
+                m.request = IIIFRequest(api_version='2.1')
+                m.request.parse_url(url)
+                m.derive(srcfile=srcfile, outfile=None)
+                self.assertEqual(m.plan, plan)
+                # Spec order
+                s = IIIFManipulatorPIL()
+                s.request = m.request
+                s.srcfile = srcfile
+                s.do_first()
+                s.do_region(*s.region_to_apply())
+                s.do_size(*s.size_to_apply())
+                s.do_rotation(*s.rotation_to_apply(no_mirror=True))
+                s.do_quality(s.quality_to_apply())
+                self.assertEqual(m.image.mode, s.image.mode)
+                self.assertEqual(ImageChops.difference(m.image, s.image).getbbox(), None)
+                m.cleanup()
+            # Palette image rotated before gray because of background
+            m = IIIFManipulatorPIL()
+            m.request = IIIFRequest(api_version='2.1')
+            m.request.parse_url('id/full/full/33/gray.png')
+            m.derive(srcfile=os.path.join(tmp, 'pal.png'), outfile=None)
+            self.assertEqual(m.plan, ('rotation', 'quality'))
+            m.cleanup()
+        finally:
+            shutil.rmtree(tmp)
+
+    def test18_derive_many(self):
+        """Test derive_many gives the same images as derive."""
+        srcfile = 'testimages/starfish_1500x2000.png'
+        requests = []
+        for url in ('id/0,0,512,512/256,/0/default.png',
+                    'id/512,0,512,512/256,/0/default.png',
+                    'id/1024,1536,476,464/238,/0/default.png',
+                    'id/0,0,1024,1024/256,/0/default.png',
+                    'id/full/375,/0/default.png',
+                    'id/10,20,30,40/full/90/gray.png',
+                    'id/1500,0,10,10/full/0/default.png'):
+            r = IIIFRequest(api_version='2.1')
+            r.parse_url(url)
+            requests.append(r)
+        m = IIIFManipulatorPIL()
+        m.in_memory = True
+        n = 0
+        for (outfile, mime_type, error) in m.derive_many(srcfile, requests):
+            if (n == 6):
+                self.assertTrue(isinstance(error, IIIFError))
+                self.assertEqual(sorted(m.shared_bases.keys()), [2, 4])
+                break
+            self.assertEqual(error, None)
+            self.assertEqual(mime_type, 'image/png')
+            s = IIIFManipulatorPIL()
+            s.derive(srcfile=srcfile, request=requests[n], outfile=None)
+            image = Image.open(io.BytesIO(m.outbytes))
+            self.assertEqual(ImageChops.difference(image, s.image).getbbox(), None)
+            s.cleanup()
+            if (n == 1):
+                # Shared base for the tiles reduced by 2
+                self.assertEqual(list(m.shared_bases.keys()), [2])
+            n += 1
+        self.assertEqual(n, 6)
+        # Shared images are closed at end
+        self.assertEqual(m.shared_image, None)
+        self.assertEqual(m.shared_bases, None)
+        # Bad source
+        self.assertRaises(IIIFError, list,
+                          m.derive_many('testimages/bad.png', requests))
+
+    def test19_strips(self):
+        """Test strip-parallel operations give the same images."""
+        srcfile = 'testimages/starfish_1500x2000.png'
+        try:
+            for url in ('id/full/750,/0/default.png',
+                        'id/full/600,/0/gray.png',
+                        'id/0,0,1000,1000/500,/90/default.png',
+                        'id/full/full/180/gray.png',
+                        'id/full/1000,/0/default.png'):
+                images = []
+                for (threads, min_pixels) in ((1, 1), (4, 1)):
+                    IIIFManipulatorPIL.strip_threads = threads
+                    IIIFManipulatorPIL.strip_min_pixels = min_pixels
+                    m = IIIFManipulatorPIL()
+                    m.request = IIIFRequest(api_version='2.1')
+                    m.request.parse_url(url)
+                    m.derive(srcfile=srcfile, outfile=None)
+                    images.append(m.image.copy())
+                    m.cleanup()
+                self.assertEqual(images[0].size, images[1].size)
+                self.assertEqual(ImageChops.difference(images[0], images[1]).getbbox(), None)
+            # Small image not split
+            m = IIIFManipulatorPIL()
+            m.srcfile = srcfile
+            m.do_first()
+            self.assertEqual(m.strips(), 4)
+            IIIFManipulatorPIL.strip_min_pixels = 4000000
+            self.assertEqual(m.strips(), 0)
+        finally:
+            IIIFManipulatorPIL.strip_threads = None
+            IIIFManipulatorPIL.strip_min_pixels = 16 * 1024 * 1024
+
+    def test20_encoder_profiles(self):
+        """Test encoder profiles."""
+        m = IIIFManipulatorPIL()
+        m.srcfile = 'testimages/test1.png'
+        m.in_memory = True
+        m.do_first()
+        self.assertEqual(m.encoder_options('png'), {})
+        m.do_format('png')
+        default = len(m.outbytes)
+        m.encoder_profile = 'fast'
+        self.assertEqual(m.encoder_options('png'), {'compress_level': 1})
+        m.do_format('png')
+        self.assertTrue(len(m.outbytes) > default)
+        m.encoder_profile = 'small'
+        self.assertEqual(m.encoder_options('jpeg'),
+                         {'quality': 75, 'optimize': True, 'progressive': True})
+        # Large image profile
+        m.encoder_profile = 'fast'
+        m.encoder_profile_large = 'small'
+        m.encoder_large_pixels = 175 * 131
+        self.assertEqual(m.encoder_options('webp'), {'quality': 75, 'method': 6})
+        m.encoder_large_pixels = 175 * 131 + 1
+        self.assertEqual(m.encoder_options('webp'), {'quality': 75, 'method': 0})
+        # Bad profile
+        m.encoder_profile = 'bogus'
+        self.assertRaises(IIIFError, m.do_format, 'png')
+
+    def test21_estimate_memory(self):
+        """Test estimate of memory and admission with memory budget."""
+        m = IIIFManipulatorPIL()
+        m.srcfile = 'testimages/starfish.jpg'
+        m.request = IIIFRequest(api_version='2.1')
+        m.request.parse_url('id/full/full/0/default.jpg')
+        m.do_first()
+        full = m.estimate_memory()
+        self.assertEqual(full, 2 * 3000 * 4000 * 4)
+        # JPEG draft decode at 1/8 scale
+        m.request = IIIFRequest(api_version='2.1')
+        m.request.parse_url('id/full/375,/0/default.jpg')
+        self.assertEqual(m.estimate_memory(), 2 * 375 * 500 * 4)
+        # Rotation and conversion to gray
+        m.request = IIIFRequest(api_version='2.1')
+        m.request.parse_url('id/full/375,/90/gray.jpg')
+        self.assertEqual(m.estimate_memory(), 2 * 375 * 500 * 4)
+        m.cleanup()
+        # Tile of tiled TIFF needs just the tiles covering it
+        tmp = tempfile.mkdtemp()
+        try:
+            tiff = os.path.join(tmp, 'tiled.tif')
+            image = Image.open('testimages/starfish_1500x2000.png').convert('RGB')
+            write_tiled_tiff(tiff, [image], tile=256)
+            m = IIIFManipulatorPIL()
+            m.srcfile = tiff
+            m.request = IIIFRequest(api_version='2.1')
+            m.request.parse_url('id/0,0,256,256/full/0/default.jpg')
+            m.do_first()
+            self.assertEqual(m.estimate_memory(), 2 * 256 * 256 * 4)
+            m.cleanup()
+        finally:
+            shutil.rmtree(tmp)
+        # Admission with budget
+        budget = MemoryBudget(full - 1, timeout=0.0)
+        IIIFManipulatorPIL.memory_budget = budget
+        try:
+            m = IIIFManipulatorPIL()
+            m.request = IIIFRequest(api_version='2.1')
+            m.request.parse_url('id/full/375,/0/default.jpg')
+            m.derive(srcfile='testimages/starfish.jpg')
+            self.assertEqual(budget.bytes, 0)
+            m.cleanup()
+            m = IIIFManipulatorPIL()
+            m.request = IIIFRequest(api_version='2.1')
+            m.request.parse_url('id/full/full/0/default.png')
+            with self.assertRaises(IIIFError) as cm:
+                m.derive(srcfile='testimages/starfish.jpg')
+            self.assertEqual(cm.exception.code, 503)
+            self.assertEqual(budget.bytes, 0)
+            m.cleanup()
+        finally:
+            IIIFManipulatorPIL.memory_budget = None
+
+    def test22_icc_to_srgb(self):
+        """Test conversion of source with ICC profile to sRGB."""
+        tmp = tempfile.mkdtemp()
+        try:
+            src = os.path.join(tmp, 'icc.png')
+            profile = swapped_rgb_profile()
+            image = Image.open('testimages/starfish_1500x2000.png').convert('RGB')
+            image.save(src, icc_profile=profile)
+            # No conversion by default
+            m = IIIFManipulatorPIL()
+            m.request = IIIFRequest(api_version='2.1')
+            m.request.parse_url('id/full/150,/0/default.png')
+            m.derive(srcfile=src)
+            self.assertEqual(m.icc_profile, profile)
+            unconverted = m.image.copy()
+            (r, g, b) = unconverted.split()
+            swapped = Image.merge('RGB', (b, g, r))
+            m.cleanup()
+            # Conversion with cache of transforms
+            IIIFManipulatorPIL.icc_transforms = TransformCache()
+            for n in range(2):
+                m = IIIFManipulatorPIL()
+                m.request = IIIFRequest(api_version='2.1')
+                m.request.parse_url('id/full/150,/0/default.png')
+                m.derive(srcfile=src)
+                self.assertEqual(m.image.tobytes(), swapped.tobytes())
+                m.cleanup()
+            self.assertEqual((m.icc_transforms.hits, m.icc_transforms.misses), (1, 1))
+            # Gray is from sRGB values
+            m = IIIFManipulatorPIL()
+            m.request = IIIFRequest(api_version='2.1')
+            m.request.parse_url('id/full/150,/0/gray.png')
+            m.derive(srcfile=src)
+            self.assertEqual(m.image.tobytes(), swapped.convert('L').tobytes())
+            m.cleanup()
+            # Source without profile unchanged
+            m = IIIFManipulatorPIL()
+            m.request = IIIFRequest(api_version='2.1')
+            m.request.parse_url('id/full/150,/0/default.png')
+            m.derive(srcfile='testimages/starfish_1500x2000.png')
+            self.assertEqual(m.icc_profile, None)
+            self.assertEqual(m.image.tobytes(), unconverted.tobytes())
+            m.cleanup()
+        finally:
+            IIIFManipulatorPIL.icc_transforms = None
+            shutil.rmtree(tmp)
+
+    def test23_passthrough(self):
+        """Test passthrough of source file for requests that leave it unchanged."""
+        def derive(srcfile, path, outfile=None, **kwargs):
+            m = IIIFManipulatorPIL()
+            for (name, value) in kwargs.items():
+                setattr(m, name, value)
+            m.request = IIIFRequest(api_version='2.1')
+            m.request.parse_url('id/' + path)
+            m.derive(srcfile=srcfile, outfile=outfile)
+            m.cleanup()
+            return m
+        tmp = tempfile.mkdtemp()
+        try:
+            image = Image.open('testimages/starfish_1500x2000.png').convert('RGB').resize((150, 200))
+            jpg = os.path.join(tmp, 'small.jpg')
+            image.save(jpg)
+            png = os.path.join(tmp, 'small.png')
+            image.save(png)
+            # Passed through
+            for (srcfile, path, mime_type) in (
+                    (jpg, 'full/full/0/default.jpg', 'image/jpeg'),
+                    (jpg, 'full/max/0/color', 'image/jpeg'),
+                    (jpg, 'pct:0,0,100,100/pct:100/0/default.jpg', 'image/jpeg'),
+                    (png, 'full/max/0/default.png', 'image/png')):
+                m = derive(srcfile, path, in_memory=True)
+                self.assertEqual(m.plan, ('quality',))
+                self.assertEqual(m.outfile, srcfile)
+                self.assertEqual(m.outbytes, None)
+                self.assertEqual(m.mime_type, mime_type)
+                self.assertTrue(os.path.exists(srcfile))
+            # Not passed through
+            for (srcfile, path, kwargs) in (
+                    (jpg, 'full/full/0/default.png', {}),
+                    (jpg, 'full/full/0/gray.jpg', {}),
+                    (jpg, 'full/full/180/default.jpg', {}),
+                    (jpg, 'full/max/0/default.jpg', {'max_width': 100}),
+                    ('testimages/robot_palette_320x200.gif', 'full/full/0/default.png', {})):
+                m = derive(srcfile, path, **kwargs)
+                self.assertNotEqual(m.outfile, srcfile)
+            # Copied to outfile
+            outfile = os.path.join(tmp, 'out.jpg')
+            m = derive(jpg, 'full/full/0/default.jpg', outfile=outfile)
+            with open(outfile, 'rb') as fh, open(jpg, 'rb') as src:
+                self.assertEqual(fh.read(), src.read())
+            # EXIF orientation
+            exif = Image.Exif()
+            exif[0x0112] = 6
+            rotated = os.path.join(tmp, 'rotated.jpg')
+            image.save(rotated, exif=exif)
+            m = derive(rotated, 'full/full/0/default.jpg')
+            self.assertNotEqual(m.outfile, rotated)
+            # ICC profile that needs conversion to sRGB
+            icc = os.path.join(tmp, 'icc.png')
+            image.save(icc, icc_profile=swapped_rgb_profile())
+            m = derive(icc, 'full/full/0/default.png')
+            self.assertEqual(m.outfile, icc)
+            m = derive(icc, 'full/full/0/default.png', icc_transforms=TransformCache())
+            self.assertNotEqual(m.outfile, icc)
+        finally:
+            shutil.rmtree(tmp)
+
+    def test24_jpegtran(self):
+        """Test lossless JPEG crop and rotation with jpegtran."""
+        def manipulator(srcfile, path, jpegtran='jpegtran'):
+            m = IIIFManipulatorPIL()
+            m.jpegtran = jpegtran
+            m.srcfile = srcfile
+            m.request = IIIFRequest(api_version='2.1')
+            m.request.parse_url('id/' + path)
+            m.do_first()
+            return m
+        # MCU sizes from sampling factors
+        self.assertEqual(manipulator('testimages/starfish.jpg', 'full/full/0/default.jpg').jpeg_mcu_size(), (8, 16))
+        self.assertEqual(manipulator('testimages/tetons.jpg', 'full/full/0/default.jpg').jpeg_mcu_size(), (16, 8))
+        self.assertEqual(manipulator('testimages/starfish2.jpg', 'full/full/0/default.jpg').jpeg_mcu_size(), (8, 8))
+        # Commands
+        src = 'testimages/starfish.jpg'
+        m = manipulator(src, '512,1024,512,512/512,/0/default.jpg')
+        self.assertEqual(m.jpegtran_commands(),
+                         [['jpegtran', '-copy', 'none', '-crop', '512x512+512+1024', src]])
+        m = manipulator(src, '2560,3584,512,512/full/90/default.jpg')
+        self.assertEqual(m.jpegtran_commands(),
+                         [['jpegtran', '-copy', 'none', '-crop', '440x416+2560+3584', src],
+                          ['jpegtran', '-copy', 'none', '-perfect', '-rotate', '90']])
+        m = manipulator(src, 'full/3000,/180/color.jpg')
+        self.assertEqual(m.jpegtran_commands(),
+                         [['jpegtran', '-copy', 'none', '-perfect', '-rotate', '180', src]])
+        for path in ('512,1032,512,512/512,/0/default.jpg',
+                     '512,1024,512,512/256,/0/default.jpg',
+                     '512,1024,512,512/512,/45/default.jpg',
+                     '512,1024,512,512/512,/0/gray.jpg',
+                     '512,1024,512,512/512,/0/default.png',
+                     'full/full/0/default.jpg'):
+            self.assertEqual(manipulator(src, path).jpegtran_commands(), None)
+        self.assertEqual(manipulator(src, '512,1024,512,512/512,/0/default.jpg',
+                                     jpegtran=None).jpegtran_commands(), None)
+        self.assertEqual(manipulator('testimages/test1.png', '0,0,16,16/full/0/default.png')
+                         .jpegtran_commands(), None)
+        # Fall back to PIL if jpegtran fails or is missing
+        for jpegtran in ('false', '/nonexistent/jpegtran'):
+            m = manipulator(src, '512,1024,512,512/512,/0/default.jpg', jpegtran=jpegtran)
+            m.in_memory = True
+            m.derive()
+            self.assertEqual(Image.open(io.BytesIO(m.outbytes)).size, (512, 512))
+            m.cleanup()
+
+    @unittest.skipUnless(which('jpegtran'), "jpegtran not available")
+    def test25_jpegtran_output(self):
+        """Test output from jpegtran is the same as the region of the source."""
+        src = 'testimages/starfish.jpg'
+        source = Image.open(src)
+        for (path, box, rot) in (('512,1024,512,512/512,/0/default.jpg', (512, 1024, 1024, 1536), None),
+                                 ('2560,3584,512,512/full/0/default.jpg', (2560, 3584, 3000, 4000), None),
+                                 ('512,1024,512,512/full/90/default.jpg', (512, 1024, 1024, 1536), Image.ROTATE_270)):
+            m = IIIFManipulatorPIL()
+            m.jpegtran = which('jpegtran')
+            m.in_memory = True
+            m.request = IIIFRequest(api_version='2.1')
+            m.request.parse_url('id/' + path)
+            m.derive(srcfile=src)
+            expected = source.crop(box)
+            if (rot is not None):
+                expected = expected.transpose(rot)
+            output = Image.open(io.BytesIO(m.outbytes))
+            self.assertEqual(output.size, expected.size)
+            # Same DCT coefficients decode to nearly the same pixels
+            diff = ImageStat.Stat(ImageChops.difference(output.convert('RGB'), expected)).mean
+            self.assertTrue(max(diff) < 2.0)
+            m.cleanup()
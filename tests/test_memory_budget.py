@@ -0,0 +1,50 @@
+"""Test code for iiif/memory_budget.py."""
+import threading
+import time
+import unittest
+
+from iiif.error import IIIFError
+from iiif.memory_budget import MemoryBudget
+
+
+class TestAll(unittest.TestCase):
+    """Tests."""
+
+    def test01_acquire_release(self):
+        """Acquire and release within budget."""
+        b = MemoryBudget(1000)
+        b.acquire(600)
+        b.acquire(400)
+        self.assertEqual(b.bytes, 1000)
+        b.release(600)
+        b.acquire(500)
+        self.assertEqual(b.bytes, 900)
+        b.release(500)
+        b.release(400)
+        self.assertEqual(b.bytes, 0)
+
+    def test02_reject(self):
+        """Reject request bigger than the budget or after timeout."""
+        b = MemoryBudget(1000, timeout=0.05, retry_after=7)
+        with self.assertRaises(IIIFError) as cm:
+            b.acquire(1001)
+        self.assertEqual(cm.exception.code, 503)
+        self.assertEqual(cm.exception.headers, {'Retry-After': '7'})
+        self.assertEqual(b.bytes, 0)
+        b.acquire(800)
+        start = time.time()
+        with self.assertRaises(IIIFError) as cm:
+            b.acquire(300)
+        self.assertTrue(time.time() - start >= 0.05)
+        self.assertEqual(cm.exception.code, 503)
+        self.assertEqual(b.bytes, 800)
+
+    def test03_wait(self):
+        """Wait for memory released by another thread."""
+        b = MemoryBudget(1000, timeout=5.0)
+        b.acquire(800)
+        t = threading.Timer(0.05, b.release, (800,))
+        t.start()
+        b.acquire(300)
+        t.join()
+        self.assertEqual(b.bytes, 300)
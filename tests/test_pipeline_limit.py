@@ -0,0 +1,51 @@
+"""Test code for iiif/pipeline_limit.py."""
+import threading
+import time
+import unittest
+
+from iiif.error import IIIFError
+from iiif.pipeline_limit import PipelineLimit
+
+
+class TestAll(unittest.TestCase):
+    """Tests."""
+
+    def test01_acquire_release(self):
+        """Acquire and release slots within limit."""
+        p = PipelineLimit(2)
+        p.acquire()
+        p.acquire()
+        self.assertEqual(p.running, 2)
+        p.release()
+        p.acquire()
+        self.assertEqual(p.running, 2)
+        p.release()
+        p.release()
+        self.assertEqual((p.running, p.waiting), (0, 0))
+
+    def test02_reject(self):
+        """Reject request after timeout or when queue is full."""
+        p = PipelineLimit(1, timeout=0.05, retry_after=7)
+        p.acquire()
+        start = time.time()
+        with self.assertRaises(IIIFError) as cm:
+            p.acquire()
+        self.assertTrue(time.time() - start >= 0.05)
+        self.assertEqual(cm.exception.code, 503)
+        self.assertEqual(cm.exception.headers, {'Retry-After': '7'})
+        self.assertEqual((p.running, p.waiting), (1, 0))
+        p = PipelineLimit(1, timeout=5.0, max_waiting=0)
+        p.acquire()
+        start = time.time()
+        self.assertRaises(IIIFError, p.acquire)
+        self.assertTrue(time.time() - start < 1.0)
+
+    def test03_wait(self):
+        """Wait for slot released by another thread."""
+        p = PipelineLimit(1, timeout=5.0)
+        p.acquire()
+        t = threading.Timer(0.05, p.release)
+        t.start()
+        p.acquire()
+        t.join()
+        self.assertEqual((p.running, p.waiting), (1, 0))
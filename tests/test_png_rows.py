@@ -0,0 +1,84 @@
+"""Test code for iiif/png_rows.py."""
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from PIL import Image
+
+import iiif.png_rows
+from iiif.manipulator_pil import REDUCE_MODES
+from iiif.png_rows import png_rawmode, png_region
+
+
+class TestAll(unittest.TestCase):
+    """Tests."""
+
+    def setUp(self):
+        """Make temporary directory and use small bands."""
+        self.tmp = tempfile.mkdtemp()
+        self.band_bytes = iiif.png_rows.BAND_BYTES
+        iiif.png_rows.BAND_BYTES = 1000
+
+    def tearDown(self):
+        """Remove temporary directory and restore band size."""
+        shutil.rmtree(self.tmp)
+        iiif.png_rows.BAND_BYTES = self.band_bytes
+
+    def png(self, image, name, **kwargs):
+        """Save image as PNG, return filename."""
+        filename = os.path.join(self.tmp, name + '.png')
+        image.save(filename, **kwargs)
+        return filename
+
+    def test01_png_rawmode(self):
+        """Raw modes of PNG images that can be read row-wise."""
+        src = Image.open('testimages/starfish_1500x2000.png')
+        self.assertEqual(png_rawmode(src), 'RGB')
+        self.assertEqual(png_rawmode(Image.open('testimages/starfish.jpg')), None)
+        bits = self.png(src.resize((30, 40)).convert('P', colors=16), 'p4', bits=4)
+        self.assertEqual(png_rawmode(Image.open(bits)), 'P;4')
+
+    def test02_png_region(self):
+        """Regions read row-wise match regions of the whole image."""
+        src = Image.open('testimages/starfish_1500x2000.png').resize((150, 200))
+        images = [('RGB', src),
+                  ('RGBA', src.convert('RGBA')),
+                  ('L', src.convert('L')),
+                  ('LA', src.convert('LA')),
+                  ('P', src.convert('P', palette=Image.ADAPTIVE)),
+                  ('1', src.convert('1')),
+                  ('I;16', src.convert('L').point(lambda i: i * 257).convert('I;16'))]
+        for (name, image) in images:
+            filename = self.png(image, name)
+            whole = Image.open(filename)
+            whole.load()
+            for box in [(0, 0, 150, 50), (10, 20, 60, 90), (100, 150, 150, 200),
+                        (33.5, 77.3, 120.7, 199.9)]:
+                for reduce in ((1, 2, 3) if (name in REDUCE_MODES) else (1,)):
+                    (region, offset) = png_region(filename, Image.open(filename), box, reduce)
+                    ibox = (offset[0] * reduce, offset[1] * reduce,
+                            min(150, int(-(-box[2] // 1))), min(200, int(-(-box[3] // 1))))
+                    expected = whole.crop(ibox)
+                    if (reduce > 1):
+                        expected = expected.reduce(reduce)
+                    self.assertEqual(region.mode, whole.mode)
+                    self.assertEqual(region.tobytes(), expected.tobytes(),
+                                     "%s %s reduce %d" % (name, box, reduce))
+                    if (name == 'P'):
+                        self.assertEqual(region.getpalette(), whole.getpalette())
+
+    def test03_png_region_none(self):
+        """Images and regions left for PIL to decode."""
+        filename = 'testimages/starfish_1500x2000.png'
+        self.assertEqual(png_region(filename, Image.open(filename), (0, 0, 1500, 2000)), None)
+        self.assertEqual(png_region(filename, Image.open(filename), (10, 10, 10, 20)), None)
+        jpeg = 'testimages/starfish.jpg'
+        self.assertEqual(png_region(jpeg, Image.open(jpeg), (0, 0, 10, 10)), None)
+        # Truncated image data
+        src = Image.open(filename).resize((150, 200))
+        data = open(self.png(src, 'full', compress_level=0), 'rb').read()
+        truncated = os.path.join(self.tmp, 'truncated.png')
+        with open(truncated, 'wb') as fh:
+            fh.write(data[:len(data) // 2])
+        self.assertEqual(png_region(truncated, Image.open(truncated), (0, 150, 50, 200)), None)
@@ -0,0 +1,99 @@
+"""Test code for iiif/pnm_cache.py."""
+import io
+import os
+import os.path
+import shutil
+import tempfile
+import time
+import unittest
+
+from PIL import Image
+
+from iiif.image_header import pnm_header
+from iiif.pnm_cache import PNMCache, write_rows
+
+
+class TestAll(unittest.TestCase):
+    """Tests."""
+
+    def setUp(self):
+        """Make temporary directory."""
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Remove temporary directory."""
+        shutil.rmtree(self.tmp)
+
+    def source(self, name, nbytes=100):
+        """Make source file name, return path."""
+        path = os.path.join(self.tmp, name)
+        with open(path, 'wb') as fh:
+            fh.write(b'x' * nbytes)
+        return path
+
+    def test01_get_put(self):
+        """Put and get PNM files."""
+        c = PNMCache(os.path.join(self.tmp, 'cache'), max_bytes=1000)
+        src = self.source('a.png')
+        self.assertEqual(c.get(src), None)
+        self.assertEqual(c.get(os.path.join(self.tmp, 'does_not_exist')), None)
+        self.assertEqual(c.put(os.path.join(self.tmp, 'does_not_exist'), None), None)
+        with c.put(src, lambda fh: fh.write(b'P5 1 1 255 \x00')) as fh:
+            self.assertEqual(fh.read(), b'P5 1 1 255 \x00')
+        with c.get(src) as fh:
+            self.assertEqual(fh.read(), b'P5 1 1 255 \x00')
+        self.assertEqual((c.hits, c.misses, len(c)), (1, 2, 1))
+        # Changed source is a miss
+        os.utime(src, (time.time() + 10, time.time() + 10))
+        self.assertEqual(c.get(src), None)
+        # Failed write leaves nothing in cache
+        self.assertRaises(ValueError, c.put, src, lambda fh: int('bad'))
+        self.assertEqual(len([n for n in os.listdir(c.directory) if n.endswith('.tmp')]), 0)
+        c.clear()
+        self.assertEqual(len(c), 0)
+
+    def test02_evict(self):
+        """Least recently used files are evicted."""
+        c = PNMCache(os.path.join(self.tmp, 'cache'), max_bytes=1000)
+        srcs = [self.source('%d.png' % (n)) for n in range(4)]
+        for (n, src) in enumerate(srcs):
+            c.put(src, lambda fh: fh.write(b'x' * 400)).close()
+            # Distinct use times
+            filename = c.filename(c.key(src))
+            os.utime(filename, (1000 + n, 1000 + n))
+            if (n == 1):
+                c.get(srcs[0]).close()
+        # srcs[0] used after srcs[1] so srcs[1] is evicted first
+        self.assertEqual(len(c), 2)
+        self.assertTrue(os.path.exists(c.filename(c.key(srcs[3]))))
+        self.assertFalse(os.path.exists(c.filename(c.key(srcs[1]))))
+        # File bigger than budget is kept until next put
+        c.put(srcs[1], lambda fh: fh.write(b'x' * 2000)).close()
+        self.assertEqual(len(c), 1)
+
+    def test03_write_rows(self):
+        """Write rows of raw PNM."""
+        image = Image.open('testimages/test1.png')
+        for mode in ('1', 'L', 'RGB', 'RGBA'):
+            src = image.convert(mode)
+            path = os.path.join(self.tmp, 'src.pnm')
+            if (mode == 'RGBA'):
+                # PAM
+                with open(path, 'wb') as fh:
+                    fh.write(b'P7\nWIDTH 175\nHEIGHT 131\nDEPTH 4\nMAXVAL 255\n'
+                             b'TUPLTYPE RGB_ALPHA\nENDHDR\n')
+                    fh.write(src.tobytes())
+            else:
+                src.save(path, format='PPM')
+            with open(path, 'rb') as fh:
+                header = pnm_header(fh.read(100))
+                out = io.BytesIO()
+                write_rows(fh, header, 30, 40, out)
+            data = out.getvalue()
+            expected = src.crop((0, 30, 175, 70))
+            if (mode == 'RGBA'):
+                h = pnm_header(data)
+                self.assertEqual((h['size'], h['tupltype']), ((175, 40), b'RGB_ALPHA'))
+                self.assertEqual(data[h['length']:], expected.tobytes())
+            else:
+                self.assertEqual(Image.open(io.BytesIO(data)).tobytes(), expected.tobytes())
@@ -0,0 +1,61 @@
+"""Test code for iiif/process_pool.py."""
+import io
+import unittest
+
+import mock
+from PIL import Image
+
+from iiif.error import IIIFError
+from iiif.manipulator import IIIFManipulator
+from iiif.manipulator_pil import IIIFManipulatorPIL
+from iiif.process_pool import ManipulatorPool, derive_in_worker, limit_memory
+from iiif.request import IIIFRequest
+
+
+class TestAll(unittest.TestCase):
+    """Tests."""
+
+    def test01_limit_memory(self):
+        """Memory limit for worker."""
+        with mock.patch('resource.setrlimit') as setrlimit:
+            limit_memory(None)
+            self.assertFalse(setrlimit.called)
+            limit_memory(1000)
+            setrlimit.assert_called_once_with(mock.ANY, (1000, 1000))
+
+    def test02_derive_in_worker(self):
+        """Derive in this process."""
+        r = IIIFRequest(api_version='2.1', identifier='a')
+        r.parse_url('full/100,/0/default.png')
+        (content, mime_type) = derive_in_worker(IIIFManipulatorPIL, 'testimages/test1.png', r)
+        self.assertEqual(mime_type, 'image/png')
+        self.assertEqual(Image.open(io.BytesIO(content)).size, (100, 75))
+        # Manipulator writing file
+        r.parse_url('full/full/0/default')
+        (content, mime_type) = derive_in_worker(IIIFManipulator, 'testimages/test1.png', r)
+        with open('testimages/test1.png', 'rb') as fh:
+            self.assertEqual(content, fh.read())
+        # Memory error
+        with mock.patch.object(IIIFManipulator, 'do_first', side_effect=MemoryError()):
+            self.assertRaises(IIIFError, derive_in_worker, IIIFManipulator,
+                              'testimages/test1.png', r)
+
+    def test03_pool(self):
+        """Derive in worker processes."""
+        pool = ManipulatorPool(processes=2, maxtasksperchild=2)
+        try:
+            self.assertEqual(pool.processes, 2)
+            r = IIIFRequest(api_version='2.1', identifier='a')
+            r.parse_url('full/100,/0/default.png')
+            for n in range(3):
+                (content, mime_type) = pool.derive(IIIFManipulatorPIL, 'testimages/test1.png', r)
+                self.assertEqual(mime_type, 'image/png')
+                self.assertEqual(Image.open(io.BytesIO(content)).size, (100, 75))
+            # IIIFError passed back
+            try:
+                pool.derive(IIIFManipulatorPIL, 'testimages/does_not_exist.png', r)
+                self.fail("no IIIFError")
+            except IIIFError as e:
+                self.assertIn('Failed to read image', str(e))
+        finally:
+            pool.close()
@@ -0,0 +1,89 @@
+"""Test code for iiif/stage_timer.py."""
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from testfixtures import LogCapture
+
+from iiif.manipulator import IIIFManipulator
+from iiif.manipulator_pil import IIIFManipulatorPIL
+from iiif.request import IIIFRequest
+from iiif.stage_timer import StageTimer, log_timings
+
+
+class TestAll(unittest.TestCase):
+    """Tests."""
+
+    def test01_sample(self):
+        """Sample rate."""
+        self.assertTrue(StageTimer().sample())
+        self.assertFalse(StageTimer(sample_rate=0.0).sample())
+        t = StageTimer(sample_rate=0.5)
+        n = sum([1 for j in range(1000) if t.sample()])
+        self.assertTrue(300 < n < 700)
+
+    def test02_measure(self):
+        """Measure one stage."""
+        class M(IIIFManipulator):
+            def do_a(self, x):
+                return x * 2
+
+            def do_c(self, x):
+                return int(x)
+
+            def image_bytes(self):
+                return 3000
+
+        m = M()
+        m.timings = []
+        t = StageTimer()
+        self.assertEqual(t.measure(m, 'do_a', 3), 6)
+        self.assertEqual(m.timings, [('do_a', m.timings[0][1], 3000)])
+        self.assertTrue(m.timings[0][1] >= 0.0)
+        # Exceptions propagate, stage still recorded
+        self.assertRaises(ValueError, t.measure, m, 'do_c', 'x')
+        self.assertEqual(m.timings[1][0], 'do_c')
+        # No memory
+        t = StageTimer(memory=False)
+        m.timings = []
+        t.measure(m, 'do_a', 1)
+        self.assertEqual(m.timings[0][2], None)
+        # Manipulator without image
+        m = IIIFManipulator()
+        m.timings = []
+        StageTimer().measure(m, 'do_last')
+        self.assertEqual(m.timings[0][2], None)
+
+    def test03_derive(self):
+        """Timings from derive() and sink."""
+        reported = []
+        m = IIIFManipulator()
+        m.stage_timer = StageTimer(sink=lambda m, t: reported.append(t))
+        r = IIIFRequest(api_version='2.1')
+        r.parse_url('a/full/full/0/default')
+        tmp = tempfile.mkdtemp()
+        outfile = os.path.join(tmp, 'out.jpg')
+        self.addCleanup(shutil.rmtree, tmp)
+        m.derive(srcfile='testimages/starfish.jpg', request=r, outfile=outfile)
+        self.assertEqual([s[0] for s in m.timings],
+                         ['do_first', 'do_quality', 'do_format', 'do_last'])
+        self.assertEqual(reported, [m.timings])
+        # Not sampled
+        m.stage_timer.sample_rate = 0.0
+        m.derive(outfile=outfile)
+        self.assertEqual(m.timings, None)
+        self.assertEqual(len(reported), 1)
+        # Image buffer bytes from PIL manipulator
+        m = IIIFManipulatorPIL()
+        m.stage_timer = StageTimer()
+        r = IIIFRequest(api_version='2.1')
+        r.parse_url('a/full/50,/0/gray')
+        m.derive(srcfile='testimages/starfish.jpg', request=r, outfile=outfile)
+        sizes = dict([(s[0], s[2]) for s in m.timings])
+        self.assertEqual(sizes['do_size'], 50 * m.image.size[1] * 4)
+        self.assertEqual(sizes['do_quality'], 50 * m.image.size[1])
+        # Logging sink
+        with LogCapture() as lc:
+            log_timings(m, [('do_first', 0.001, 2048), ('do_last', 0.002, None)])
+            self.assertIn('do_first=1.00ms/2kB do_last=2.00ms', str(lc))
@@ -0,0 +1,79 @@
+"""Test code for iiif/strips.py."""
+import unittest
+
+from PIL import Image, ImageChops
+
+from iiif.strips import (strip_rows, resize_strip_rows, parallel_convert,
+                         parallel_reduce, parallel_resize, parallel_transpose,
+                         thread_pool)
+
+
+class TestAll(unittest.TestCase):
+    """Tests."""
+
+    def setUp(self):
+        """Load test image."""
+        self.image = Image.open('testimages/starfish_1500x2000.png').convert('RGB')
+        self.image.load()
+
+    def assertSameImage(self, a, b):
+        """Check images a and b are identical."""
+        self.assertEqual(a.mode, b.mode)
+        self.assertEqual(a.size, b.size)
+        self.assertEqual(ImageChops.difference(a, b).getbbox(), None)
+
+    def test01_strip_rows(self):
+        """Row boundaries."""
+        self.assertEqual(strip_rows(100, 4), [0, 25, 50, 75, 100])
+        self.assertEqual(strip_rows(10, 3), [0, 3, 6, 10])
+        self.assertEqual(strip_rows(10, 3, align=4), [0, 4, 10])
+        self.assertEqual(strip_rows(10, 3, align=6), [0, 10])
+        self.assertEqual(strip_rows(1, 4), [0, 1])
+        # 2000 -> 800 is 5/2 so strips start at multiples of 2 rows
+        self.assertEqual(resize_strip_rows((0, 0, 1500, 2000), (600, 800), 3),
+                         [0, 266, 532, 800])
+        self.assertEqual(resize_strip_rows((0, 0, 1500, 2000), (700, 933), 3),
+                         [0, 933])
+
+    def test02_thread_pool(self):
+        """Shared thread pool."""
+        self.assertTrue(thread_pool(2) is thread_pool(3))
+
+    def test03_parallel_resize(self):
+        """Resize in strips."""
+        for (size, box) in (((600, 800), None),
+                            ((750, 1000), (0, 0, 1500, 2000)),
+                            ((640, 400), (0.5, 0, 1500, 1000)),
+                            ((1000, 1000), (100, 100, 1500, 1500)),
+                            ((2250, 3000), None)):
+            for gap in (None, 3.0):
+                image = parallel_resize(self.image, size, box, gap, 4, 4)
+                self.assertSameImage(image, self.image.resize(size, box=box, reducing_gap=gap))
+        # Cannot split
+        self.assertEqual(parallel_resize(self.image, (700, 933), None, None, 4, 4), None)
+        self.assertEqual(parallel_resize(self.image, (750, 1000), (0, 0.5, 1500, 2000), None, 4, 4), None)
+        self.assertEqual(parallel_resize(self.image, (150, 200), None, 3.0, 4, 4), None)
+
+    def test04_parallel_reduce(self):
+        """Reduce in strips."""
+        for factors in ((2, 2), (3, 3), (4, 3)):
+            for box in (None, (0, 1, 1500, 1999), (10, 20, 1001, 1003)):
+                image = parallel_reduce(self.image, factors, box, 3, 3)
+                self.assertSameImage(image, self.image.reduce(factors, box=box))
+
+    def test05_parallel_convert(self):
+        """Convert in strips."""
+        for mode in ('L', 'RGBA', 'CMYK'):
+            self.assertSameImage(parallel_convert(self.image, mode, 4, 4),
+                                 self.image.convert(mode))
+        p = self.image.convert('P')
+        self.assertSameImage(parallel_convert(p, 'RGB', 4, 4), p.convert('RGB'))
+
+    def test06_parallel_transpose(self):
+        """Transpose in strips."""
+        image = self.image.crop((0, 0, 1500, 1999))
+        for method in (Image.FLIP_LEFT_RIGHT, Image.FLIP_TOP_BOTTOM,
+                       Image.ROTATE_90, Image.ROTATE_180, Image.ROTATE_270,
+                       Image.TRANSPOSE, Image.TRANSVERSE):
+            self.assertSameImage(parallel_transpose(image, method, 3, 3),
+                                 image.transpose(method))
@@ -0,0 +1,136 @@
+"""Test code for iiif/tiff_tiles.py."""
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from PIL import Image, ImageChops, ImageStat
+
+from iiif.tiff_tiles import tiff_level, tiff_tile_layout, tiff_region
+from .testlib.tiff import write_tiled_tiff, pyramid
+
+
+class TestAll(unittest.TestCase):
+    """Tests."""
+
+    def setUp(self):
+        """Make temp dir and test image."""
+        self.tmp = tempfile.mkdtemp()
+        self.image = Image.open('testimages/67352ccc-d1b0-11e1-89ae-279075081939.png').convert('RGB')
+
+    def tearDown(self):
+        """Remove temp dir."""
+        shutil.rmtree(self.tmp)
+
+    def test01_tiff_level(self):
+        """Select resolution level."""
+        f = os.path.join(self.tmp, 'p.tif')
+        write_tiled_tiff(f, pyramid(self.image, 3))
+        im = Image.open(f)
+        self.assertEqual(im.size, (1000, 1000))
+        self.assertIs(tiff_level(im, 1000, 1000), im)
+        self.assertEqual(im.size, (1000, 1000))
+        self.assertEqual(tiff_level(im, 600, 500).size, (1000, 1000))
+        self.assertEqual(tiff_level(im, 500, 500).size, (500, 500))
+        self.assertEqual(tiff_level(Image.open(f), 100, 10).size, (250, 250))
+        # Single page, no levels
+        f = os.path.join(self.tmp, 's.tif')
+        self.image.save(f)
+        self.assertEqual(tiff_level(Image.open(f), 10, 10).size, (1000, 1000))
+
+    def test01_tiff_level_subifds(self):
+        """Select resolution level from SubIFDs without loading it."""
+        f = os.path.join(self.tmp, 'p.tif')
+        write_tiled_tiff(f, pyramid(self.image, 3), subifds=True)
+        im = Image.open(f)
+        self.assertEqual(getattr(im, 'n_frames', 1), 1)
+        self.assertIs(tiff_level(im, 600, 500), im)
+        level = tiff_level(im, 500, 500)
+        self.assertEqual(level.size, (500, 500))
+        self.assertIsNot(level, im)
+        # Only the header has been read
+        self.assertTrue(level.tile)
+        self.assertEqual(tiff_level(Image.open(f), 100, 10).size, (250, 250))
+        level.load()
+        self.assertEqual(level.size, (500, 500))
+
+    def test01_tiff_level_multipage(self):
+        """Pages not marked as reduced resolution are not levels."""
+        f = os.path.join(self.tmp, 'm.tif')
+        write_tiled_tiff(f, pyramid(self.image, 3), reduced=False)
+        im = Image.open(f)
+        self.assertEqual(im.n_frames, 3)
+        self.assertIs(tiff_level(im, 100, 100), im)
+        self.assertEqual(im.tell(), 0)
+        self.assertEqual(im.size, (1000, 1000))
+        write_tiled_tiff(f, pyramid(self.image, 3), reduced=False, subifds=True)
+        im = Image.open(f)
+        self.assertIs(tiff_level(im, 100, 100), im)
+
+    def test01_tiff_level_mode(self):
+        """Reduced resolution pages of another mode are not levels."""
+        f = os.path.join(self.tmp, 'k.tif')
+        (full, half, quarter) = pyramid(self.image, 3)
+        # Transparency mask (NewSubfileType 5) at half size
+        images = [full, half.convert('L'), quarter]
+        for subifds in (False, True):
+            write_tiled_tiff(f, images, subifds=subifds, subfile_types=[5, 1])
+            im = Image.open(f)
+            self.assertEqual(tiff_level(im, 400, 400).mode, 'RGB')
+            self.assertEqual(tiff_level(im, 400, 400).size, (1000, 1000))
+            self.assertEqual(tiff_level(im, 200, 200).size, (250, 250))
+
+    def test02_tiff_tile_layout(self):
+        """Layout of tiles or strips."""
+        f = os.path.join(self.tmp, 't.tif')
+        write_tiled_tiff(f, [self.image], tile=128, compression=8)
+        (tw, th, offsets, counts, decoder) = tiff_tile_layout(Image.open(f))
+        self.assertEqual((tw, th, decoder), (128, 128, 'deflate'))
+        self.assertEqual(len(offsets), 64)
+        self.assertEqual(len(counts), 64)
+        f = os.path.join(self.tmp, 's.tif')
+        self.image.save(f, compression='packbits')
+        (tw, th, offsets, counts, decoder) = tiff_tile_layout(Image.open(f))
+        self.assertEqual((tw, decoder), (1000, 'packbits'))
+        # Not 8 bits per sample
+        self.image.convert('1').save(f)
+        self.assertEqual(tiff_tile_layout(Image.open(f)), None)
+
+    def test03_tiff_region(self):
+        """Read region tiles."""
+        box = (100.5, 300, 250, 333)
+        for (name, compression) in (('raw', 1), ('deflate', 8), ('jpeg', 7)):
+            f = os.path.join(self.tmp, name + '.tif')
+            write_tiled_tiff(f, [self.image], compression=compression)
+            (region, offset) = tiff_region(f, Image.open(f), box)
+            self.assertEqual(offset, (64, 256))
+            self.assertEqual(region.size, (192, 128))
+            expected = self.image.crop((64, 256, 256, 384))
+            diff = ImageChops.difference(region, expected)
+            if (compression == 7):
+                self.assertLess(max(ImageStat.Stat(diff).mean), 3.0)
+            else:
+                self.assertEqual(diff.getbbox(), None)
+        # Partial tiles at edge
+        (region, offset) = tiff_region(f, Image.open(f), (950, 990, 1000, 1000))
+        self.assertEqual(offset, (896, 960))
+        self.assertEqual(region.size, (104, 40))
+        # Whole image needed
+        self.assertEqual(tiff_region(f, Image.open(f), (0, 0, 1000, 1000)), None)
+        # Strips
+        for compression in ('raw', 'packbits', 'tiff_deflate'):
+            f = os.path.join(self.tmp, compression + '.tif')
+            self.image.save(f, compression=compression)
+            r = tiff_region(f, Image.open(f), (10, 990, 20, 1000))
+            if (compression == 'raw'):
+                # Single strip
+                self.assertEqual(r, None)
+            else:
+                (region, offset) = r
+                rows = Image.open(f).tag_v2[278]
+                oy = (990 // rows) * rows
+                self.assertEqual(offset, (0, oy))
+                self.assertEqual(region.size, (1000, 1000 - oy))
+                diff = ImageChops.difference(region, self.image.crop((0, oy, 1000, 1000)))
+                self.assertEqual(diff.getbbox(), None)
@@ -0,0 +1,24 @@
+"""Check the vectorized pixels() method of pixel generators."""
+
+try:
+    import numpy as np
+except ImportError:  # numpy not installed
+    np = None
+
+
+def check_pixels(test, gen, xs, ys):
+    """Check that gen.pixels() matches gen.pixel() on a grid of points.
+
+    The grid has x and y coordinates from np.arange() of the (start, stop,
+    step) tuples xs and ys. Points where pixel() gives None must
+    have the background color. Failures are reported with the assertions
+    of the unittest.TestCase test.
+    """
+    (x, y) = np.meshgrid(np.arange(*xs), np.arange(*ys))
+    colors = gen.pixels(x, y)
+    test.assertEqual(colors.shape, x.shape + (3,))
+    for (j, i) in np.ndindex(x.shape):
+        color = gen.pixel(int(x[j, i]), int(y[j, i]))
+        if (color is None):
+            color = gen.background_color
+        test.assertEqual(tuple(colors[j, i]), color)
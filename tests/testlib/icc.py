@@ -0,0 +1,31 @@
+"""Make ICC profiles for tests.
+
+PIL can create only sRGB, LAB and XYZ profiles so this makes an RGB
+profile that is not sRGB by editing the tags of the sRGB profile.
+"""
+import struct
+
+from PIL import ImageCms
+
+
+def swapped_rgb_profile():
+    """Make ICC profile bytes for sRGB with the red and blue primaries swapped.
+
+    The profile description is changed from "sRGB built-in" to "Test
+    built-in" so that it is not recognized as sRGB. Transforming an
+    image with this profile to sRGB swaps the red and blue channels.
+    """
+    data = bytearray(ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB')).tobytes())
+    tags = {}
+    (count,) = struct.unpack('>I', bytes(data[128:132]))
+    for n in range(count):
+        (sig, offset, size) = struct.unpack('>4sII', bytes(data[132 + 12 * n:144 + 12 * n]))
+        tags[sig] = (offset, size)
+    (r, size) = tags[b'rXYZ']
+    (b, size) = tags[b'bXYZ']
+    (data[r:r + size], data[b:b + size]) = (data[b:b + size], data[r:r + size])
+    name = 'sRGB'.encode('utf-16-be')
+    (offset, size) = tags[b'desc']
+    desc = data[offset:offset + size].replace(name, 'Test'.encode('utf-16-be'))
+    data[offset:offset + size] = desc
+    return bytes(data)
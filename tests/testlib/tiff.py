@@ -0,0 +1,117 @@
+"""Write tiled and pyramidal TIFF test images.
+
+PIL can write only stripped, single resolution TIFF images so this
+writes the simple tiled TIFF structure directly.
+"""
+import io
+import struct
+import zlib
+
+from PIL import Image
+
+
+def tile_data(tile, compression):
+    """Encode one tile image with given compression."""
+    if (compression == 7):
+        buf = io.BytesIO()
+        tile.save(buf, format='jpeg', quality=95)
+        return buf.getvalue()
+    data = tile.tobytes()
+    if (compression == 8):
+        data = zlib.compress(data)
+    return data
+
+
+def write_image(out, im, tile, compression, extra_entries):
+    """Append tiles and IFD for RGB or L PIL image im to out, return IFD offset.
+
+    The IFD has the given extra entries and a zero next IFD offset.
+    """
+    (w, h) = im.size
+    tiles = []
+    for ty in range(0, h, tile):
+        for tx in range(0, w, tile):
+            t = Image.new(im.mode, (tile, tile))
+            t.paste(im.crop((tx, ty, min(tx + tile, w), min(ty + tile, h))))
+            tiles.append(tile_data(t, compression))
+    offsets = []
+    for data in tiles:
+        offsets.append(len(out))
+        out += data
+        if (len(out) % 2):
+            out += b'\x00'
+    offsets_ptr = len(out)
+    out += struct.pack('<%dI' % len(tiles), *offsets)
+    counts_ptr = len(out)
+    out += struct.pack('<%dI' % len(tiles), *[len(t) for t in tiles])
+    if (im.mode == 'L'):
+        entries = [(258, 3, 1, 8), (262, 3, 1, 1), (277, 3, 1, 1)]
+    else:
+        bits_ptr = len(out)
+        out += struct.pack('<3H', 8, 8, 8)
+        photometric = (6 if compression == 7 else 2)
+        entries = [(258, 3, 3, bits_ptr), (262, 3, 1, photometric),
+                   (277, 3, 1, 3)]
+    entries += [(256, 4, 1, w), (257, 4, 1, h),
+                (259, 3, 1, compression), (284, 3, 1, 1),
+                (322, 3, 1, tile), (323, 3, 1, tile),
+                (324, 4, len(tiles), offsets_ptr if len(tiles) > 1 else offsets[0]),
+                (325, 4, len(tiles), counts_ptr if len(tiles) > 1 else len(tiles[0]))]
+    ifd = len(out)
+    entries = sorted(entries + extra_entries)
+    out += struct.pack('<H', len(entries))
+    for (tag, typ, count, value) in entries:
+        if (typ == 3 and count == 1):
+            out += struct.pack('<HHIHH', tag, typ, count, value, 0)
+        else:
+            out += struct.pack('<HHII', tag, typ, count, value)
+    out += b'\x00\x00\x00\x00'
+    return ifd
+
+
+def write_tiled_tiff(filename, images, tile=64, compression=1,
+                     reduced=True, subifds=False, subfile_types=None):
+    """Write RGB PIL images as the pages of a tiled TIFF file.
+
+    Images may be RGB or L. Compression may be 1 (none), 8 (deflate) or
+    7 (JPEG, with each tile a complete JPEG stream and YCbCr photometric
+    interpretation for RGB). If reduced then the images after the first
+    are marked as reduced resolution images with NewSubfileType 1, or
+    with the values in the list subfile_types if given. If subifds then
+    they are written as SubIFDs of the first page rather than as further
+    pages.
+    """
+    out = bytearray(b'II*\x00\x00\x00\x00\x00')
+    if (not reduced):
+        subfiles = [[]] * len(images)
+    else:
+        subfiles = [[]] + [[(254, 4, 1, t)]
+                           for t in (subfile_types or [1] * (len(images) - 1))]
+    if (subifds):
+        children = [write_image(out, im, tile, compression, subfiles[n])
+                    for (n, im) in enumerate(images) if n > 0]
+        entries = []
+        if (children):
+            children_ptr = len(out)
+            out += struct.pack('<%dI' % len(children), *children)
+            entries = [(330, 4, len(children),
+                        children_ptr if len(children) > 1 else children[0])]
+        ifd = write_image(out, images[0], tile, compression, entries)
+        struct.pack_into('<I', out, 4, ifd)
+    else:
+        next_ifd_ptr = 4
+        for (n, im) in enumerate(images):
+            ifd = write_image(out, im, tile, compression, subfiles[n])
+            struct.pack_into('<I', out, next_ifd_ptr, ifd)
+            next_ifd_ptr = len(out) - 4
+    with open(filename, 'wb') as fh:
+        fh.write(out)
+
+
+def pyramid(image, levels):
+    """Make list of image and levels-1 successively halved copies."""
+    images = [image]
+    for n in range(1, levels):
+        (w, h) = images[-1].size
+        images.append(image.resize(((w + 1) // 2, (h + 1) // 2)))
+    return images